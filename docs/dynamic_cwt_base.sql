@@ -89,6 +89,9 @@ CREATE OR REPLACE DYNAMIC TABLE DEV__MODELLING.CANCER__CWT_PATHWAY.CWT_BASE (
     IS_EVENT_FDS BOOLEAN, --Flag if the record includes the 28D Pathway
     IS_EVENT_TREATMENTSTARTDATE BOOLEAN, --Flag if the record includes the 62D Pathway
 
+    --Metric Eligibility
+    CWT_ELIGIBILITY NUMBER, --Bit for each standard the record is valid for (See utils/util_eligibility.py)
+
     --Metadata
     META_SUBMISSIONID NUMBER --Numeric ID for the upload batch in the source
 
@@ -99,20 +102,6 @@ REFRESH_MODE = FULL
 INITIALIZE = ON_CREATE
 WAREHOUSE = NCL_ANALYTICS_XS
 AS
-WITH org_par AS (
-    SELECT 
-        child."Organisation_Code" AS "ORG_SITE", 
-        CASE 
-            WHEN child."SK_OrganisationTypeID" = 41
-            THEN child."Organisation_Code"
-            ELSE par."Organisation_Code" 
-        END AS "ORG_TRUST"
-    FROM "Dictionary"."dbo"."Organisation" child
-
-    LEFT JOIN "Dictionary"."dbo"."Organisation" par 
-    ON child."SK_OrganisationID_ParentOrg" = par."SK_OrganisationID"
-)
-
 SELECT
     --Entry identifiers
     cwt.SK AS SK_CWT_ID,
@@ -201,36 +190,101 @@ SELECT
         cwt."Organisation_Code_CCG_of_TSD" = '93C',
         FALSE
     ) AS GEO_TRUST,
-    org_fs.ORG_TRUST IN ('RAL', 'RAN', 'RAP', 'RKE', 'RRV', 'RP4', 'RP6') AS GEO_TRUST_DATEFIRSTSEEN,
-    org_fdp.ORG_TRUST IN ('RAL', 'RAN', 'RAP', 'RKE', 'RRV', 'RP4', 'RP6') AS GEO_TRUST_FDS,
-    org_at.ORG_TRUST IN ('RAL', 'RAN', 'RAP', 'RKE', 'RRV', 'RP4', 'RP6') AS GEO_TRUST_TREATMENTSTARTDATE,
-    cwt.ACCOUNTABLEINVESTIGATINGPROVIDER IN ('RAL', 'RAN', 'RAP', 'RKE', 'RRV', 'RP4', 'RP6') AS GEO_TRUST_ACCOUNTABLEINVESTIGATING,
-    org_cu.ORG_TRUST IN ('RAL', 'RAN', 'RAP', 'RKE', 'RRV', 'RP4', 'RP6') AS GEO_TRUST_CONSULTANTUPGRADE,
+    org_fs.IS_NCL AS GEO_TRUST_DATEFIRSTSEEN,
+    org_fdp.IS_NCL AS GEO_TRUST_FDS,
+    org_at.IS_NCL AS GEO_TRUST_TREATMENTSTARTDATE,
+    cwt.ACCOUNTABLEINVESTIGATINGPROVIDER IN (
+        SELECT ORG_TRUST
+        FROM DEV__MODELLING.CANCER__CWT_PATHWAY.CWT_ORGANISATION
+        WHERE IS_NCL
+    ) AS GEO_TRUST_ACCOUNTABLEINVESTIGATING,
+    org_cu.IS_NCL AS GEO_TRUST_CONSULTANTUPGRADE,
     --Event
     cwt.DATEFIRSTSEEN IS NOT NULL AS EVENT_DATEFIRSTSEEN,
     cwt.CANCERTREATMENTPERIODSTARTDATE IS NOT NULL AS EVENT_CANCERTREATMENTPERIOD,
     cwt.CANCERFASTERDIAGNOSISPATHWAYENDDATE IS NOT NULL AS EVENT_FDS,
     cwt.TREATMENTSTARTDATECANCER IS NOT NULL AS EVENT_TREATMENTSTARTDATE,
+    --Metric Eligibility
+    --(A Null filter leaves the bit unset, as a WHERE on the filter would)
+    ---2WW---
+    CASE WHEN
+        cwt.PRIORITYTYPECODE = 3 AND
+        cwt.SOURCEOFREFERRALFOROUTPATIENT != 17 AND
+        cwt.CRTPDATE IS NOT NULL AND
+        cwt.DATEFIRSTSEEN IS NOT NULL
+    THEN 1 ELSE 0 END +
+    ---FDS (Reason 03 depends on the FDS value)---
+    CASE WHEN
+        (
+            cwt.FDPENDREASON IN ('01', '02', '04') OR
+            (
+                cwt.FDPENDREASON = '03' AND
+                cwt.FDPEXCLUSIONREASON = '01' AND
+                DATEDIFF(day, cwt.CRTPDATE,
+                    CASE
+                        WHEN cwt.CANCERTREATMENTPERIODSTARTDATE <
+                            cwt.CANCERFASTERDIAGNOSISPATHWAYENDDATE
+                        THEN cwt.CANCERTREATMENTPERIODSTARTDATE
+                        ELSE cwt.CANCERFASTERDIAGNOSISPATHWAYENDDATE
+                    END
+                ) - COALESCE(cwt.WAITINGTIMEADJUSTMENTFIRSTSEEN, 0) > 28
+            )
+        ) AND
+        cwt.CRTPDATE IS NOT NULL AND
+        cwt.CANCERFASTERDIAGNOSISPATHWAYENDDATE IS NOT NULL
+    THEN 2 ELSE 0 END +
+    ---31 Day (First Treatment)---
+    CASE WHEN
+        cwt.CANCERTREATMENTEVENTTYPE IN ('01', '07', '12') AND
+        cwt.CANCERTREATMENTMODALITY != 98 AND
+        cwt.PRIMARYDIAGNOSISICD IS NOT NULL AND
+        cwt.CANCERTREATMENTPERIODSTARTDATE IS NOT NULL AND
+        cwt.TREATMENTSTARTDATECANCER IS NOT NULL
+    THEN 4 ELSE 0 END +
+    ---31 Day (Subsequent Treatments)---
+    CASE WHEN
+        cwt.CANCERTREATMENTEVENTTYPE IN
+            ('02', '03', '04', '05', '06', '08', '09', '10', '11') AND
+        cwt.CANCERTREATMENTMODALITY != 98 AND
+        cwt.PRIMARYDIAGNOSISICD IS NOT NULL AND
+        cwt.CANCERTREATMENTPERIODSTARTDATE IS NOT NULL AND
+        cwt.TREATMENTSTARTDATECANCER IS NOT NULL
+    THEN 8 ELSE 0 END +
+    ---62 Day (31 Day First Treatment with a First Seen Org or an Upgrade)---
+    CASE WHEN
+        cwt.CANCERTREATMENTEVENTTYPE IN ('01', '07', '12') AND
+        cwt.CANCERTREATMENTMODALITY != 98 AND
+        cwt.PRIMARYDIAGNOSISICD IS NOT NULL AND
+        cwt.CANCERTREATMENTPERIODSTARTDATE IS NOT NULL AND
+        cwt.TREATMENTSTARTDATECANCER IS NOT NULL AND
+        (
+            org_fs.ORG_TRUST IS NOT NULL OR
+            (
+                cwt.SOURCEOFREFERRALFOROUTPATIENT != 17 AND
+                cwt.CONSULTANTUPGRADEDATE IS NOT NULL
+            )
+        )
+    THEN 16 ELSE 0 END AS CWT_ELIGIBILITY,
     --Metadata
     cwt."UniqSubmissionID" AS META_SUBMISSIONID
 
 FROM DATA_LAKE.CWT."CWT001Data" cwt
 
---Organisation Site and Trust Mapping
+--Organisation Site and Trust Mapping (See dynamic_cwt_organisation.sql)
 ---Consultant Upgrades---
-LEFT JOIN org_par org_cu
+LEFT JOIN DEV__MODELLING.CANCER__CWT_PATHWAY.CWT_ORGANISATION org_cu
 ON org_cu.ORG_SITE = cwt.ORGCONSUPGRADE
 ---First Seen---
-LEFT JOIN org_par org_fs
+LEFT JOIN DEV__MODELLING.CANCER__CWT_PATHWAY.CWT_ORGANISATION org_fs
 ON org_fs.ORG_SITE = cwt.ORGFIRSTSEEN
 ---Faster Diagnosis Standard---
-LEFT JOIN org_par org_fdp
+LEFT JOIN DEV__MODELLING.CANCER__CWT_PATHWAY.CWT_ORGANISATION org_fdp
 ON org_fdp.ORG_SITE = cwt.ORGFDPEND
 ---Pathway Identifier---
-LEFT JOIN org_par org_pi
+LEFT JOIN DEV__MODELLING.CANCER__CWT_PATHWAY.CWT_ORGANISATION org_pi
 ON org_pi.ORG_SITE = cwt.ORGPPI
 ---Accountable Treating---
-LEFT JOIN org_par org_at
+LEFT JOIN DEV__MODELLING.CANCER__CWT_PATHWAY.CWT_ORGANISATION org_at
 ON org_at.ORG_SITE = cwt.ORGTREATSTART
 
 --Reference Information Joins
@@ -0,0 +1,39 @@
+CREATE OR REPLACE DYNAMIC TABLE DEV__MODELLING.CANCER__CWT_PATHWAY.CWT_LATEST (
+
+    --Description: Latest version of each record in CWT_BASE (Used by --latest-only builds)
+    --Author: Jake Kealey
+
+    RECORD_ID VARCHAR,
+    META_SUBMISSIONID NUMBER, --Latest submission with the record
+    SK_CWT_ID VARCHAR --Largest SK_CWT_ID of the record in that submission
+)
+COMMENT="Dynamic table index of the latest version of each record."
+--Refreshed whenever a dynamic table built from it refreshes, from the same
+--version of CWT_BASE, so a scheduled refresh of a metric table never reads an
+--index older than the base
+TARGET_LAG = DOWNSTREAM
+--CWT_BASE is a FULL refresh dynamic table (Rewritten on every refresh) so
+--the index is rebuilt in full too, with grouped maximums joined back
+--instead of a window function over the base
+REFRESH_MODE = FULL
+INITIALIZE = ON_CREATE
+WAREHOUSE = NCL_ANALYTICS_XS
+AS
+WITH latest AS (
+    SELECT RECORD_ID, MAX(META_SUBMISSIONID) AS LATEST_SUBMISSIONID
+    FROM DEV__MODELLING.CANCER__CWT_PATHWAY.CWT_BASE
+    GROUP BY RECORD_ID
+)
+
+SELECT
+    base.RECORD_ID,
+    base.META_SUBMISSIONID,
+    MAX(base.SK_CWT_ID) AS SK_CWT_ID
+
+FROM DEV__MODELLING.CANCER__CWT_PATHWAY.CWT_BASE base
+
+INNER JOIN latest
+ON latest.RECORD_ID = base.RECORD_ID
+AND latest.LATEST_SUBMISSIONID = base.META_SUBMISSIONID
+
+GROUP BY base.RECORD_ID, base.META_SUBMISSIONID
@@ -0,0 +1,53 @@
+CREATE OR REPLACE DYNAMIC TABLE DEV__MODELLING.CANCER__CWT_PATHWAY.CWT_ORGANISATION (
+
+    --Description: Site to Trust mapping used to resolve the CWT organisations
+    --Author: Jake Kealey
+
+    ORG_SITE VARCHAR, --Organisation code as submitted (Site or Trust)
+    ORG_TRUST VARCHAR, --Trust of the organisation (Itself for a Trust)
+    IS_NCL BOOLEAN, --Flag if the Trust is a NCL Trust
+    ORG_VERSION NUMBER --Hash of the mapping, changes when any row (or NCL flag) changes
+
+)
+COMMENT="Dynamic table to map organisation codes to Trusts and the NCL flag."
+TARGET_LAG = "24 hours"
+REFRESH_MODE = FULL
+INITIALIZE = ON_CREATE
+WAREHOUSE = NCL_ANALYTICS_XS
+AS
+WITH org_par AS (
+    SELECT
+        child."Organisation_Code" AS "ORG_SITE",
+        CASE
+            WHEN child."SK_OrganisationTypeID" = 41
+            THEN child."Organisation_Code"
+            ELSE par."Organisation_Code"
+        END AS "ORG_TRUST"
+    FROM "Dictionary"."dbo"."Organisation" child
+
+    LEFT JOIN "Dictionary"."dbo"."Organisation" par
+    ON child."SK_OrganisationID_ParentOrg" = par."SK_OrganisationID"
+),
+
+org_ncl AS (
+    SELECT
+        ORG_SITE,
+        ORG_TRUST,
+        --The only place the NCL Trust list is defined
+        ORG_TRUST IN ('RAL', 'RAN', 'RAP', 'RKE', 'RRV', 'RP4', 'RP6') AS IS_NCL
+    FROM org_par
+)
+
+SELECT
+    org_ncl.ORG_SITE,
+    org_ncl.ORG_TRUST,
+    org_ncl.IS_NCL,
+    ver.ORG_VERSION
+
+FROM org_ncl
+
+--The flag is in the hash so editing the NCL Trust list changes the version
+CROSS JOIN (
+    SELECT HASH_AGG(ORG_SITE, ORG_TRUST, IS_NCL) AS ORG_VERSION
+    FROM org_ncl
+) ver
@@ -12,7 +12,8 @@ CREATE OR REPLACE DYNAMIC TABLE DEV__MODELLING.CANCER__CWT_PATHWAY.CWT_PERFORMAN
 	PER_METRIC VARCHAR,
 	PER_VALUE NUMBER,
 	PER_NUMERATOR FLOAT,
-	PER_DENOMINATOR FLOAT
+	PER_DENOMINATOR FLOAT,
+	PATHWAY VARCHAR --Pathway of the base row (See utils/util_pathway.py)
 )
 COMMENT="Dynamic table containing performance metrics for CWT data."
 TARGET_LAG = "24 hours"
@@ -30,6 +31,8 @@ WITH org_par AS (
 )
 
 --Combine Performance metrics into 1 table
+--Each metric table carries the PATHWAY of its base row so Unknown pathways
+--are filtered without joining CWT_PATHWAY (RECORD_ID is not unique there)
 SELECT per_base.*
 FROM (
 	--2WW
@@ -45,10 +48,7 @@ FROM (
 	FROM DEV__MODELLING.CANCER__CWT_PATHWAY.CWT_PERFORMANCE_62DAY
 ) per_base
 
-LEFT JOIN DEV__MODELLING.CANCER__CWT_PATHWAY.CWT_PATHWAY pw
-ON per_base.RECORD_ID = pw.RECORD_ID
-
-WHERE pw.PATHWAY != 'Unknown'
+WHERE per_base.PATHWAY != 'Unknown'
 
 UNION ALL
 --Handle 31 Day seperately since the records are not dependant on standard pathway options
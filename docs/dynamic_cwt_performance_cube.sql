@@ -0,0 +1,67 @@
+CREATE OR REPLACE DYNAMIC TABLE DEV__MODELLING.CANCER__CWT_PATHWAY.CWT_PERFORMANCE_CUBE (
+
+    --Description: Pre-aggregated performance for reporting (CWT Pathway standard)
+    --Author: Jake Kealey
+
+    PER_DATE_YEAR NUMBER,
+    PER_DATE_MONTH NUMBER,
+    PER_ORG_TRUST VARCHAR, --Null for the NCL and All levels
+    PER_ORG_SITE VARCHAR, --Null for the Trust, NCL and All levels
+    PER_ORG_NCL BOOLEAN, --Null for the All level
+    PER_METRIC VARCHAR,
+    PATHWAY VARCHAR, --Null when CUBE_ALL_PATHWAYS
+    CUBE_ORG_LEVEL VARCHAR, --Site, Trust (All sites), NCL (All trusts by NCL flag) or All
+    CUBE_ALL_PATHWAYS BOOLEAN, --Flag if the row is the total of every pathway
+    PER_NUMERATOR FLOAT,
+    PER_DENOMINATOR FLOAT,
+    PER_COUNT NUMBER --Number of performance rows
+)
+COMMENT="Dynamic table containing performance totals at each reporting level."
+TARGET_LAG = "24 hours"
+REFRESH_MODE = FULL
+INITIALIZE = ON_CREATE
+WAREHOUSE = NCL_ANALYTICS_XS
+AS
+--PATHWAY is carried on each performance row (See utils/util_pathway.py)
+SELECT
+    per.PER_DATE_YEAR,
+    per.PER_DATE_MONTH,
+    per.PER_ORG_TRUST,
+    per.PER_ORG_SITE,
+    per.PER_ORG_NCL,
+    per.PER_METRIC,
+    per.PATHWAY,
+    CASE
+        WHEN GROUPING(per.PER_ORG_NCL) = 1 THEN 'All'
+        WHEN GROUPING(per.PER_ORG_TRUST) = 1 THEN 'NCL'
+        WHEN GROUPING(per.PER_ORG_SITE) = 1 THEN 'Trust'
+        ELSE 'Site'
+    END AS CUBE_ORG_LEVEL,
+    GROUPING(per.PATHWAY) = 1 AS CUBE_ALL_PATHWAYS,
+    SUM(per.PER_NUMERATOR) AS PER_NUMERATOR,
+    SUM(per.PER_DENOMINATOR) AS PER_DENOMINATOR,
+    COUNT(*) AS PER_COUNT
+
+FROM DEV__MODELLING.CANCER__CWT_PATHWAY.CWT_PERFORMANCE per
+
+--Every reporting level in one pass of CWT_PERFORMANCE
+GROUP BY GROUPING SETS (
+    --Site
+    (per.PER_DATE_YEAR, per.PER_DATE_MONTH, per.PER_METRIC, per.PATHWAY,
+        per.PER_ORG_NCL, per.PER_ORG_TRUST, per.PER_ORG_SITE),
+    (per.PER_DATE_YEAR, per.PER_DATE_MONTH, per.PER_METRIC,
+        per.PER_ORG_NCL, per.PER_ORG_TRUST, per.PER_ORG_SITE),
+    --Trust (All sites)
+    (per.PER_DATE_YEAR, per.PER_DATE_MONTH, per.PER_METRIC, per.PATHWAY,
+        per.PER_ORG_NCL, per.PER_ORG_TRUST),
+    (per.PER_DATE_YEAR, per.PER_DATE_MONTH, per.PER_METRIC,
+        per.PER_ORG_NCL, per.PER_ORG_TRUST),
+    --NCL (All trusts in and out of NCL)
+    (per.PER_DATE_YEAR, per.PER_DATE_MONTH, per.PER_METRIC, per.PATHWAY,
+        per.PER_ORG_NCL),
+    (per.PER_DATE_YEAR, per.PER_DATE_MONTH, per.PER_METRIC,
+        per.PER_ORG_NCL),
+    --All
+    (per.PER_DATE_YEAR, per.PER_DATE_MONTH, per.PER_METRIC, per.PATHWAY),
+    (per.PER_DATE_YEAR, per.PER_DATE_MONTH, per.PER_METRIC)
+)
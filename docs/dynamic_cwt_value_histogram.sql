@@ -0,0 +1,39 @@
+CREATE OR REPLACE DYNAMIC TABLE DEV__MODELLING.CANCER__CWT_PATHWAY.CWT_VALUE_HISTOGRAM (
+
+    --Description: Per-day waiting time histogram for each metric (CWT Pathway standard)
+    --Author: Jake Kealey
+
+    PER_DATE_YEAR NUMBER,
+    PER_DATE_MONTH NUMBER,
+    PER_ORG_TRUST VARCHAR,
+    PER_ORG_SITE VARCHAR,
+    PER_ORG_NCL BOOLEAN,
+    PER_METRIC VARCHAR,
+    PER_VALUE NUMBER, --Waiting days (Null rows breach at every threshold)
+    HIST_WEIGHT FLOAT, --Sum of PER_DENOMINATOR for the rows with this value
+    HIST_COUNT NUMBER --Number of performance rows with this value
+)
+COMMENT="Dynamic table containing waiting time histograms for any threshold performance."
+TARGET_LAG = "24 hours"
+REFRESH_MODE = FULL
+INITIALIZE = ON_CREATE
+WAREHOUSE = NCL_ANALYTICS_XS
+AS
+--The breaches for any threshold are the weight above it, so a standard
+--other than the ones hard coded in the metrics can be answered from here
+--(See utils/util_histogram.py)
+SELECT
+    PER_DATE_YEAR,
+    PER_DATE_MONTH,
+    PER_ORG_TRUST,
+    PER_ORG_SITE,
+    PER_ORG_NCL,
+    PER_METRIC,
+    PER_VALUE,
+    SUM(PER_DENOMINATOR) AS HIST_WEIGHT,
+    COUNT(*) AS HIST_COUNT
+
+FROM DEV__MODELLING.CANCER__CWT_PATHWAY.CWT_PERFORMANCE
+
+GROUP BY PER_DATE_YEAR, PER_DATE_MONTH, PER_ORG_TRUST, PER_ORG_SITE,
+    PER_ORG_NCL, PER_METRIC, PER_VALUE
@@ -0,0 +1,43 @@
+CREATE OR REPLACE DYNAMIC TABLE DEV__MODELLING.CANCER__CWT_PATHWAY.CWT_VALUE_SKETCH (
+
+    --Description: Mergeable quantile sketch of the waiting times for each metric (CWT Pathway standard)
+    --Author: Jake Kealey
+
+    PER_DATE_YEAR NUMBER,
+    PER_DATE_MONTH NUMBER,
+    PER_ORG_TRUST VARCHAR,
+    PER_ORG_SITE VARCHAR,
+    PER_ORG_NCL BOOLEAN,
+    PER_METRIC VARCHAR,
+    SKETCH_BUCKET NUMBER, --Log bucket of PER_VALUE (0 for 0, negative for negative values)
+    SKETCH_COUNT NUMBER --Number of performance rows in the bucket
+)
+COMMENT="Dynamic table containing waiting time quantile sketches."
+TARGET_LAG = "24 hours"
+REFRESH_MODE = FULL
+INITIALIZE = ON_CREATE
+WAREHOUSE = NCL_ANALYTICS_XS
+AS
+--Buckets grow by a factor of 1.0202 (1% relative error, see utils/util_sketch.py)
+--so a group never has more than a few hundred rows. Sketches merge by summing
+--SKETCH_COUNT, so sites, trusts and quarters roll up without the records
+SELECT
+    PER_DATE_YEAR,
+    PER_DATE_MONTH,
+    PER_ORG_TRUST,
+    PER_ORG_SITE,
+    PER_ORG_NCL,
+    PER_METRIC,
+    CASE
+        WHEN PER_VALUE = 0 THEN 0
+        ELSE SIGN(PER_VALUE) * (CEIL(LN(ABS(PER_VALUE)) / LN(1.01 / 0.99)) + 1)
+    END AS SKETCH_BUCKET,
+    COUNT(*) AS SKETCH_COUNT
+
+FROM DEV__MODELLING.CANCER__CWT_PATHWAY.CWT_PERFORMANCE
+
+--Null values have no waiting time so are not in the distribution
+WHERE PER_VALUE IS NOT NULL
+
+GROUP BY PER_DATE_YEAR, PER_DATE_MONTH, PER_ORG_TRUST, PER_ORG_SITE,
+    PER_ORG_NCL, PER_METRIC, SKETCH_BUCKET
@@ -0,0 +1,111 @@
+#General imports
+import argparse
+import time
+import pandas as pd
+
+#Utility script imports
+import utils.util_local as ul
+import utils.util_synthetic as synthetic
+
+#Script to compare the branch-and-union 62 Day plan against the single scan
+# plan on a synthetic base
+#The local engine is always benchmarked. With --snowflake the synthetic base
+# is uploaded to a temporary table and both Snowpark plans are run against it
+
+def time_local(transformation_func, df_base, repeat):
+    #Best of repeat runs
+    timings = []
+    for _ in range(repeat):
+        time_start = time.perf_counter()
+        df = transformation_func(df_base)
+        timings.append(time.perf_counter() - time_start)
+    return df, min(timings)
+
+def sorted_output(df):
+    #Row order differs between the plans so compare on sorted values
+    df = df.astype(str)
+    return df.sort_values(list(df.columns)).reset_index(drop=True)
+
+def benchmark_snowflake(df_base):
+    #Imported here so the local benchmark does not need Snowflake settings
+    from dotenv import load_dotenv
+    from os import getenv
+    import utils.util_snowflake as us
+    import feature_dynamic_performance_62 as fd_62
+
+    load_dotenv(override=True)
+    connection_params = {
+        "account": getenv("ACCOUNT"),
+        "user": getenv("USER"),
+        "authenticator": getenv("AUTHENTICATOR"),
+        "role": getenv("ROLE"),
+        "warehouse": getenv("WAREHOUSE"),
+        "database": getenv("DATABASE"),
+        "schema": getenv("SCHEMA")
+    }
+    session = us.snowpark_session_create(
+        connection_params, "CANCER CWT BENCHMARK 62 DAY")
+
+    table_name = "CWT_BASE_BENCHMARK"
+    session.write_pandas(
+        df_base, table_name, auto_create_table=True, overwrite=True,
+        table_type="temporary", use_logical_type=True)
+
+    results = {}
+    for name, transformation_func in [
+            ("branches", fd_62.performance_62day),
+            ("single_scan", fd_62.performance_62day_single_scan)]:
+        df = transformation_func(session.table(table_name))
+        query = df.queries["queries"][-1]
+
+        time_start = time.perf_counter()
+        rows = df.count()
+        results[name] = {
+            "rows": rows,
+            "seconds": time.perf_counter() - time_start,
+            "sql_length": len(query),
+            "base_scans": query.count(table_name)
+        }
+
+    session.close()
+
+    return results
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        description="Benchmark the 62 Day allocation plans.")
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument(
+        "--snowflake", action="store_true",
+        help="Also run the Snowpark plans against a temporary table")
+    args = parser.parse_args()
+
+    df_base = synthetic.cwt_base(args.rows)
+
+    df_branches, time_branches = time_local(
+        ul.performance_62day, df_base, args.repeat)
+    df_single, time_single = time_local(
+        ul.performance_62day_single_scan, df_base, args.repeat)
+
+    pd.testing.assert_frame_equal(
+        sorted_output(df_branches), sorted_output(df_single))
+
+    print(f"Local engine ({args.rows} base rows, best of {args.repeat})")
+    print(f"{'Plan':<15}{'Rows':>12}{'Seconds':>10}{'Rows/sec':>14}")
+    for name, df, seconds in [
+            ("branches", df_branches, time_branches),
+            ("single_scan", df_single, time_single)]:
+        print(f"{name:<15}{len(df):>12}{seconds:>10.2f}"
+              f"{len(df) / seconds:>14.0f}")
+
+    if args.snowflake:
+        results = benchmark_snowflake(df_base)
+
+        print("Snowpark")
+        print(f"{'Plan':<15}{'Rows':>12}{'Seconds':>10}"
+              f"{'SQL length':>12}{'Base scans':>12}")
+        for name, result in results.items():
+            print(f"{name:<15}{result['rows']:>12}{result['seconds']:>10.2f}"
+                  f"{result['sql_length']:>12}{result['base_scans']:>12}")
@@ -0,0 +1,119 @@
+#General imports
+import argparse
+import multiprocessing
+import os
+import resource
+import time
+import pandas as pd
+
+#Script to measure how the local metric functions scale with the size of
+# CWT_BASE, using synthetic extracts (i.e. 1M, 10M and 100M rows)
+#Extracts are generated once into the data folder and reused
+#Each function runs in its own process so the peak RSS is not shared
+#Peak MB is the peak RSS above the process baseline so includes the base
+
+#Local metric functions to benchmark (Names in utils/util_local.py)
+LOCAL_FUNCTIONS = [
+    "determine_pathway",
+    "performance_2ww",
+    "performance_fds",
+    "performance_31day_first",
+    "performance_31day_sub",
+    "performance_62day",
+    "performance_62day_single_scan"
+]
+
+def peak_rss_mb():
+    #ru_maxrss is in KB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def run_function(name, path, results, workers=1):
+    #Utility script imports (Imported here so the import cost is in the baseline)
+    import utils.util_columns as ucol
+    import utils.util_local as ul
+    import utils.util_parallel as upl
+
+    baseline = peak_rss_mb()
+
+    time_start = time.perf_counter()
+    df_base = ul.load_base(path, ucol.base_columns(name))
+    time_load = time.perf_counter() - time_start
+
+    time_start = time.perf_counter()
+    if workers > 1:
+        #Peak MB is then only the parent (Workers have their own RSS)
+        df = upl.parallel_local_features(
+            getattr(ul, name), df_base, n_workers=workers)
+    else:
+        df = getattr(ul, name)(df_base)
+    time_run = time.perf_counter() - time_start
+
+    results[name] = {
+        "rows_in": len(df_base),
+        "rows_out": len(df),
+        "load_seconds": time_load,
+        "seconds": time_run,
+        "rows_per_second": len(df_base) / time_run,
+        "peak_mb": peak_rss_mb() - baseline
+    }
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        description="Benchmark the local metric functions on synthetic data.")
+    parser.add_argument(
+        "--rows", type=int, nargs="+", default=[1000000],
+        help="Sizes of CWT_BASE to benchmark (i.e. 1000000 10000000)")
+    parser.add_argument("--folder", default="data/synthetic")
+    parser.add_argument("--chunk-rows", type=int, default=1000000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--functions", nargs="+", default=LOCAL_FUNCTIONS,
+        choices=LOCAL_FUNCTIONS)
+    parser.add_argument(
+        "--workers", type=int, default=1,
+        help="Processes to run each function with (See util_parallel)")
+    parser.add_argument(
+        "--output", default=None,
+        help="(Optional) Path of a csv file to save the results to")
+    args = parser.parse_args()
+
+    import utils.util_synthetic as synthetic
+
+    manager = multiprocessing.Manager()
+    report = []
+
+    for n_rows in args.rows:
+        path = os.path.join(args.folder, f"cwt_base_{n_rows}.parquet")
+
+        if not os.path.exists(path):
+            time_start = time.perf_counter()
+            synthetic.write_cwt_base(
+                path, n_rows, seed=args.seed, chunk_rows=args.chunk_rows)
+            print(f"Generated {path} in {time.perf_counter() - time_start:.1f}s")
+
+        results = manager.dict()
+        for name in args.functions:
+            process = multiprocessing.get_context("spawn").Process(
+                target=run_function, args=(name, path, results, args.workers))
+            process.start()
+            process.join()
+
+            if name not in results:
+                print(f"{name} failed on {n_rows} rows "
+                      f"(exit code {process.exitcode})")
+
+        print(f"CWT_BASE with {n_rows} rows")
+        print(f"{'Function':<32}{'Rows out':>12}{'Load s':>9}{'Run s':>9}"
+              f"{'Rows/sec':>12}{'Peak MB':>10}")
+        for name in args.functions:
+            if name not in results:
+                continue
+            result = results[name]
+            print(f"{name:<32}{result['rows_out']:>12}"
+                  f"{result['load_seconds']:>9.1f}{result['seconds']:>9.1f}"
+                  f"{result['rows_per_second']:>12.0f}{result['peak_mb']:>10.0f}")
+            report.append({"function": name, **result})
+
+    if args.output:
+        pd.DataFrame(report).to_csv(args.output, index=False)
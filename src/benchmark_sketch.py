@@ -0,0 +1,121 @@
+#General imports
+import argparse
+import time
+import numpy as np
+
+#Utility script imports
+import utils.util_local as ul
+import utils.util_sketch as usk
+import utils.util_synthetic as synthetic
+
+#Script to check the quantile sketches (utils/util_sketch.py) against exact
+# quantiles of PER_VALUE on a synthetic base, and to time both
+#Exact quantiles are numpy.quantile method="lower" on the performance rows,
+# which every sketch estimate should be within alpha (relative) of
+
+#Local metric functions for each performance table
+LOCAL_FEATURES = {
+    "CWT_PERFORMANCE_2WW": ul.performance_2ww,
+    "CWT_PERFORMANCE_FDS": ul.performance_fds,
+    "CWT_PERFORMANCE_31DAY_FIRST": ul.performance_31day_first,
+    "CWT_PERFORMANCE_31DAY_SUBSEQUENT": ul.performance_31day_sub,
+    "CWT_PERFORMANCE_62DAY": ul.performance_62day
+}
+
+#Groupings to check (Sketches are merged up from months and sites)
+GROUPINGS = {
+    "month": ["PER_METRIC", "PER_DATE_YEAR", "PER_DATE_MONTH"],
+    "quarter": ["PER_METRIC", "PER_DATE_YEAR", "PER_DATE_QUARTER"],
+    "trust": ["PER_METRIC", "PER_ORG_TRUST"],
+    "metric": ["PER_METRIC"]
+}
+
+def exact_quantiles(df_performance, quantiles, group_by):
+    #Exact lower quantile of PER_VALUE for each group
+    df = df_performance[df_performance["PER_VALUE"].notna()]
+    if "PER_DATE_QUARTER" in group_by:
+        df = df.assign(PER_DATE_QUARTER=(df["PER_DATE_MONTH"] - 1) // 3 + 1)
+
+    groups = df.groupby(group_by, dropna=False, sort=True)["PER_VALUE"]
+    df_out = groups.size().rename("EXACT_COUNT").reset_index()
+    for q in quantiles:
+        df_out[f"P{q * 100:g}_EXACT"] = groups.agg(
+            lambda values: np.quantile(
+                values.to_numpy(dtype="float64"), q, method="lower")
+        ).to_numpy()
+
+    return df_out
+
+def check_grouping(df_performance, df_sketch, quantiles, group_by):
+    #Estimates and exact quantiles for one grouping with the timings
+    time_start = time.perf_counter()
+    df_estimate = usk.sketch_quantiles(df_sketch, quantiles, group_by)
+    time_sketch = time.perf_counter() - time_start
+
+    time_start = time.perf_counter()
+    df_exact = exact_quantiles(df_performance, quantiles, group_by)
+    time_exact = time.perf_counter() - time_start
+
+    df = df_estimate.merge(df_exact, on=group_by, how="outer")
+    assert (df["SKETCH_COUNT"] == df["EXACT_COUNT"]).all(), \
+        "Sketch counts do not match the performance rows"
+
+    results = {
+        "groups": len(df),
+        "seconds_sketch": time_sketch,
+        "seconds_exact": time_exact
+    }
+    for q in quantiles:
+        name = f"P{q * 100:g}"
+        exact = df[name + "_EXACT"]
+        #(Tolerance for the float rounding of the bounds)
+        is_within = (exact >= df[name + "_LOWER"] - 1e-9) & \
+            (exact <= df[name + "_UPPER"] + 1e-9)
+        results[name + "_within"] = int(is_within.sum())
+        results[name + "_max_error"] = float(
+            (np.abs(df[name] - exact) / np.maximum(np.abs(exact), 1)).max())
+
+    return results
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        description="Check the quantile sketches against exact quantiles.")
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument(
+        "--quantiles", type=float, nargs="*", default=[0.5, 0.9])
+    args = parser.parse_args()
+
+    df_base = synthetic.cwt_base(args.rows)
+    df_performance = ul.combine_performance({
+        table: transformation_func(df_base)
+        for table, transformation_func in LOCAL_FEATURES.items()
+    })
+
+    time_start = time.perf_counter()
+    df_sketch = usk.value_sketch(df_performance)
+    time_build = time.perf_counter() - time_start
+
+    print(f"{len(df_performance)} performance rows -> {len(df_sketch)} sketch "
+          f"rows in {time_build:.2f}s (alpha {usk.SKETCH_ALPHA})")
+
+    header = f"{'Grouping':<10}{'Groups':>8}"
+    for q in args.quantiles:
+        header += f"{f'P{q * 100:g} within':>14}{'Max error':>11}"
+    print(header + f"{'Sketch s':>10}{'Exact s':>10}")
+
+    is_pass = True
+    for grouping, group_by in GROUPINGS.items():
+        results = check_grouping(
+            df_performance, df_sketch, args.quantiles, group_by)
+
+        line = f"{grouping:<10}{results['groups']:>8}"
+        for q in args.quantiles:
+            name = f"P{q * 100:g}"
+            within = f"{results[name + '_within']}/{results['groups']}"
+            line += f"{within:>14}{results[name + '_max_error']:>11.4f}"
+            is_pass = is_pass and results[name + "_within"] == results["groups"]
+        print(line + f"{results['seconds_sketch']:>10.3f}"
+              f"{results['seconds_exact']:>10.3f}")
+
+    assert is_pass, "Some exact quantiles are outside the sketch bounds"
@@ -0,0 +1,77 @@
+#General imports
+import argparse
+import multiprocessing
+import os
+import resource
+import shutil
+import tempfile
+import time
+
+#Script to compare the peak memory of pulling a record-level result in one
+# go (pull_data_from_query) against streaming it to parquet in batches
+# (write_query_to_parquet), using a local stand-in for the Snowflake cursor
+#Each method runs in its own process so the peak RSS is not shared
+
+def peak_rss_mb():
+    #ru_maxrss is in KB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def run_method(method, n_batches, batch_size, destination, results):
+    #Utility script imports (Imported here so the import cost is in the baseline)
+    import utils.util_snowflake as us
+    import utils.util_stub as stub
+
+    connection = stub.LocalConnection(
+        batch_func=lambda i: stub.cwt_batch(i, batch_size),
+        n_batches=n_batches)
+
+    baseline = peak_rss_mb()
+    time_start = time.perf_counter()
+
+    query = "SELECT * FROM CWT_BASE"
+
+    if method == "pull_all":
+        df = us.pull_data_from_query(query, connection=connection)
+        df.to_parquet(os.path.join(destination, "cwt_base.parquet"))
+        rows = len(df)
+    elif method == "stream":
+        rows = us.write_query_to_parquet(
+            query, os.path.join(destination, "cwt_base.parquet"),
+            connection=connection)
+    elif method == "stream_partitioned":
+        rows = us.write_query_to_parquet(
+            query, os.path.join(destination, "cwt_base"),
+            partition_cols=["META_SUBMISSIONID"], connection=connection)
+
+    results[method] = {
+        "rows": rows,
+        "seconds": time.perf_counter() - time_start,
+        "baseline_mb": baseline,
+        "peak_mb": peak_rss_mb()
+    }
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        description="Benchmark peak memory of batched result fetching.")
+    parser.add_argument("--batches", type=int, default=20)
+    parser.add_argument("--batch-size", type=int, default=250000)
+    args = parser.parse_args()
+
+    manager = multiprocessing.Manager()
+    results = manager.dict()
+
+    for method in ["pull_all", "stream", "stream_partitioned"]:
+        destination = tempfile.mkdtemp()
+        process = multiprocessing.get_context("spawn").Process(
+            target=run_method,
+            args=(method, args.batches, args.batch_size, destination, results))
+        process.start()
+        process.join()
+        shutil.rmtree(destination)
+
+    print(f"{'Method':<20}{'Rows':>12}{'Seconds':>10}{'Peak MB':>10}{'Above baseline MB':>20}")
+    for method, result in results.items():
+        print(f"{method:<20}{result['rows']:>12}{result['seconds']:>10.1f}"
+              f"{result['peak_mb']:>10.0f}"
+              f"{result['peak_mb'] - result['baseline_mb']:>20.0f}")
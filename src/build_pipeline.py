@@ -0,0 +1,264 @@
+#General imports
+import argparse
+import toml
+from dotenv import load_dotenv
+from os import getenv
+
+#Utility script imports
+import utils.util_snowflake as us
+import utils.util_pipeline as up
+import utils.util_stub as ustub
+
+#Feature script imports (for the transformation functions and params)
+import feature_dynamic_pathway as fd_pathway
+import feature_dynamic_performance as fd_performance
+import feature_dynamic_performance_2ww as fd_2ww
+import feature_dynamic_performance_fds as fd_fds
+import feature_dynamic_performance_31_first as fd_31_first
+import feature_dynamic_performance_31_sub as fd_31_sub
+import feature_dynamic_performance_62 as fd_62
+
+#Script to build the CWT dynamic tables in dependency order
+#Independent tables are submitted together as async jobs on one session
+
+parser = argparse.ArgumentParser(
+    description="Build the CWT dynamic table pipeline.")
+parser.add_argument(
+    "--skip", nargs="*", default=[],
+    help="Tables to treat as already built (i.e. CWT_BASE)")
+parser.add_argument(
+    "--fused", action="store_true",
+    help="Build CWT_PERFORMANCE in a single pass of CWT_BASE instead of "
+         "from the metric tables, which are not built (Nor are the 31 and "
+         "62 Day breakdowns, which are built from them)")
+parser.add_argument(
+    "--single-scan-62", action="store_true",
+    help="Build CWT_PERFORMANCE_62DAY with the single scan plan")
+parser.add_argument(
+    "--latest-only", action="store_true",
+    help="Build the metric tables from the latest version of each record "
+         "(Adds the CWT_LATEST index after CWT_BASE)")
+parser.add_argument(
+    "--run-id", default=None,
+    help="(Optional) ID to tag the run with instead of a generated one")
+parser.add_argument(
+    "--offline", default=None, metavar="BASE_PATH",
+    help="Build without Snowflake from a parquet fixture of CWT_BASE, "
+         "capturing the tables in output/offline (See util_stub.OfflineSession)")
+parser.add_argument(
+    "--dry-run", action="store_true",
+    help="Print the build order without building anything")
+args = parser.parse_args()
+if args.fused and args.single_scan_62:
+    parser.error("--single-scan-62 builds CWT_PERFORMANCE_62DAY, which "
+                 "--fused does not build")
+
+#Load env settings
+load_dotenv(override=True)
+config = toml.load("config.toml")
+
+#Create a Snowflake session shared by every build
+connection_params = {
+    "account": getenv("ACCOUNT"),
+    "user": getenv("USER"),
+    "authenticator": getenv("AUTHENTICATOR"),
+    "role": getenv("ROLE"),
+    "warehouse": getenv("WAREHOUSE"),
+    "database": getenv("DATABASE"),
+    "schema": getenv("SCHEMA")
+}
+
+def submit_sql(name, path, query_tag, join_keys={}):
+    #Build a table defined in a SQL script in the docs folder
+    #join_keys: Tables the script joins to and the keys it joins them on,
+    # checked for duplicates first so a join cannot fan out the rows
+    #Offline runs build the tables with a local version from the local
+    # outputs (See util_stub.OFFLINE_SQL_TABLES), the rest are not built
+    def submit():
+        if args.offline and name not in ustub.OFFLINE_SQL_TABLES:
+            return up.NOT_BUILT
+        if not args.offline:
+            for table, keys in join_keys.items():
+                us.check_join_keys(session, table, keys)
+        with open(path, "r") as f:
+            query = f.read()
+        session.query_tag = query_tag
+        with us.trace_stage(session, name, "submit", sql_length=len(query)) \
+                as trace:
+            if args.offline:
+                job = session.local_sql(name, query)
+            else:
+                job = session.sql(query).collect_nowait()
+            trace["query_id"] = job.query_id
+        return job
+    return submit
+
+def submit_features(module, transformation_func):
+    #Build a table defined by a feature_dynamic_*.py script
+    def submit():
+        session.query_tag = module.feature_dynamic_params["query_tag"]
+        return us.create_dynamic_features(
+            transformation_func=transformation_func,
+            params=module.feature_dynamic_params,
+            session=session,
+            block=False
+        )
+    return submit
+
+def submit_latest_index():
+    #Create the latest submission index (A dynamic table so the metric tables
+    # built from it stay in step with the base between pipeline runs)
+    #Offline runs filter the fixture to the latest rows when it is read
+    if args.offline:
+        return up.NOT_BUILT
+    return submit_sql(
+        us.LATEST_INDEX_TABLE, "docs/dynamic_cwt_latest.sql",
+        "CANCER CWT PIPELINE LATEST")()
+
+#Nodes in the pipeline and the tables they depend on
+pipeline = {
+    "CWT_ORGANISATION": {
+        "depends_on": [],
+        "submit": submit_sql(
+            "CWT_ORGANISATION", "docs/dynamic_cwt_organisation.sql",
+            "CANCER CWT PIPELINE ORGANISATION",
+            join_keys={
+                '"Dictionary"."dbo"."Organisation"': ['"SK_OrganisationID"']
+            })
+    },
+    "CWT_BASE": {
+        "depends_on": ["CWT_ORGANISATION"],
+        "submit": submit_sql(
+            "CWT_BASE", "docs/dynamic_cwt_base.sql",
+            "CANCER CWT PIPELINE BASE",
+            join_keys={
+                "DEV__MODELLING.CANCER__CWT_PATHWAY.CWT_ORGANISATION":
+                    ["ORG_SITE"],
+                "DEV__MODELLING.CANCER__REF.DIM_CWT_REFERENCE":
+                    ["REFERENCE_CODE", "CODE"]
+            })
+    },
+    "CWT_PATHWAY": {
+        "depends_on": ["CWT_BASE"],
+        "submit": submit_features(fd_pathway, fd_pathway.determine_pathway)
+    },
+    "CWT_PERFORMANCE_2WW": {
+        "depends_on": ["CWT_BASE"],
+        "submit": submit_features(fd_2ww, fd_2ww.performance_2ww)
+    },
+    "CWT_PERFORMANCE_FDS": {
+        "depends_on": ["CWT_BASE"],
+        "submit": submit_features(fd_fds, fd_fds.performance_fds)
+    },
+    "CWT_PERFORMANCE_31DAY_FIRST": {
+        "depends_on": ["CWT_BASE"],
+        "submit": submit_features(
+            fd_31_first, fd_31_first.performance_31day_first)
+    },
+    "CWT_PERFORMANCE_31DAY_SUBSEQUENT": {
+        "depends_on": ["CWT_BASE"],
+        "submit": submit_features(fd_31_sub, fd_31_sub.performance_31day_sub)
+    },
+    "CWT_PERFORMANCE_62DAY": {
+        "depends_on": ["CWT_BASE"],
+        "submit": submit_features(fd_62, fd_62.performance_62day)
+    },
+    "CWT_PERFORMANCE": {
+        "depends_on": [
+            "CWT_PERFORMANCE_2WW", "CWT_PERFORMANCE_FDS",
+            "CWT_PERFORMANCE_31DAY_FIRST", "CWT_PERFORMANCE_31DAY_SUBSEQUENT",
+            "CWT_PERFORMANCE_62DAY"
+        ],
+        "submit": submit_sql(
+            "CWT_PERFORMANCE", "docs/dynamic_cwt_performance.sql",
+            "CANCER CWT PIPELINE PERFORMANCE")
+    },
+    "CWT_PERFORMANCE_CUBE": {
+        "depends_on": ["CWT_PERFORMANCE"],
+        "submit": submit_sql(
+            "CWT_PERFORMANCE_CUBE", "docs/dynamic_cwt_performance_cube.sql",
+            "CANCER CWT PIPELINE PERFORMANCE CUBE")
+    },
+    "CWT_VALUE_HISTOGRAM": {
+        "depends_on": ["CWT_PERFORMANCE"],
+        "submit": submit_sql(
+            "CWT_VALUE_HISTOGRAM", "docs/dynamic_cwt_value_histogram.sql",
+            "CANCER CWT PIPELINE VALUE HISTOGRAM")
+    },
+    "CWT_VALUE_SKETCH": {
+        "depends_on": ["CWT_PERFORMANCE"],
+        "submit": submit_sql(
+            "CWT_VALUE_SKETCH", "docs/dynamic_cwt_value_sketch.sql",
+            "CANCER CWT PIPELINE VALUE SKETCH")
+    },
+    "CWT_62DAYBREAKDOWN": {
+        "depends_on": ["CWT_PERFORMANCE_62DAY"],
+        "submit": submit_sql(
+            "CWT_62DAYBREAKDOWN", "docs/dynamic_cwt_62daybreakdown.sql",
+            "CANCER CWT PIPELINE 62 DAY")
+    },
+    "CWT_31DAYBREAKDOWN": {
+        "depends_on": [
+            "CWT_PERFORMANCE_31DAY_FIRST", "CWT_PERFORMANCE_31DAY_SUBSEQUENT"
+        ],
+        "submit": submit_sql(
+            "CWT_31DAYBREAKDOWN", "docs/dynamic_cwt_31daybreakdown.sql",
+            "CANCER CWT PIPELINE 31 DAY")
+    }
+}
+
+#The fused build only needs the base and replaces the metric tables, so they
+# (and the breakdowns built from them) are left out instead of scanning the
+# base a sixth time
+if args.fused:
+    pipeline["CWT_PERFORMANCE"] = {
+        "depends_on": ["CWT_BASE"],
+        "submit": submit_features(fd_performance, fd_performance.performance_all)
+    }
+    for name in ["CWT_PERFORMANCE_2WW", "CWT_PERFORMANCE_FDS",
+                 "CWT_PERFORMANCE_31DAY_FIRST",
+                 "CWT_PERFORMANCE_31DAY_SUBSEQUENT", "CWT_PERFORMANCE_62DAY",
+                 "CWT_62DAYBREAKDOWN", "CWT_31DAYBREAKDOWN"]:
+        del pipeline[name]
+
+if args.single_scan_62:
+    pipeline["CWT_PERFORMANCE_62DAY"]["submit"] = submit_features(
+        fd_62, fd_62.performance_62day_single_scan)
+
+#Filter the metric tables to the latest version of each record
+if args.latest_only:
+    pipeline[us.LATEST_INDEX_TABLE] = {
+        "depends_on": ["CWT_BASE"],
+        "submit": submit_latest_index
+    }
+    for module in [fd_pathway, fd_performance, fd_2ww, fd_fds, fd_31_first,
+                   fd_31_sub, fd_62]:
+        module.feature_dynamic_params["latest_only"] = True
+        name = module.feature_dynamic_params["destination_table"]
+        if name in pipeline and "CWT_BASE" in pipeline[name]["depends_on"]:
+            pipeline[name]["depends_on"] = pipeline[name]["depends_on"] + [
+                us.LATEST_INDEX_TABLE]
+
+if args.dry_run:
+    print("Build order:")
+    for name in up.pipeline_order(pipeline):
+        status = " (skipped)" if name in args.skip else ""
+        print(f"  {name} <- {', '.join(pipeline[name]['depends_on'])}{status}")
+else:
+    if args.offline:
+        session = ustub.OfflineSession(
+            {"CWT_BASE": args.offline}, query_tag="CANCER CWT PIPELINE")
+    else:
+        session = us.session_get(connection_params, "CANCER CWT PIPELINE")
+
+    #Every statement is tagged with the run ID (See output/trace.jsonl)
+    run_id = us.trace_start(args.run_id)
+    print(f"Run ID: {run_id}")
+
+    timings = up.run_pipeline(pipeline, skip=args.skip)
+    up.pipeline_report(pipeline, timings)
+
+    for name, (start, end) in timings.items():
+        us.trace_log("pipeline", table=name, start=start, end=end,
+                     seconds=end - start)
+    us.trace_query_history(session)
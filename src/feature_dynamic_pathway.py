@@ -4,11 +4,11 @@ from dotenv import load_dotenv
 from os import getenv
 
 #Snowflake imports
-from snowflake.snowpark.functions import col, is_null, not_, when
 from snowflake.ml.feature_store import FeatureView
 
 #Utility script imports
 import utils.util_snowflake as us
+import utils.util_pathway as upw
 
 def determine_pathway(df):
     
@@ -19,40 +19,12 @@ def determine_pathway(df):
         - df: Dataframe containing the target features
     """
     
-    pathway_usc = (
-        (col("PATHWAY_PRIORITYTYPE_CODE") == 3) &
-        (col("CWT_CANCERREFERALTYPE_CODE") != 16) &
-        (col("PATHWAY_SOURCEOFREFERRALFOROUTPATIENT_CODE") != 17) &
-        is_null(col("DATE_CONSULTANTUPGRADEDATE"))
-    )
-
-    pathway_breastsymp = (
-        (col("PATHWAY_PRIORITYTYPE_CODE") == 3) &
-        (col("CWT_CANCERREFERALTYPE_CODE") == 16) &
-        (col("PATHWAY_SOURCEOFREFERRALFOROUTPATIENT_CODE") != 17) &
-        is_null(col("DATE_CONSULTANTUPGRADEDATE"))
-    )
-
-    pathway_screening = (
-        (col("PATHWAY_PRIORITYTYPE_CODE") == 2) &
-        (col("PATHWAY_SOURCEOFREFERRALFOROUTPATIENT_CODE") == 17)
-    )
-
-    pathway_upgrade = (
-        (col("PATHWAY_SOURCEOFREFERRALFOROUTPATIENT_CODE") != 17) &
-        not_(is_null(col("DATE_CONSULTANTUPGRADEDATE")))
-    )
-
+    #Shared with the metric builders (See utils/util_pathway.py)
     df = df.with_column(
         "PATHWAY",
-        when(pathway_usc, "USC")
-        .when(pathway_breastsymp, "Breast Symptomatic")
-        .when(pathway_screening, "Screening")
-        .when(pathway_upgrade, "Upgrade")
-        .otherwise("Unknown")
+        upw.pathway_column()
     )
 
-
     df = df[["RECORD_ID", "PATHWAY"]]
 
     return df
@@ -80,4 +52,5 @@ feature_dynamic_params = {
     "fdt_comment": "Categorises data into USC, Breast Symptomatic, Screening, Upgrade, Unknown"
 }
 
-us.create_dynamic_features(transformation_func=determine_pathway, params=feature_dynamic_params)
\ No newline at end of file
+if __name__ == "__main__":
+    us.create_dynamic_features(transformation_func=determine_pathway, params=feature_dynamic_params)
@@ -0,0 +1,306 @@
+#General imports
+import toml
+from dotenv import load_dotenv
+from os import getenv
+
+#Snowflake imports
+from snowflake.snowpark.functions import col, is_null, not_, when, lit, coalesce, iff
+
+#Utility script imports
+import utils.util_snowflake as us
+import utils.util_allocation as ua
+import utils.util_rows as ur
+import utils.util_eligibility as ue
+import utils.util_pathway as upw
+
+#Function to derive every performance metric from a single scan of the base
+def performance_all(df):
+
+    #Intermediate values are added as TEMP_ columns so each expression is
+    # only compiled once even though several output rows reference it
+
+    #Pathway of the row (Same expression as CWT_PATHWAY and the metric
+    # tables, see utils/util_pathway.py). Evaluated on the row itself instead
+    # of joining CWT_PATHWAY on RECORD_ID, as RECORD_ID is not unique in the base
+    df = df.with_column(
+        "TEMP_UPGRADE",
+        upw.upgrade_column()
+    )
+    pathway_upgrade = col("TEMP_UPGRADE")
+
+    df = df.with_column(
+        "PATHWAY",
+        upw.pathway_column()
+    )
+    pathway_known = col("PATHWAY") != upw.PATHWAY_UNKNOWN
+
+    #Calculate the value for each metric
+    df = df.with_column(
+        "TEMP_FDSENDDATE",
+        when((
+                col("DATE_CANCERTREATMENTPERIODSTARTDATE") <
+                col("DATE_FDSPATHWAYENDDATE")
+            ),
+            col("DATE_CANCERTREATMENTPERIODSTARTDATE"))
+        .otherwise(col("DATE_FDSPATHWAYENDDATE"))
+    )
+
+    df = df.with_column(
+        "TEMP_VALUE_2WW",
+        col("DATE_DATEFIRSTSEEN") -
+        col("DATE_CANCERREFERRALTOTREATMENTPERIODSTARTDATE") -
+        coalesce(col("WTA_FIRSTSEENADJUSTMENT"), lit(0))
+    )
+
+    df = df.with_column(
+        "TEMP_VALUE_FDS",
+        col("TEMP_FDSENDDATE") -
+        col("DATE_CANCERREFERRALTOTREATMENTPERIODSTARTDATE") -
+        coalesce(col("WTA_FIRSTSEENADJUSTMENT"), lit(0))
+    )
+
+    df = df.with_column(
+        "TEMP_VALUE_31",
+        col("DATE_TREATMENTSTARTDATE") -
+        col("DATE_CANCERTREATMENTPERIODSTARTDATE") -
+        coalesce(col("WTA_TREATMENTADJUSTMENT"), lit(0))
+    )
+
+    df = df.with_column(
+        "TEMP_VALUE_62",
+        #If USC, Breast Symptomatic, Screening
+        when(
+            not_(pathway_upgrade),
+            col("DATE_TREATMENTSTARTDATE") -
+            col("DATE_CANCERREFERRALTOTREATMENTPERIODSTARTDATE") -
+            coalesce(col("WTA_FIRSTSEENADJUSTMENT"), lit(0)) -
+            coalesce(col("WTA_TREATMENTADJUSTMENT"), lit(0))
+        )
+        #If Upgrade then calculation depends if the upgrade date is before or
+        # on the date first seen
+        .when(
+            col("DATE_CONSULTANTUPGRADEDATE") <= col("DATE_DATEFIRSTSEEN"),
+            col("DATE_TREATMENTSTARTDATE") -
+            col("DATE_CONSULTANTUPGRADEDATE") -
+            coalesce(col("WTA_FIRSTSEENADJUSTMENT"), lit(0))  -
+            coalesce(col("WTA_TREATMENTADJUSTMENT"), lit(0))
+        )
+        .otherwise(
+            col("DATE_TREATMENTSTARTDATE") -
+            col("DATE_CONSULTANTUPGRADEDATE") -
+            coalesce(col("WTA_TREATMENTADJUSTMENT"), lit(0))
+        )
+    )
+
+    df = df.with_column(
+        "TEMP_VALUE_38",
+        when(
+            not_(pathway_upgrade),
+            col("DATE_TRANSFERTOTREATMENTDATE") -
+            col("DATE_CANCERREFERRALTOTREATMENTPERIODSTARTDATE") -
+            coalesce(col("WTA_FIRSTSEENADJUSTMENT"), lit(0))
+        )
+        .when(
+            col("DATE_CONSULTANTUPGRADEDATE") <= col("DATE_DATEFIRSTSEEN"),
+            col("DATE_TRANSFERTOTREATMENTDATE") -
+            col("DATE_CONSULTANTUPGRADEDATE") -
+            coalesce(col("WTA_FIRSTSEENADJUSTMENT"), lit(0))
+        )
+        .otherwise(
+            col("DATE_TRANSFERTOTREATMENTDATE") -
+            col("DATE_CONSULTANTUPGRADEDATE")
+        )
+    )
+
+    df = df.with_column(
+        "TEMP_VALUE_24",
+        col("DATE_TREATMENTSTARTDATE") -
+        col("DATE_TRANSFERTOTREATMENTDATE") -
+        coalesce(col("WTA_TREATMENTADJUSTMENT"), lit(0))
+    )
+
+    #Determine Accountable Investigating Provider and allocation method
+    df = df.with_column(
+        "TEMP_ACC_DIAGNOSTIC",
+        coalesce(
+            col("ORG_ACCOUNTABLEINVESTIGATING_TRUST"),
+            col("ORG_CONSULTANTUPGRADE_TRUST"),
+            col("ORG_FIRSTSEEN_TRUST")
+        )
+    )
+    acc_diagnostic = col("TEMP_ACC_DIAGNOSTIC")
+    acc_treatment = col("ORG_ACCOUNTABLETREATING_TRUST")
+
+    df = df.with_column(
+        "TEMP_ALLOCATIONMETHOD",
+        when(acc_diagnostic == acc_treatment, "Solo")
+        .when(is_null(col("ORG_ACCOUNTABLEINVESTIGATING_TRUST")), "5050")
+        .otherwise("6 Scenarios")
+    )
+    is_solo = col("TEMP_ALLOCATIONMETHOD") == "Solo"
+    is_5050 = col("TEMP_ALLOCATIONMETHOD") == "5050"
+    is_6s = col("TEMP_ALLOCATIONMETHOD") == "6 Scenarios"
+
+    #Boolean shorthand to determine breaches
+    value_62 = col("TEMP_VALUE_62")
+    value_38 = col("TEMP_VALUE_38")
+    value_24 = col("TEMP_VALUE_24")
+    d62 = (value_62 <= 62)
+    d38 = (value_38 <= 38)
+    d24 = (value_24 <= 24)
+
+    #6 Scenarios allocation is looked up by the 3-bit breach code
+    # (See utils/util_allocation.py)
+    df = df.with_column(
+        "TEMP_6S_BREACHCODE",
+        ua.breach_code_column(value_62, value_38, value_24)
+    )
+    breach_code = col("TEMP_6S_BREACHCODE")
+
+    #Valid records for each metric########################
+    #(Bits of CWT_ELIGIBILITY, see utils/util_eligibility.py)
+    valid_2ww = ue.eligible_column(ue.ELIGIBLE_2WW)
+    valid_fds = ue.eligible_column(ue.ELIGIBLE_FDS)
+    valid_31 = ue.eligible_column(
+        ue.ELIGIBLE_31DAY_FIRST | ue.ELIGIBLE_31DAY_SUB)
+    valid_62 = ue.eligible_column(ue.ELIGIBLE_62DAY)
+
+    #Build the output rows for each record################
+    #2WW, FDS and 62 Day are only reported for known pathways
+    #31 Day is not dependent on the standard pathway options
+    row_2ww = ur.performance_row(
+        valid_2ww & pathway_known,
+        col("DATE_DATEFIRSTSEEN"),
+        col("ORG_FIRSTSEEN_TRUST"),
+        col("ORG_FIRSTSEEN_SITE"),
+        col("IS_GEO_TRUST_DATEFIRSTSEEN"),
+        "2WW",
+        col("TEMP_VALUE_2WW"),
+        when(col("TEMP_VALUE_2WW") <= 14, 0).otherwise(1),
+        lit(1)
+    )
+
+    row_fds = ur.performance_row(
+        valid_fds & pathway_known,
+        col("DATE_FDSPATHWAYENDDATE"),
+        col("ORG_FDPEND_TRUST"),
+        col("ORG_FDPEND_SITE"),
+        col("IS_GEO_TRUST_FDS"),
+        "FDS",
+        col("TEMP_VALUE_FDS"),
+        when(col("TEMP_VALUE_FDS") <= 28, 0).otherwise(1),
+        lit(1)
+    )
+
+    row_31 = ur.performance_row(
+        valid_31,
+        col("DATE_TREATMENTSTARTDATE"),
+        col("ORG_ACCOUNTABLETREATING_TRUST"),
+        col("ORG_ACCOUNTABLETREATING_SITE"),
+        col("IS_GEO_TRUST_TREATMENTSTARTDATE"),
+        "31 Day",
+        col("TEMP_VALUE_31"),
+        when(col("TEMP_VALUE_31") <= 31, 0).otherwise(1),
+        lit(1)
+    )
+
+    ncl_diagnostic = coalesce(
+        col("IS_GEO_TRUST_ACCOUNTABLEINVESTIGATING"),
+        col("IS_GEO_TRUST_CONSULTANTUPGRADE"),
+        col("IS_GEO_TRUST_DATEFIRSTSEEN")
+    )
+
+    numerator_62 = when(d62, 0.0).otherwise(1.0)
+
+    #Diagnostic provider row (Also used for Solo)
+    row_62_diag = ur.performance_row(
+        valid_62 & pathway_known,
+        col("DATE_TREATMENTSTARTDATE"),
+        acc_diagnostic,
+        lit(None),
+        when(is_solo, col("IS_GEO_TRUST_TREATMENTSTARTDATE"))
+        .otherwise(ncl_diagnostic),
+        "62 Day",
+        value_62,
+        when(is_solo, numerator_62)
+        .when(is_5050, numerator_62 * 0.5)
+        .otherwise(ua.allocation_column("diag", "num", breach_code)),
+        when(is_solo, lit(1.0))
+        .when(is_5050, lit(0.5))
+        .otherwise(ua.allocation_column("diag", "den", breach_code))
+    )
+
+    #Treatment provider row (5050 and 6 Scenarios only)
+    row_62_treat = ur.performance_row(
+        valid_62 & pathway_known & not_(is_solo),
+        col("DATE_TREATMENTSTARTDATE"),
+        acc_treatment,
+        iff(is_6s, col("ORG_ACCOUNTABLETREATING_SITE"), lit(None)),
+        col("IS_GEO_TRUST_TREATMENTSTARTDATE"),
+        "62 Day",
+        value_62,
+        when(is_5050, numerator_62 * 0.5)
+        .otherwise(ua.allocation_column("treat", "num", breach_code)),
+        when(is_5050, lit(0.5))
+        .otherwise(ua.allocation_column("treat", "den", breach_code))
+    )
+
+    #38 Day and 24 Day Performance (6 Scenarios only)
+    row_38 = ur.performance_row(
+        valid_62 & pathway_known & is_6s,
+        col("DATE_TREATMENTSTARTDATE"),
+        acc_diagnostic,
+        lit(None),
+        ncl_diagnostic,
+        "38 Day",
+        value_38,
+        when(d38, 0).otherwise(1),
+        lit(1)
+    )
+
+    row_24 = ur.performance_row(
+        valid_62 & pathway_known & is_6s,
+        col("DATE_TREATMENTSTARTDATE"),
+        acc_treatment,
+        col("ORG_ACCOUNTABLETREATING_SITE"),
+        col("IS_GEO_TRUST_TREATMENTSTARTDATE"),
+        "24 Day",
+        value_24,
+        when(d24, 0).otherwise(1),
+        lit(1)
+    )
+
+    #Collect the rows for each record and explode them into the long format
+    #(Every row of a record has the record's PATHWAY)
+    df = ur.explode_rows(df, [
+        row_2ww, row_fds, row_31,
+        row_62_diag, row_62_treat, row_38, row_24
+    ], keep_cols=["RECORD_ID", "PATHWAY"])
+
+    return df.select(["RECORD_ID"] + list(ur.per_types) + ["PATHWAY"])
+
+#Load env settings
+load_dotenv(override=True)
+config = toml.load("config.toml")
+
+feature_dynamic_params = {
+    "base_table": "CWT_BASE",
+    "query_tag": "CANCER DYNAMIC TABLE FOR CWT PERFORMANCE",
+
+    "session_database": getenv("DATABASE"),
+    "session_schema": getenv("SCHEMA"),
+    "account": getenv("ACCOUNT"),
+    "user": getenv("USER"),
+    "authenticator": getenv("AUTHENTICATOR"),
+    "role": getenv("ROLE"),
+    "warehouse": getenv("WAREHOUSE"),
+
+    "destination_database": getenv("DATABASE"),
+    "destination_schema": getenv("SCHEMA"),
+    "destination_table": "CWT_PERFORMANCE",
+
+    "fdt_comment": "Performance data for each metric built in a single pass of CWT_BASE"
+}
+
+if __name__ == "__main__":
+    us.create_dynamic_features(transformation_func=performance_all, params=feature_dynamic_params)
@@ -4,20 +4,23 @@ from dotenv import load_dotenv
 from os import getenv
 
 #Snowflake imports
-from snowflake.snowpark.functions import col, is_null, not_, when, month, year, lit, coalesce
+from snowflake.snowpark.functions import col, when, month, year, lit, coalesce
 from snowflake.ml.feature_store import FeatureView
 
 #Utility script imports
 import utils.util_snowflake as us
+import utils.util_eligibility as ue
+import utils.util_pathway as upw
 
 #Function to derive the 2ww performance figures
 def performance_2ww(df):
-    #Filter out to only valid 2ww records
-    df = df.where(
-        (col("PATHWAY_PRIORITYTYPE_CODE") == 3) &
-        (col("PATHWAY_SOURCEOFREFERRALFOROUTPATIENT_CODE") != 17) &
-        not_(is_null(col("DATE_CANCERREFERRALTOTREATMENTPERIODSTARTDATE"))) &
-        not_(is_null(col("DATE_DATEFIRSTSEEN")))        
+    #Filter out to only valid 2ww records (See utils/util_eligibility.py)
+    df = df.where(ue.eligible_column(ue.ELIGIBLE_2WW))
+
+    #Stamp the pathway of the base row (See utils/util_pathway.py)
+    df = df.with_column(
+        "PATHWAY",
+        upw.pathway_column()
     )
 
     #Set the Date fields
@@ -76,10 +79,7 @@ def performance_2ww(df):
     #Remove unused columns
     df = df[["RECORD_ID", "PER_DATE_YEAR", "PER_DATE_MONTH", 
             "PER_ORG_TRUST", "PER_ORG_SITE", "PER_ORG_NCL", "PER_METRIC", 
-            "PER_VALUE", "PER_NUMERATOR", "PER_DENOMINATOR"]]
-
-    print("Sample of output:")
-    df.show()
+            "PER_VALUE", "PER_NUMERATOR", "PER_DENOMINATOR", "PATHWAY"]]
 
     return df
 
@@ -106,4 +106,5 @@ feature_dynamic_params = {
     "fdt_comment": "Calculates 2WW Performance"
 }
 
-us.create_dynamic_features(transformation_func=performance_2ww, params=feature_dynamic_params)
\ No newline at end of file
+if __name__ == "__main__":
+    us.create_dynamic_features(transformation_func=performance_2ww, params=feature_dynamic_params)
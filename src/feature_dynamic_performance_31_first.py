@@ -4,20 +4,23 @@ from dotenv import load_dotenv
 from os import getenv
 
 #Snowflake imports
-from snowflake.snowpark.functions import col, is_null, not_, when, month, year, lit, coalesce, in_
+from snowflake.snowpark.functions import col, when, month, year, lit, coalesce
 
 #Utility script imports
 import utils.util_snowflake as us
+import utils.util_eligibility as ue
+import utils.util_pathway as upw
 
 #Function to derive the 31 day performance figures (First Treatment)
 def performance_31day_first(df):
     #Filter out to only valid 31 Day (First Treatment) records
-    df = df.where(
-        (in_([col("PATHWAY_CANCERTREATMENTEVENTTYPE_CODE")], ["01", "07", "12"])) &
-        (col("PATHWAY_CANCERTREATMENTMODALITY_CODE") != 98) &
-        not_(is_null(col("CWT_PRIMARYDIAGNOSIS_CODE"))) &
-        not_(is_null(col("DATE_CANCERTREATMENTPERIODSTARTDATE"))) &
-        not_(is_null(col("DATE_TREATMENTSTARTDATE")))        
+    # (See utils/util_eligibility.py)
+    df = df.where(ue.eligible_column(ue.ELIGIBLE_31DAY_FIRST))
+
+    #Stamp the pathway of the base row (See utils/util_pathway.py)
+    df = df.with_column(
+        "PATHWAY",
+        upw.pathway_column()
     )
 
     #Set the Date fields
@@ -78,10 +81,7 @@ def performance_31day_first(df):
     #Remove unused columns
     df = df[["RECORD_ID", "PER_DATE_YEAR", "PER_DATE_MONTH", 
             "PER_ORG_TRUST", "PER_ORG_SITE", "PER_ORG_NCL", "PER_METRIC", 
-            "PER_VALUE", "PER_NUMERATOR", "PER_DENOMINATOR"]]
-
-    print("Sample of output:")
-    df.show()
+            "PER_VALUE", "PER_NUMERATOR", "PER_DENOMINATOR", "PATHWAY"]]
 
     return df
 
@@ -108,4 +108,5 @@ feature_dynamic_params = {
     "fdt_comment": "Calculates 31 Day Performance (First Treatment)"
 }
 
-us.create_dynamic_features(transformation_func=performance_31day_first, params=feature_dynamic_params)
\ No newline at end of file
+if __name__ == "__main__":
+    us.create_dynamic_features(transformation_func=performance_31day_first, params=feature_dynamic_params)
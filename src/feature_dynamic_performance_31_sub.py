@@ -4,21 +4,23 @@ from dotenv import load_dotenv
 from os import getenv
 
 #Snowflake imports
-from snowflake.snowpark.functions import col, is_null, not_, when, month, year, lit, coalesce, in_
+from snowflake.snowpark.functions import col, when, month, year, lit, coalesce, in_
 
 #Utility script imports
 import utils.util_snowflake as us
+import utils.util_eligibility as ue
+import utils.util_pathway as upw
 
 #Function to derive the 31 day performance figures (Subsequent Treatments)
 def performance_31day_sub(df):
     #Filter out to only valid 31 Day (Subsequent Treatments) records
-    df = df.where(
-        (in_([col("PATHWAY_CANCERTREATMENTEVENTTYPE_CODE")], 
-             ["02", "03", "04", "05", "06", "08", "09", "10", "11"])) &
-        (col("PATHWAY_CANCERTREATMENTMODALITY_CODE") != 98) &
-        not_(is_null(col("CWT_PRIMARYDIAGNOSIS_CODE"))) &
-        not_(is_null(col("DATE_CANCERTREATMENTPERIODSTARTDATE"))) &
-        not_(is_null(col("DATE_TREATMENTSTARTDATE")))        
+    # (See utils/util_eligibility.py)
+    df = df.where(ue.eligible_column(ue.ELIGIBLE_31DAY_SUB))
+
+    #Stamp the pathway of the base row (See utils/util_pathway.py)
+    df = df.with_column(
+        "PATHWAY",
+        upw.pathway_column()
     )
 
     #Add field for 31 Day Breakdown
@@ -94,12 +96,9 @@ def performance_31day_sub(df):
     #Remove unused columns
     df = df[["RECORD_ID", "PER_DATE_YEAR", "PER_DATE_MONTH", 
             "PER_ORG_TRUST", "PER_ORG_SITE", "PER_ORG_NCL", "PER_METRIC", 
-            "PER_VALUE", "PER_NUMERATOR", "PER_DENOMINATOR",
+            "PER_VALUE", "PER_NUMERATOR", "PER_DENOMINATOR", "PATHWAY",
             "D31_BREAKDOWN"]]
 
-    print("Sample of output:")
-    df.show()
-
     return df
 
 #Load env settings
@@ -125,4 +124,5 @@ feature_dynamic_params = {
     "fdt_comment": "Calculates 31 Day Performance (Subsequent Treatments)"
 }
 
-us.create_dynamic_features(transformation_func=performance_31day_sub, params=feature_dynamic_params)
\ No newline at end of file
+if __name__ == "__main__":
+    us.create_dynamic_features(transformation_func=performance_31day_sub, params=feature_dynamic_params)
@@ -4,31 +4,37 @@ from dotenv import load_dotenv
 from os import getenv
 
 #Snowflake imports
-from snowflake.snowpark.functions import col, is_null, not_, when, month, year, lit, coalesce, in_
+from snowflake.snowpark.functions import col, is_null, not_, when, month, year, lit, coalesce, iff
 from snowflake.snowpark import Row
 
 #Utility script imports
 import utils.util_snowflake as us
+import utils.util_allocation as ua
+import utils.util_rows as ur
+import utils.util_eligibility as ue
+import utils.util_pathway as upw
+
+#Columns in the CWT_PERFORMANCE_62DAY table
+d62_cols = ["RECORD_ID", "PER_DATE_YEAR", "PER_DATE_MONTH",
+    "PER_ORG_TRUST", "PER_ORG_SITE", "PER_ORG_NCL", "PER_METRIC",
+    "PER_VALUE", "PER_NUMERATOR", "PER_DENOMINATOR", "PATHWAY",
+    "D62_ACC_DIAGNOSTIC", "D62_ACC_TREATMENT",
+    "D62_ALLOCATIONMETHOD", "D62_6S_SCENARIO"]
 
 #Function to derive the 31 day performance figures (First Treatment)
 def performance_62day(df):
 
     #Define Upgrade pathway as some logic is dependent on it
-    pathway_upgrade = (
-        (col("PATHWAY_SOURCEOFREFERRALFOROUTPATIENT_CODE") != 17) &
-        not_(is_null(col("DATE_CONSULTANTUPGRADEDATE")))
-    )
+    pathway_upgrade = upw.upgrade_column()
      
-    #Filter out to only valid 62 Day records
-    df = df.where(
-        (in_([col("PATHWAY_CANCERTREATMENTEVENTTYPE_CODE")], ["01", "07", "12"])) &
-        (col("PATHWAY_CANCERTREATMENTMODALITY_CODE") != 98) &
-        not_(is_null(col("CWT_PRIMARYDIAGNOSIS_CODE"))) &
-        not_(is_null(col("DATE_CANCERTREATMENTPERIODSTARTDATE"))) &
-        not_(is_null(col("DATE_TREATMENTSTARTDATE"))) &
-        #Additional requirement
-        #(For all USC, Screening activity; First Seen Org is required)
-        (not_(is_null(col("ORG_FIRSTSEEN_TRUST"))) | pathway_upgrade)
+    #Filter out to only valid 62 Day records (See utils/util_eligibility.py)
+    #(For all USC, Screening activity; First Seen Org is required)
+    df = df.where(ue.eligible_column(ue.ELIGIBLE_62DAY))
+
+    #Stamp the pathway of the base row (See utils/util_pathway.py)
+    df = df.with_column(
+        "PATHWAY",
+        upw.pathway_column()
     )
 
     #Set the Date fields
@@ -236,49 +242,22 @@ def performance_62day(df):
             coalesce(df_6s["WTA_TREATMENTADJUSTMENT"], lit(0))
     )
 
-    #Determine Scenario
+    #Determine Scenario from the 3-bit breach code
+    #(The scenario matrix and allocation are defined in util_allocation)
+    df_6s = df_6s.with_column(
+        "TEMP_6S_BREACHCODE",
+        ua.breach_code_column(col("PER_VALUE"), col("PER_38D"), col("PER_24D"))
+    )
 
-    #Boolean shorthand to determine breaches
-    d62 = (col("PER_VALUE") <= 62)
-    d38 = (col("PER_38D") <= 38)
-    d24 = (col("PER_24D") <= 24)
-    nd62 = not_(d62)
-    nd38 = not_(d38)
-    nd24 = not_(d24)
-
-    #Dictionary containing patient allocation based on the organisation
-    #Note the numerator values are inversed because the table should show 
-    # breaches whereas the Scenario Allocation Logic is for awarding credit
-    dict_6s = {
-        "diag":{
-            1:{"num": 0, "den":0.5},
-            2:{"num": 0, "den":0.5},
-            3:{"num": 0,   "den":0},
-            4:{"num": 0,   "den":0},
-            5:{"num": 1,   "den":1},
-            6:{"num": 0.5,   "den":0.5},
-        },
-        "treat":{
-            1:{"num": 0, "den":0.5},
-            2:{"num": 0, "den":0.5},
-            3:{"num": 0,   "den":1},
-            4:{"num": 1,   "den":1},
-            5:{"num": 0,   "den":0},
-            6:{"num": 0.5,   "den":0.5},
-        }
-    }
-
-    #Determine which scenario
     df_6s = df_6s.with_column(
         "D62_6S_SCENARIO",
-        when( d62  & d38  & d24,  1)
-        .when(d62  & d38  & nd24, 2)
-        .when(d62  & nd38 & d24,  3)
-        .when(nd62 & d38  & nd24, 4)
-        .when(nd62 & nd38 & d24,  5)
-        .when(nd62 & nd38 & nd24, 6)
+        ua.scenario_column(col("TEMP_6S_BREACHCODE"))
     )
 
+    #Boolean shorthand for the 38 Day and 24 Day Performance
+    d38 = (col("PER_38D") <= 38)
+    d24 = (col("PER_24D") <= 24)
+
     #Diagnostic 6S
     df_6s_diag = df_6s
 
@@ -307,22 +286,12 @@ def performance_62day(df):
     #Calculate patient allocation
     df_6s_diag = df_6s_diag.with_column(
         "PER_NUMERATOR",
-        when(df_6s_diag["D62_6S_SCENARIO"] == 1, dict_6s["diag"][1]["num"])
-        .when(df_6s_diag["D62_6S_SCENARIO"] == 2, dict_6s["diag"][2]["num"])
-        .when(df_6s_diag["D62_6S_SCENARIO"] == 3, dict_6s["diag"][3]["num"])
-        .when(df_6s_diag["D62_6S_SCENARIO"] == 4, dict_6s["diag"][4]["num"])
-        .when(df_6s_diag["D62_6S_SCENARIO"] == 5, dict_6s["diag"][5]["num"])
-        .when(df_6s_diag["D62_6S_SCENARIO"] == 6, dict_6s["diag"][6]["num"])
+        ua.allocation_column("diag", "num", col("TEMP_6S_BREACHCODE"))
     )
 
     df_6s_diag = df_6s_diag.with_column(
         "PER_DENOMINATOR",
-        when(df_6s_diag["D62_6S_SCENARIO"] == 1, dict_6s["diag"][1]["den"])
-        .when(df_6s_diag["D62_6S_SCENARIO"] == 2, dict_6s["diag"][2]["den"])
-        .when(df_6s_diag["D62_6S_SCENARIO"] == 3, dict_6s["diag"][3]["den"])
-        .when(df_6s_diag["D62_6S_SCENARIO"] == 4, dict_6s["diag"][4]["den"])
-        .when(df_6s_diag["D62_6S_SCENARIO"] == 5, dict_6s["diag"][5]["den"])
-        .when(df_6s_diag["D62_6S_SCENARIO"] == 6, dict_6s["diag"][6]["den"])
+        ua.allocation_column("diag", "den", col("TEMP_6S_BREACHCODE"))
     )
 
     #Treatment 6S
@@ -349,22 +318,12 @@ def performance_62day(df):
     #Calculate patient allocation
     df_6s_treat = df_6s_treat.with_column(
         "PER_NUMERATOR",
-        when(df_6s_treat["D62_6S_SCENARIO"] == 1, dict_6s["treat"][1]["num"])
-        .when(df_6s_treat["D62_6S_SCENARIO"] == 2, dict_6s["treat"][2]["num"])
-        .when(df_6s_treat["D62_6S_SCENARIO"] == 3, dict_6s["treat"][3]["num"])
-        .when(df_6s_treat["D62_6S_SCENARIO"] == 4, dict_6s["treat"][4]["num"])
-        .when(df_6s_treat["D62_6S_SCENARIO"] == 5, dict_6s["treat"][5]["num"])
-        .when(df_6s_treat["D62_6S_SCENARIO"] == 6, dict_6s["treat"][6]["num"])
+        ua.allocation_column("treat", "num", col("TEMP_6S_BREACHCODE"))
     )
 
     df_6s_treat = df_6s_treat.with_column(
         "PER_DENOMINATOR",
-        when(df_6s_treat["D62_6S_SCENARIO"] == 1, dict_6s["treat"][1]["den"])
-        .when(df_6s_treat["D62_6S_SCENARIO"] == 2, dict_6s["treat"][2]["den"])
-        .when(df_6s_treat["D62_6S_SCENARIO"] == 3, dict_6s["treat"][3]["den"])
-        .when(df_6s_treat["D62_6S_SCENARIO"] == 4, dict_6s["treat"][4]["den"])
-        .when(df_6s_treat["D62_6S_SCENARIO"] == 5, dict_6s["treat"][5]["den"])
-        .when(df_6s_treat["D62_6S_SCENARIO"] == 6, dict_6s["treat"][6]["den"])
+        ua.allocation_column("treat", "den", col("TEMP_6S_BREACHCODE"))
     )
 
     #Calculate 38 Day Performance
@@ -416,12 +375,6 @@ def performance_62day(df):
     df_6s_extra = df_6s_diag_d38.union_all(df_6s_treat_d24)
 
     #Remove unused columns
-    d62_cols = ["RECORD_ID", "PER_DATE_YEAR", "PER_DATE_MONTH", 
-        "PER_ORG_TRUST", "PER_ORG_SITE", "PER_ORG_NCL", "PER_METRIC", 
-        "PER_VALUE", "PER_NUMERATOR", "PER_DENOMINATOR",
-        "D62_ACC_DIAGNOSTIC", "D62_ACC_TREATMENT", 
-        "D62_ALLOCATIONMETHOD", "D62_6S_SCENARIO"]
-    
     df_solo = df_solo.select(d62_cols)
     df_5050 = df_5050.select(d62_cols)
     df_6s = df_6s.select(d62_cols)
@@ -436,11 +389,203 @@ def performance_62day(df):
     #Apply 6s allocation
     #Move solo, 5050, 6s allocation to their own functions
 
-    print("Sample of output:")
+    return df_out
+
+#Function to derive the 62 day performance figures from a single scan
+#Every provider allocation row for a record is built as an object and the
+# objects are exploded with flatten instead of splitting the base by
+# allocation method and unioning the branches back together
+def performance_62day_single_scan(df):
 
-    df_out.show()
+    #Define Upgrade pathway as some logic is dependent on it
+    pathway_upgrade = upw.upgrade_column()
 
-    return df_out
+    #Filter out to only valid 62 Day records (See utils/util_eligibility.py)
+    #(For all USC, Screening activity; First Seen Org is required)
+    df = df.where(ue.eligible_column(ue.ELIGIBLE_62DAY))
+
+    #Stamp the pathway of the base row (See utils/util_pathway.py)
+    df = df.with_column(
+        "PATHWAY",
+        upw.pathway_column()
+    )
+
+    #Calculate the 62 Day, 38 Day and 24 Day values
+    df = df.with_column(
+        "TEMP_VALUE_62",
+        #If USC, Breast Symptomatic, Screening
+        when(
+            not_(pathway_upgrade),
+            col("DATE_TREATMENTSTARTDATE") -
+            col("DATE_CANCERREFERRALTOTREATMENTPERIODSTARTDATE") -
+            coalesce(col("WTA_FIRSTSEENADJUSTMENT"), lit(0)) -
+            coalesce(col("WTA_TREATMENTADJUSTMENT"), lit(0))
+        )
+        #If Upgrade then calculation depends if the upgrade date is before or
+        # on the date first seen
+        .when(
+            col("DATE_CONSULTANTUPGRADEDATE") <= col("DATE_DATEFIRSTSEEN"),
+            col("DATE_TREATMENTSTARTDATE") -
+            col("DATE_CONSULTANTUPGRADEDATE") -
+            coalesce(col("WTA_FIRSTSEENADJUSTMENT"), lit(0)) -
+            coalesce(col("WTA_TREATMENTADJUSTMENT"), lit(0))
+        )
+        .otherwise(
+            col("DATE_TREATMENTSTARTDATE") -
+            col("DATE_CONSULTANTUPGRADEDATE") -
+            coalesce(col("WTA_TREATMENTADJUSTMENT"), lit(0))
+        )
+    )
+
+    df = df.with_column(
+        "TEMP_VALUE_38",
+        when(
+            not_(pathway_upgrade),
+            col("DATE_TRANSFERTOTREATMENTDATE") -
+            col("DATE_CANCERREFERRALTOTREATMENTPERIODSTARTDATE") -
+            coalesce(col("WTA_FIRSTSEENADJUSTMENT"), lit(0))
+        )
+        .when(
+            col("DATE_CONSULTANTUPGRADEDATE") <= col("DATE_DATEFIRSTSEEN"),
+            col("DATE_TRANSFERTOTREATMENTDATE") -
+            col("DATE_CONSULTANTUPGRADEDATE") -
+            coalesce(col("WTA_FIRSTSEENADJUSTMENT"), lit(0))
+        )
+        .otherwise(
+            col("DATE_TRANSFERTOTREATMENTDATE") -
+            col("DATE_CONSULTANTUPGRADEDATE")
+        )
+    )
+
+    df = df.with_column(
+        "TEMP_VALUE_24",
+        col("DATE_TREATMENTSTARTDATE") -
+        col("DATE_TRANSFERTOTREATMENTDATE") -
+        coalesce(col("WTA_TREATMENTADJUSTMENT"), lit(0))
+    )
+
+    value_62 = col("TEMP_VALUE_62")
+    value_38 = col("TEMP_VALUE_38")
+    value_24 = col("TEMP_VALUE_24")
+
+    #Determine Accountable Investigating Provider
+    df = df.with_column(
+        "D62_ACC_DIAGNOSTIC",
+        coalesce(
+            col("ORG_ACCOUNTABLEINVESTIGATING_TRUST"),
+            col("ORG_CONSULTANTUPGRADE_TRUST"),
+            col("ORG_FIRSTSEEN_TRUST")
+        )
+    )
+
+    df = df.with_column(
+        "D62_ACC_TREATMENT",
+        col("ORG_ACCOUNTABLETREATING_TRUST")
+    )
+
+    #Determine allocation method
+    df = df.with_column(
+        "D62_ALLOCATIONMETHOD",
+        when(
+            col("D62_ACC_DIAGNOSTIC") == col("D62_ACC_TREATMENT"),
+            "Solo")
+        .when(
+            is_null(col("ORG_ACCOUNTABLEINVESTIGATING_TRUST")),
+            "5050")
+        .otherwise("6 Scenarios")
+    )
+    is_solo = col("D62_ALLOCATIONMETHOD") == "Solo"
+    is_5050 = col("D62_ALLOCATIONMETHOD") == "5050"
+    is_6s = col("D62_ALLOCATIONMETHOD") == "6 Scenarios"
+
+    #Determine Scenario from the 3-bit breach code (6 Scenarios only)
+    df = df.with_column(
+        "TEMP_6S_BREACHCODE",
+        iff(is_6s, ua.breach_code_column(value_62, value_38, value_24), lit(None))
+    )
+    breach_code = col("TEMP_6S_BREACHCODE")
+
+    df = df.with_column(
+        "D62_6S_SCENARIO",
+        ua.scenario_column(breach_code)
+    )
+
+    ncl_diagnostic = coalesce(
+        col("IS_GEO_TRUST_ACCOUNTABLEINVESTIGATING"),
+        col("IS_GEO_TRUST_CONSULTANTUPGRADE"),
+        col("IS_GEO_TRUST_DATEFIRSTSEEN")
+    )
+
+    numerator_62 = when(value_62 <= 62, 0.0).otherwise(1.0)
+
+    #Diagnostic provider row (Also used for Solo)
+    row_diag = ur.performance_row(
+        lit(True),
+        col("DATE_TREATMENTSTARTDATE"),
+        col("D62_ACC_DIAGNOSTIC"),
+        lit(None),
+        when(is_solo, col("IS_GEO_TRUST_TREATMENTSTARTDATE"))
+        .otherwise(ncl_diagnostic),
+        "62 Day",
+        value_62,
+        when(is_solo, numerator_62)
+        .when(is_5050, numerator_62 * 0.5)
+        .otherwise(ua.allocation_column("diag", "num", breach_code)),
+        when(is_solo, lit(1.0))
+        .when(is_5050, lit(0.5))
+        .otherwise(ua.allocation_column("diag", "den", breach_code))
+    )
+
+    #Treatment provider row (5050 and 6 Scenarios only)
+    row_treat = ur.performance_row(
+        not_(is_solo),
+        col("DATE_TREATMENTSTARTDATE"),
+        col("D62_ACC_TREATMENT"),
+        iff(is_6s, col("ORG_ACCOUNTABLETREATING_SITE"), lit(None)),
+        col("IS_GEO_TRUST_TREATMENTSTARTDATE"),
+        "62 Day",
+        value_62,
+        when(is_5050, numerator_62 * 0.5)
+        .otherwise(ua.allocation_column("treat", "num", breach_code)),
+        when(is_5050, lit(0.5))
+        .otherwise(ua.allocation_column("treat", "den", breach_code))
+    )
+
+    #38 Day and 24 Day Performance (6 Scenarios only)
+    row_38 = ur.performance_row(
+        is_6s,
+        col("DATE_TREATMENTSTARTDATE"),
+        col("D62_ACC_DIAGNOSTIC"),
+        lit(None),
+        ncl_diagnostic,
+        "38 Day",
+        value_38,
+        when(value_38 <= 38, 0).otherwise(1),
+        lit(1)
+    )
+
+    row_24 = ur.performance_row(
+        is_6s,
+        col("DATE_TREATMENTSTARTDATE"),
+        col("D62_ACC_TREATMENT"),
+        col("ORG_ACCOUNTABLETREATING_SITE"),
+        col("IS_GEO_TRUST_TREATMENTSTARTDATE"),
+        "24 Day",
+        value_24,
+        when(value_24 <= 24, 0).otherwise(1),
+        lit(1)
+    )
+
+    #Explode the rows and keep the D62_ fields of the record on each row
+    df = ur.explode_rows(
+        df,
+        [row_diag, row_treat, row_38, row_24],
+        keep_cols=["RECORD_ID", "PATHWAY", "D62_ACC_DIAGNOSTIC",
+                   "D62_ACC_TREATMENT", "D62_ALLOCATIONMETHOD",
+                   "D62_6S_SCENARIO"]
+    )
+
+    return df.select(d62_cols)
 
 #Load env settings
 load_dotenv(override=True)
@@ -465,21 +610,5 @@ feature_dynamic_params = {
     "fdt_comment": "Calculates 62 Day Performance"
 }
 
-#Create a Snowflake session
-connection_params = {
-    "account": getenv("ACCOUNT"),
-    "user": getenv("USER"),
-    "authenticator": getenv("AUTHENTICATOR"),
-    "role": getenv("ROLE"),
-    "warehouse": getenv("WAREHOUSE"),
-    "database": getenv("DATABASE"),
-    "schema": "CANCER_CWT"
-}
-
-session = us.snowpark_session_create(
-    connection_params, "Build 62 Day Performance table")
-
-#Load the base data
-df_base = session.table("CWT_BASE")
-
-us.create_dynamic_features(transformation_func=performance_62day, params=feature_dynamic_params)
\ No newline at end of file
+if __name__ == "__main__":
+    us.create_dynamic_features(transformation_func=performance_62day, params=feature_dynamic_params)
@@ -4,17 +4,27 @@ from dotenv import load_dotenv
 from os import getenv
 
 #Snowflake imports
-from snowflake.snowpark.functions import col, is_null, not_, when, month, year, lit, coalesce, in_
+from snowflake.snowpark.functions import col, when, month, year, lit, coalesce
 from snowflake.ml.feature_store import FeatureView
 
 #Utility script imports
 import utils.util_snowflake as us
+import utils.util_eligibility as ue
+import utils.util_pathway as upw
 
 #Function to derive the FDS performance figures
 def performance_fds(df):
 
-    #Calculate the PER_VALUE first since it is needed in the filter for valid records
-    ##Determine which end date column to use
+    #Filter out to only valid FDS records (See utils/util_eligibility.py)
+    df = df.where(ue.eligible_column(ue.ELIGIBLE_FDS))
+
+    #Stamp the pathway of the base row (See utils/util_pathway.py)
+    df = df.with_column(
+        "PATHWAY",
+        upw.pathway_column()
+    )
+
+    #Determine which end date column to use for the value
     df = df.with_column(
         "TEMP_FDSENDDATE",
         when((
@@ -32,20 +42,6 @@ def performance_fds(df):
         coalesce(df["WTA_FIRSTSEENADJUSTMENT"], lit(0))
     )
 
-    #Filter out to only valid FDS records
-    df = df.where(
-        (
-            (in_([col("PATHWAY_FDPENDREASON_CODE")], ["01", "02", "04"])) |
-            (
-                (col("PATHWAY_FDPENDREASON_CODE") == "03") &
-                (col("PATHWAY_FDPEXCLUSIONREASON_CODE") == "01") &
-                (col("PER_VALUE") > 28)
-            )
-        ) &
-        not_(is_null(col("DATE_CANCERREFERRALTOTREATMENTPERIODSTARTDATE"))) &
-        not_(is_null(col("DATE_FDSPATHWAYENDDATE"))) 
-    )
-
     #Set the Date fields
     df = df.with_column(
         "PER_DATE_YEAR",
@@ -95,10 +91,7 @@ def performance_fds(df):
     #Remove unused columns
     df = df[["RECORD_ID", "PER_DATE_YEAR", "PER_DATE_MONTH", 
             "PER_ORG_TRUST", "PER_ORG_SITE", "PER_ORG_NCL", "PER_METRIC", 
-            "PER_VALUE", "PER_NUMERATOR", "PER_DENOMINATOR"]]
-
-    print("Sample of output:")
-    df.show()
+            "PER_VALUE", "PER_NUMERATOR", "PER_DENOMINATOR", "PATHWAY"]]
 
     return df
 
@@ -125,4 +118,5 @@ feature_dynamic_params = {
     "fdt_comment": "Calculates FDS Performance"
 }
 
-us.create_dynamic_features(transformation_func=performance_fds, params=feature_dynamic_params)
\ No newline at end of file
+if __name__ == "__main__":
+    us.create_dynamic_features(transformation_func=performance_fds, params=feature_dynamic_params)
@@ -0,0 +1,90 @@
+#General imports
+import toml
+from dotenv import load_dotenv
+import os
+from os import getenv
+
+#Utility script imports
+import utils.util_columns as ucol
+import utils.util_local as ul
+import utils.util_org as org
+import utils.util_parquet as upq
+import utils.util_sketch as usk
+
+#Script to build every performance table locally from an extract of CWT_BASE
+#This uses the same metric definitions as the feature_dynamic_*.py scripts
+# but runs them with pandas/NumPy so rule changes can be tested without
+# rebuilding the dynamic tables
+
+#Load env settings
+load_dotenv(override=True)
+config = toml.load("config.toml")
+
+feature_local_params = {
+    "base_path": getenv("LOCAL_BASE_PATH", "data/cwt_base.parquet"),
+    "destination_folder": getenv("LOCAL_OUTPUT_FOLDER", "output"),
+    #(Optional) Saved organisation lookup (See util_org.org_lookup_save) to
+    # resolve the trusts and NCL flags with instead of those in the extract
+    "org_lookup_path": getenv("LOCAL_ORG_LOOKUP_PATH")
+}
+
+#Destination table names match the dynamic tables
+local_features = {
+    "CWT_PATHWAY": ul.determine_pathway,
+    "CWT_PERFORMANCE_2WW": ul.performance_2ww,
+    "CWT_PERFORMANCE_FDS": ul.performance_fds,
+    "CWT_PERFORMANCE_31DAY_FIRST": ul.performance_31day_first,
+    "CWT_PERFORMANCE_31DAY_SUBSEQUENT": ul.performance_31day_sub,
+    "CWT_PERFORMANCE_62DAY": ul.performance_62day
+}
+
+#Load the base data once for all metrics, only reading the columns they use
+# (and the organisation codes if they are resolved)
+columns = ucol.base_columns(*local_features.values())
+if feature_local_params["org_lookup_path"]:
+    columns = list(dict.fromkeys(
+        columns + [code_col for code_col, _, _ in ul.ORG_COLUMNS] +
+        ["ORG_ACCOUNTABLEINVESTIGATING_TRUST"]))
+df_base = ul.load_base(feature_local_params["base_path"], columns)
+
+#Resolve the organisations with the current mapping, so an extract taken
+# before an organisation change gives the same trusts as CWT_BASE
+if feature_local_params["org_lookup_path"]:
+    df_base = ul.resolve_orgs(df_base, org.org_lookup_load(
+        path=feature_local_params["org_lookup_path"]))
+
+outputs = {}
+for destination_table, transformation_func in local_features.items():
+    outputs[destination_table] = ul.create_local_features(
+        transformation_func=transformation_func,
+        params={**feature_local_params, "destination_table": destination_table},
+        df_base=df_base
+    )
+
+#Partitioned copy of the performance tables for filtered reads
+# (See util_parquet.read_performance)
+upq.write_local_performance(
+    {table: df for table, df in outputs.items()
+     if table in upq.PERFORMANCE_TABLES},
+    os.path.join(feature_local_params["destination_folder"], "CWT_PERFORMANCE")
+)
+
+#Local version of CWT_PERFORMANCE (Known pathways only for 2WW, FDS, 62 Day)
+df_performance = ul.combine_performance(
+    {table: df for table, df in outputs.items()
+     if table in upq.PERFORMANCE_TABLES})
+
+#Waiting time histogram for any threshold performance
+# (See util_histogram.threshold_performance)
+ul.value_histogram(df_performance).to_parquet(
+    os.path.join(feature_local_params["destination_folder"],
+                 "CWT_VALUE_HISTOGRAM.parquet"),
+    index=False
+)
+
+#Waiting time quantile sketches (See util_sketch.sketch_quantiles)
+usk.value_sketch(df_performance).to_parquet(
+    os.path.join(feature_local_params["destination_folder"],
+                 "CWT_VALUE_SKETCH.parquet"),
+    index=False
+)
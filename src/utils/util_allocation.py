@@ -0,0 +1,118 @@
+import numpy as np
+
+from snowflake.snowpark.functions import array_construct, get, lit, when
+from snowflake.snowpark.types import DoubleType, LongType
+
+#6 Scenarios allocation for 62 Day patients shared between providers
+#The breach code is a 3-bit number for the 62/38/24 Day waits:
+#   4 if the 62 Day wait is breached
+# + 2 if the 38 Day wait is breached
+# + 1 if the 24 Day wait is breached
+#The code is Null if any of the waits are Null
+
+#Scenario for each breach code (Codes 3 and 4 are not covered by a scenario)
+SCENARIO_BY_BREACH_CODE = [1, 2, 3, None, None, 4, 5, 6]
+
+#Patient allocation based on the organisation
+#Note the numerator values are inversed because the table should show
+# breaches whereas the Scenario Allocation Logic is for awarding credit
+ALLOCATION_6S = {
+    "diag":{
+        1:{"num": 0, "den":0.5},
+        2:{"num": 0, "den":0.5},
+        3:{"num": 0,   "den":0},
+        4:{"num": 0,   "den":0},
+        5:{"num": 1,   "den":1},
+        6:{"num": 0.5,   "den":0.5},
+    },
+    "treat":{
+        1:{"num": 0, "den":0.5},
+        2:{"num": 0, "den":0.5},
+        3:{"num": 0,   "den":1},
+        4:{"num": 1,   "den":1},
+        5:{"num": 0,   "den":0},
+        6:{"num": 0.5,   "den":0.5},
+    }
+}
+
+def allocation_by_breach_code(provider, field):
+    """
+    Get the allocation for each breach code as a list.
+    provider: "diag" or "treat"
+    field: "num" or "den"
+    Returns:
+        - allocation: List of 8 values indexed by breach code (None if no scenario)
+    """
+
+    return [
+        ALLOCATION_6S[provider][scenario][field] if scenario else None
+        for scenario in SCENARIO_BY_BREACH_CODE
+    ]
+
+#Snowpark expressions##########################################################
+
+def breach_code_column(value_62, value_38, value_24):
+    """
+    Column expression for the breach code of the 62/38/24 Day values.
+    """
+
+    return (
+        when(value_62 <= 62, 0).when(value_62 > 62, 4) +
+        when(value_38 <= 38, 0).when(value_38 > 38, 2) +
+        when(value_24 <= 24, 0).when(value_24 > 24, 1)
+    )
+
+def _lookup_column(values, breach_code, data_type):
+    #Index into a constant array instead of a CASE per breach code
+    return get(
+        array_construct(*[lit(value) for value in values]), breach_code
+    ).cast(data_type)
+
+def scenario_column(breach_code):
+    """
+    Column expression for the 6 Scenarios scenario of a breach code column.
+    """
+
+    return _lookup_column(SCENARIO_BY_BREACH_CODE, breach_code, LongType())
+
+def allocation_column(provider, field, breach_code):
+    """
+    Column expression for the allocation of a breach code column.
+    provider: "diag" or "treat"
+    field: "num" or "den"
+    """
+
+    return _lookup_column(
+        allocation_by_breach_code(provider, field), breach_code, DoubleType())
+
+#NumPy arrays for the local engine##############################################
+
+def breach_code_array(value_62, value_38, value_24):
+    """
+    Breach code for arrays of 62/38/24 Day values (-1 where any value is NaN).
+    """
+
+    code = (value_62 > 62) * 4 + (value_38 > 38) * 2 + (value_24 > 24) * 1
+    missing = np.isnan(value_62) | np.isnan(value_38) | np.isnan(value_24)
+
+    return np.where(missing, -1, code)
+
+def _lookup_array(values, breach_code):
+    #Position 8 holds NaN for a missing breach code (-1)
+    table = np.array(
+        [np.nan if value is None else value for value in values] + [np.nan])
+    return table[np.where(breach_code < 0, 8, breach_code)]
+
+def scenario_array(breach_code):
+    """
+    Scenario for an array of breach codes (NaN if no scenario).
+    """
+
+    return _lookup_array(SCENARIO_BY_BREACH_CODE, breach_code)
+
+def allocation_array(provider, field, breach_code):
+    """
+    Allocation for an array of breach codes (NaN if no scenario).
+    """
+
+    return _lookup_array(allocation_by_breach_code(provider, field), breach_code)
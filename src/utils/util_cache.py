@@ -0,0 +1,161 @@
+import hashlib
+import json
+import os
+import re
+import time
+
+import pandas as pd
+
+import utils.util_snowflake as us
+
+#Local parquet cache for pull_data_from_query
+#CWT tables only change when a new submission lands in CWT_BASE, so cached
+# results are kept until MAX(META_SUBMISSIONID) advances
+
+SUBMISSION_QUERY = "SELECT MAX(META_SUBMISSIONID) FROM CWT_BASE"
+
+#Latest submission check per role/database: (submission_id, time checked)
+_submission_checks = {}
+
+def normalise_query(query):
+    """
+    Normalise a query so trivially different text maps to the same cache entry.
+    Comments are removed and whitespace is collapsed outside of string literals.
+    query: String containing the query
+    Returns:
+        - query: Normalised query string
+    """
+
+    #Split out string literals so they are left untouched
+    parts = re.split(r"('(?:[^']|'')*')", query)
+
+    for i in range(0, len(parts), 2):
+        part = re.sub(r"--[^\n]*", " ", parts[i])
+        part = re.sub(r"/\*.*?\*/", " ", part, flags=re.DOTALL)
+        parts[i] = re.sub(r"\s+", " ", part)
+
+    return "".join(parts).strip().rstrip(";").strip()
+
+def query_cache_key(query, role, database):
+    """
+    Get the cache key for a query run with a given role and database.
+    Returns:
+        - key: Hex string of the hash of the normalised query, role and database
+    """
+
+    content = "\n".join([normalise_query(query), str(role), str(database)])
+
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+def latest_submission(connection, role, database, ttl=300):
+    """
+    Get the latest META_SUBMISSIONID in CWT_BASE.
+    The result is reused for ttl seconds to avoid a warehouse round trip on
+    every cached pull.
+    connection: Connection object from snowflake.connector.connect()
+    role, database: Used to keep the check separate per role/database
+    ttl: Seconds to reuse the previous check for
+    Returns:
+        - submission_id: Latest submission ID
+    """
+
+    check_key = (role, database)
+
+    if check_key in _submission_checks:
+        submission_id, checked = _submission_checks[check_key]
+        if time.time() - checked < ttl:
+            return submission_id
+
+    submission_id = us.pull_data_from_query(
+        SUBMISSION_QUERY, connection=connection).iloc[0, 0]
+    submission_id = None if pd.isna(submission_id) else int(submission_id)
+
+    _submission_checks[check_key] = (submission_id, time.time())
+
+    return submission_id
+
+def _index_load(cache_folder):
+    path = os.path.join(cache_folder, "index.json")
+    if not os.path.exists(path):
+        return {}
+    with open(path, "r") as f:
+        return json.load(f)
+
+def _index_save(cache_folder, index):
+    #Write to a temporary file first so the index is never left half written
+    path = os.path.join(cache_folder, "index.json")
+    with open(path + ".tmp", "w") as f:
+        json.dump(index, f, indent=1)
+    os.replace(path + ".tmp", path)
+
+def _cache_evict(cache_folder, index, max_bytes):
+    #Remove least recently used entries until the cache is within max_bytes
+    total = sum(entry["bytes"] for entry in index.values())
+
+    for key in sorted(index, key=lambda k: index[k]["last_access"]):
+        if total <= max_bytes:
+            break
+        total -= index[key]["bytes"]
+        path = os.path.join(cache_folder, key + ".parquet")
+        if os.path.exists(path):
+            os.remove(path)
+        del index[key]
+
+def cached_pull_data_from_query(query,
+                                connection=False, connection_params={},
+                                query_tag=False,
+                                cache_folder="data/cache",
+                                max_bytes=2 * 1024 ** 3,
+                                submission_ttl=300):
+    """
+    Version of pull_data_from_query that keeps results in a local parquet
+    cache. Entries are reused until a new submission lands in CWT_BASE and
+    the least recently used entries are evicted when over max_bytes.
+    query: String containing the SELECT query
+    connection, connection_params, query_tag: As for pull_data_from_query
+    cache_folder: Folder to store the cache in (The data folder is not committed)
+    max_bytes: Maximum total size of the cached results
+    submission_ttl: Seconds to reuse the latest submission check for
+    Returns:
+        - df: Pandas dataframe containing the query results
+    """
+
+    #Use passed connection method
+    if connection == False:
+        ctx = us.connection_get(connection_params, query_tag)
+    else:
+        ctx = connection
+
+    role = getattr(ctx, "role", None) or connection_params.get("role")
+    database = getattr(ctx, "database", None) or connection_params.get("database")
+
+    key = query_cache_key(query, role, database)
+    submission_id = latest_submission(ctx, role, database, submission_ttl)
+
+    os.makedirs(cache_folder, exist_ok=True)
+    index = _index_load(cache_folder)
+    path = os.path.join(cache_folder, key + ".parquet")
+
+    #Return the cached result if it is from the latest submission
+    if (key in index and index[key]["submission_id"] == submission_id
+            and os.path.exists(path)):
+        index[key]["last_access"] = time.time()
+        _index_save(cache_folder, index)
+        return pd.read_parquet(path)
+
+    df = us.pull_data_from_query(query, connection=ctx)
+    df.to_parquet(path, index=False)
+
+    index[key] = {
+        "query": normalise_query(query),
+        "role": role,
+        "database": database,
+        "submission_id": submission_id,
+        "bytes": os.path.getsize(path),
+        "last_access": time.time()
+    }
+
+    _cache_evict(cache_folder, index, max_bytes)
+    _index_save(cache_folder, index)
+
+    return df
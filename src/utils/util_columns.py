@@ -0,0 +1,108 @@
+#Column contracts: the CWT_BASE columns each transformation reads
+#Builders select only these columns up front (util_snowflake.base_table_load)
+# and the local engine only reads these columns from parquet
+# (util_local.create_local_features), so the rest of CWT_BASE is never
+# scanned. Transformations without a contract read every column.
+#util_local.check_base_columns checks a contract against the local version
+# of the transformation
+
+#Columns every contract includes (Record keys used by the latest submission
+# index and the incremental refresh)
+KEY_COLUMNS = ["RECORD_ID", "SK_CWT_ID", "META_SUBMISSIONID"]
+
+#The metrics filter on the CWT_ELIGIBILITY bits (See util_eligibility). The
+# base columns the bits are derived from stay in the contracts so the local
+# engine can derive them for extracts without CWT_ELIGIBILITY
+
+PATHWAY_COLUMNS = [
+    "CWT_CANCERREFERALTYPE_CODE",
+    "DATE_CONSULTANTUPGRADEDATE",
+    "PATHWAY_PRIORITYTYPE_CODE",
+    "PATHWAY_SOURCEOFREFERRALFOROUTPATIENT_CODE"
+]
+
+COLUMNS_2WW = [
+    "CWT_ELIGIBILITY",
+    "DATE_CANCERREFERRALTOTREATMENTPERIODSTARTDATE",
+    "DATE_DATEFIRSTSEEN",
+    "IS_GEO_TRUST_DATEFIRSTSEEN",
+    "ORG_FIRSTSEEN_SITE",
+    "ORG_FIRSTSEEN_TRUST",
+    "PATHWAY_PRIORITYTYPE_CODE",
+    "PATHWAY_SOURCEOFREFERRALFOROUTPATIENT_CODE",
+    "WTA_FIRSTSEENADJUSTMENT"
+]
+
+COLUMNS_FDS = [
+    "CWT_ELIGIBILITY",
+    "DATE_CANCERREFERRALTOTREATMENTPERIODSTARTDATE",
+    "DATE_CANCERTREATMENTPERIODSTARTDATE",
+    "DATE_FDSPATHWAYENDDATE",
+    "IS_GEO_TRUST_FDS",
+    "ORG_FDPEND_SITE",
+    "ORG_FDPEND_TRUST",
+    "PATHWAY_FDPENDREASON_CODE",
+    "PATHWAY_FDPEXCLUSIONREASON_CODE",
+    "WTA_FIRSTSEENADJUSTMENT"
+]
+
+COLUMNS_31DAY = [
+    "CWT_ELIGIBILITY",
+    "CWT_PRIMARYDIAGNOSIS_CODE",
+    "DATE_CANCERTREATMENTPERIODSTARTDATE",
+    "DATE_TREATMENTSTARTDATE",
+    "IS_GEO_TRUST_TREATMENTSTARTDATE",
+    "ORG_ACCOUNTABLETREATING_SITE",
+    "ORG_ACCOUNTABLETREATING_TRUST",
+    "PATHWAY_CANCERTREATMENTEVENTTYPE_CODE",
+    "PATHWAY_CANCERTREATMENTMODALITY_CODE",
+    "WTA_TREATMENTADJUSTMENT"
+]
+
+COLUMNS_62DAY = COLUMNS_31DAY + [
+    "DATE_CANCERREFERRALTOTREATMENTPERIODSTARTDATE",
+    "DATE_CONSULTANTUPGRADEDATE",
+    "DATE_DATEFIRSTSEEN",
+    "DATE_TRANSFERTOTREATMENTDATE",
+    "IS_GEO_TRUST_ACCOUNTABLEINVESTIGATING",
+    "IS_GEO_TRUST_CONSULTANTUPGRADE",
+    "IS_GEO_TRUST_DATEFIRSTSEEN",
+    "ORG_ACCOUNTABLEINVESTIGATING_TRUST",
+    "ORG_CONSULTANTUPGRADE_TRUST",
+    "ORG_FIRSTSEEN_TRUST",
+    "PATHWAY_SOURCEOFREFERRALFOROUTPATIENT_CODE",
+    "WTA_FIRSTSEENADJUSTMENT"
+]
+
+#Transformation function name (The Snowpark and local versions share names)
+# to the columns it reads. Every metric stamps the PATHWAY of its rows
+# (See util_pathway) so reads the pathway columns as well
+BASE_COLUMNS = {
+    "determine_pathway": PATHWAY_COLUMNS,
+    "performance_2ww": PATHWAY_COLUMNS + COLUMNS_2WW,
+    "performance_fds": PATHWAY_COLUMNS + COLUMNS_FDS,
+    "performance_31day_first": PATHWAY_COLUMNS + COLUMNS_31DAY,
+    "performance_31day_sub": PATHWAY_COLUMNS + COLUMNS_31DAY,
+    "performance_62day": PATHWAY_COLUMNS + COLUMNS_62DAY,
+    "performance_62day_single_scan": PATHWAY_COLUMNS + COLUMNS_62DAY,
+    "performance_all": PATHWAY_COLUMNS + COLUMNS_2WW + COLUMNS_FDS +
+        COLUMNS_62DAY
+}
+
+def base_columns(*transformation_funcs):
+    """
+    Get the CWT_BASE columns read by one or more transformations.
+    transformation_funcs: Transformation functions (or their names)
+    Returns:
+        - columns: List of columns without duplicates (None if any of the
+            transformations has no contract, meaning every column)
+    """
+
+    columns = list(KEY_COLUMNS)
+    for transformation_func in transformation_funcs:
+        name = getattr(transformation_func, "__name__", transformation_func)
+        if name not in BASE_COLUMNS:
+            return None
+        columns += BASE_COLUMNS[name]
+
+    return list(dict.fromkeys(columns))
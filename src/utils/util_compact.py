@@ -0,0 +1,246 @@
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+import pyarrow.parquet as pq
+
+import utils.util_local as ul
+import utils.util_snowflake as us
+
+#Memory-compact loading of CWT_BASE extracts
+#The column types come from the dynamic table definition (util_local.base_schema)
+# instead of whatever the connector or parquet file chooses:
+# - Identifiers are arrow-backed strings (No Python object per value)
+# - Other VARCHAR/CHAR code columns are categoricals (Few distinct values)
+# - Dates are date32 (4 bytes instead of 8 byte nanosecond timestamps)
+# - NUMBER columns are the smallest nullable integer that holds them
+# - BOOLEAN columns are nullable booleans (1 byte instead of an object)
+
+#High cardinality VARCHAR columns kept as strings rather than categoricals
+IDENTIFIER_COLUMNS = ["SK_CWT_ID", "RECORD_ID", "PSUEDO_NHS_ID"]
+
+#Arrow type to pandas dtype for the compact pandas conversion
+PANDAS_TYPES = {
+    pa.string(): pd.StringDtype("pyarrow"),
+    pa.large_string(): pd.StringDtype("pyarrow"),
+    pa.date32(): pd.ArrowDtype(pa.date32()),
+    pa.bool_(): pd.BooleanDtype(),
+    pa.int8(): pd.Int8Dtype(),
+    pa.int16(): pd.Int16Dtype(),
+    pa.int32(): pd.Int32Dtype(),
+    pa.int64(): pd.Int64Dtype()
+}
+
+def compact_type(column, snowflake_type):
+    """
+    Get the compact arrow type for a CWT_BASE column.
+    column: Column name
+    snowflake_type: Type from base_schema (i.e. "CHAR(2)")
+    Returns:
+        - arrow_type: Arrow type (NUMBER columns are int64 until narrowed
+            by compact_table, as the schema has no precision)
+    """
+
+    base_type = snowflake_type.split("(")[0]
+
+    if base_type in ["VARCHAR", "CHAR"]:
+        if column in IDENTIFIER_COLUMNS:
+            return pa.string()
+        return pa.dictionary(pa.int32(), pa.string())
+    if base_type == "DATE":
+        return pa.date32()
+    if base_type == "BOOLEAN":
+        return pa.bool_()
+    if base_type == "NUMBER":
+        return pa.int64()
+
+    raise Exception(f"No compact type for {column} ({snowflake_type}).")
+
+def _narrow(array):
+    #Smallest integer type that holds every value in the array
+    if array.null_count == len(array):
+        return pa.int8()
+    values = array.drop_null().to_numpy()
+    for int_type, dtype in [(pa.int8(), np.int8), (pa.int16(), np.int16),
+                            (pa.int32(), np.int32)]:
+        info = np.iinfo(dtype)
+        if values.min() >= info.min and values.max() <= info.max:
+            return int_type
+    return pa.int64()
+
+def compact_table(table, schema=None):
+    """
+    Cast an arrow table of CWT_BASE columns to the compact types.
+    Columns not in the schema are left as they are.
+    table: Arrow table (i.e. a batch from stream_data_from_query)
+    schema: (Optional) Output of util_local.base_schema, read from the
+        definition by default
+    Returns:
+        - table: Arrow table with the compact types
+    """
+
+    if schema is None:
+        schema = ul.base_schema()
+
+    for i, name in enumerate(table.column_names):
+        if name not in schema:
+            continue
+        column = table.column(i)
+        target = compact_type(name, schema[name])
+
+        if pa.types.is_integer(target):
+            column = column.cast(pa.int64())
+            target = _narrow(column.combine_chunks())
+
+        table = table.set_column(i, name, column.cast(target))
+
+    return table
+
+def compact_pandas(table):
+    """
+    Convert a compact arrow table to pandas, keeping the compact types.
+    Returns:
+        - df: Pandas dataframe
+    """
+
+    #Chunks can have their own dictionaries so unify them for the categoricals
+    return table.unify_dictionaries().to_pandas(types_mapper=PANDAS_TYPES.get)
+
+#Local metrics checked by check_compact
+CHECK_FUNCS = [
+    ul.determine_pathway,
+    ul.performance_2ww,
+    ul.performance_fds,
+    ul.performance_31day_first,
+    ul.performance_31day_sub,
+    ul.performance_62day,
+    ul.performance_62day_single_scan
+]
+
+def check_compact(df_base, transformation_funcs=CHECK_FUNCS, rows=1000,
+                  seed=0):
+    """
+    Check the local metrics give the same output on a compact frame as on
+    the default dtypes.
+    A random subset of the base is used as a subset (i.e. a shard from
+    util_parallel) has its own categories for each code column.
+    df_base: Pandas dataframe from util_local.load_base
+    transformation_funcs: Functions from util_local to check
+    rows: Number of rows in the subset
+    seed: Random seed for the subset
+    Returns:
+        - results: Dictionary of function name to True if the outputs match
+    """
+
+    df = df_base.sample(n=min(rows, len(df_base)), random_state=seed) \
+        .sort_index().reset_index(drop=True)
+    df_compact = compact_pandas(
+        compact_table(pa.Table.from_pandas(df, preserve_index=False)))
+
+    results = {}
+    for transformation_func in transformation_funcs:
+        name = transformation_func.__name__
+        try:
+            df_out = transformation_func(df_compact)
+        except Exception as e:
+            print(f"{name} failed on the compact frame: {e}")
+            results[name] = False
+            continue
+        results[name] = df_out.reset_index(drop=True).equals(
+            transformation_func(df).reset_index(drop=True))
+        if not results[name]:
+            print(f"{name} gives different output on the compact frame.")
+
+    return results
+
+def memory_report(df_compact, df_default=None, bytes_default=None):
+    """
+    Print and return the memory used by a compact dataframe against the
+    default dtypes.
+    df_compact: Dataframe from the compact loader
+    df_default: (Optional) The same data with the default dtypes
+    bytes_default: (Optional) Size of the default dataframe if it was not kept
+    Returns:
+        - report: Dictionary of the default and compact size in bytes and
+            the fraction saved
+    """
+
+    bytes_compact = int(df_compact.memory_usage(deep=True).sum())
+    if bytes_default is None:
+        bytes_default = int(df_default.memory_usage(deep=True).sum())
+
+    report = {
+        "bytes_default": bytes_default,
+        "bytes_compact": bytes_compact,
+        "saved": 1 - bytes_compact / bytes_default
+    }
+
+    print(f"{len(df_compact)} rows: {bytes_default / 1024 ** 2:.0f}MB -> "
+          f"{bytes_compact / 1024 ** 2:.0f}MB ({report['saved']:.0%} saved)")
+
+    return report
+
+def pull_compact_from_query(query,
+                            connection=False, connection_params={},
+                            query_tag=False, report=False):
+    """
+    Version of pull_data_from_query that applies the compact CWT_BASE types.
+    Each batch is cast as it is downloaded so the full result is never held
+    with the default types.
+    query: String containing the SELECT query
+    connection, connection_params, query_tag: As for pull_data_from_query
+    report: If True, print the memory saved against the default dtypes
+        (Converts each batch twice so is slower)
+    Returns:
+        - df: Pandas dataframe containing the query results
+    """
+
+    schema = ul.base_schema()
+
+    tables = []
+    bytes_default = 0
+    for table in us.stream_data_from_query(
+            query, connection=connection, connection_params=connection_params,
+            query_tag=query_tag, as_arrow=True):
+        if report:
+            bytes_default += int(
+                table.to_pandas().memory_usage(deep=True).sum())
+        #Numbers are narrowed once all batches are in so the types match
+        tables.append(compact_table(table, {
+            name: snowflake_type for name, snowflake_type in schema.items()
+            if not snowflake_type.startswith("NUMBER")
+        }))
+
+    if not tables:
+        return pd.DataFrame()
+
+    df = compact_pandas(
+        compact_table(pa.concat_tables(tables, promote_options="permissive"),
+                      schema))
+
+    if report:
+        memory_report(df, bytes_default=bytes_default)
+
+    return df
+
+def load_compact(path, columns=None, report=False):
+    """
+    Version of util_local.load_base that applies the compact CWT_BASE types.
+    path: Path to a parquet file/folder or an arrow (feather) file
+    columns: (Optional) List of columns to read, reads all columns by default
+    report: If True, print the memory saved against util_local.load_base
+    Returns:
+        - df: Pandas dataframe containing the base CWT data
+    """
+
+    if path.endswith((".arrow", ".feather", ".ipc")):
+        table = feather.read_table(path, columns=columns)
+    else:
+        table = pq.read_table(path, columns=columns)
+
+    df = compact_pandas(compact_table(table))
+
+    if report:
+        memory_report(df, ul.load_base(path, columns=columns))
+
+    return df
@@ -0,0 +1,238 @@
+import functools
+import time
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+
+import utils.util_cache as uc
+import utils.util_snowflake as us
+
+#In-process query service for dashboards (i.e. streamlit/dash callbacks)
+#CWT_PERFORMANCE_CUBE is held in memory as an arrow table on one connection
+# and each filter combination is answered from it, with the last results kept
+# in an LRU cache. The copy and the cache are replaced when a new submission
+# lands in CWT_BASE (checked at most every submission_ttl seconds)
+
+CUBE_QUERY = """
+SELECT *
+FROM DEV__MODELLING.CANCER__CWT_PATHWAY.CWT_PERFORMANCE_CUBE
+"""
+
+#Columns that can be filtered on: filter name to cube column
+FILTER_COLUMNS = {
+    "metric": "PER_METRIC",
+    "trust": "PER_ORG_TRUST",
+    "site": "PER_ORG_SITE",
+    "pathway": "PATHWAY",
+    "ncl": "PER_ORG_NCL"
+}
+
+#Organisation columns at each level of the cube, smallest level first
+LEVEL_COLUMNS = {
+    "All": set(),
+    "NCL": {"PER_ORG_NCL"},
+    "Trust": {"PER_ORG_NCL", "PER_ORG_TRUST"},
+    "Site": {"PER_ORG_NCL", "PER_ORG_TRUST", "PER_ORG_SITE"}
+}
+
+#Current copy of the cube: the connection is kept open between reads
+_service = {
+    "connection": None,
+    "query": CUBE_QUERY,
+    "table": None,
+    "submission_id": None,
+    "submission_ttl": 300,
+    "loaded_at": None
+}
+
+def _encode(table):
+    #Dictionary encode the code columns and add a month index for periods
+    for i, field in enumerate(table.schema):
+        if pa.types.is_string(field.type) or pa.types.is_large_string(field.type):
+            table = table.set_column(i, field.name, pc.dictionary_encode(
+                table.column(i)))
+
+    period = pc.add(
+        pc.multiply(table.column("PER_DATE_YEAR").cast(pa.int32()), 12),
+        table.column("PER_DATE_MONTH").cast(pa.int32()))
+
+    return table.append_column("PER_PERIOD", period)
+
+def _period(value):
+    #Month index for a "YYYY-MM" string (As for the PER_PERIOD column)
+    year, month = str(value).split("-")[:2]
+    return int(year) * 12 + int(month)
+
+def _value_set(table, column, values):
+    #Filter values as an arrow array of the column type
+    value_type = table.schema.field(column).type
+    if pa.types.is_dictionary(value_type):
+        value_type = value_type.value_type
+    return pa.array(values, value_type)
+
+def _values(value):
+    #Filter values as a sorted tuple so they can be part of the cache key
+    if value is None:
+        return None
+    if isinstance(value, (list, tuple, set)):
+        return tuple(sorted(value, key=str))
+    return (value,)
+
+def dashboard_load(connection=None, connection_params={}, query=CUBE_QUERY,
+                   table=None, submission_id=None, submission_ttl=300):
+    """
+    Load the performance cube into memory for dashboard_query.
+    connection: (Optional) Connection object from snowflake.connector.connect(),
+        kept open to check for new submissions and reload the cube
+    connection_params: Used to create the connection if one is not passed
+    query: Query to load the cube with
+    table: (Optional) Pandas dataframe or arrow table to serve instead of
+        querying Snowflake (i.e. util_local.performance_cube output)
+    submission_id: (Optional) Submission the passed table is from
+    submission_ttl: Seconds to reuse the latest submission check for
+    Returns:
+        - n_rows: Number of rows held in memory
+    """
+
+    if table is None:
+        if connection is None:
+            connection = _service["connection"] or \
+                us.connection_get(connection_params)
+        role = getattr(connection, "role", None)
+        database = getattr(connection, "database", None)
+        submission_id = uc.latest_submission(
+            connection, role, database, submission_ttl)
+
+        cur = connection.cursor()
+        cur.execute(query)
+        table = cur.fetch_arrow_all()
+    elif isinstance(table, pd.DataFrame):
+        table = pa.Table.from_pandas(table, preserve_index=False)
+
+    _service.update({
+        "connection": connection,
+        "query": query,
+        "table": _encode(table),
+        "submission_id": submission_id,
+        "submission_ttl": submission_ttl,
+        "loaded_at": time.time()
+    })
+    _query.cache_clear()
+
+    return _service["table"].num_rows
+
+def dashboard_refresh():
+    """
+    Reload the cube if a new submission has landed since it was loaded.
+    Returns:
+        - is_reloaded: True if the cube was reloaded
+    """
+
+    connection = _service["connection"]
+    if connection is None:
+        return False
+
+    submission_id = uc.latest_submission(
+        connection, getattr(connection, "role", None),
+        getattr(connection, "database", None), _service["submission_ttl"])
+
+    if submission_id == _service["submission_id"]:
+        return False
+
+    dashboard_load(connection, query=_service["query"],
+                   submission_ttl=_service["submission_ttl"])
+
+    return True
+
+@functools.lru_cache(maxsize=256)
+def _query(submission_id, loaded_at, filters, start, end, level,
+           all_pathways, group_by):
+    #Cached on the submission and load time so a reload never serves old results
+    table = _service["table"]
+
+    mask = pc.and_(
+        pc.equal(table.column("CUBE_ORG_LEVEL"), level),
+        pc.equal(table.column("CUBE_ALL_PATHWAYS"), all_pathways))
+
+    for name, values in filters:
+        column = FILTER_COLUMNS[name]
+        mask = pc.and_(mask, pc.is_in(
+            table.column(column),
+            value_set=_value_set(table, column, values)))
+
+    if start is not None:
+        mask = pc.and_(mask, pc.greater_equal(table.column("PER_PERIOD"), start))
+    if end is not None:
+        mask = pc.and_(mask, pc.less_equal(table.column("PER_PERIOD"), end))
+
+    table = table.filter(mask)
+
+    df = table.group_by(list(group_by), use_threads=False).aggregate([
+        ("PER_NUMERATOR", "sum"),
+        ("PER_DENOMINATOR", "sum"),
+        ("PER_COUNT", "sum")
+    ]).to_pandas()
+
+    #Decode the dictionary columns so they sort and compare as strings
+    for column in df.columns:
+        if isinstance(df[column].dtype, pd.CategoricalDtype):
+            df[column] = df[column].astype(object)
+
+    df = df.rename(columns={
+        "PER_NUMERATOR_sum": "PER_NUMERATOR",
+        "PER_DENOMINATOR_sum": "PER_DENOMINATOR",
+        "PER_COUNT_sum": "PER_COUNT"
+    })
+    df["PER_PERFORMANCE"] = df["PER_NUMERATOR"] / df["PER_DENOMINATOR"]
+
+    return df.sort_values(list(group_by)).reset_index(drop=True)
+
+def dashboard_query(metric=None, trust=None, site=None, pathway=None,
+                    ncl=None, start=None, end=None, level=None,
+                    group_by=["PER_DATE_YEAR", "PER_DATE_MONTH"]):
+    """
+    Get performance totals from the in-memory cube (See dashboard_load).
+    Each filter takes a value or a list of values, None means no filter.
+    metric: Metric name(s) (i.e. "62 Day")
+    trust, site: Organisation code(s)
+    pathway: Pathway name(s) (i.e. "USC")
+    ncl: True for NCL trusts, False for other trusts
+    start, end: First and last month to include as "YYYY-MM" strings
+    level: Cube level to read from, the most aggregated level that has the
+        filter and group by columns by default
+    group_by: Columns to total by
+    Returns:
+        - df: Pandas dataframe with the group_by columns, the summed
+            PER_NUMERATOR, PER_DENOMINATOR and PER_COUNT and PER_PERFORMANCE
+    """
+
+    if _service["table"] is None:
+        raise Exception("No performance cube loaded, call dashboard_load first.")
+
+    dashboard_refresh()
+
+    filters = {"metric": metric, "trust": trust, "site": site,
+               "pathway": pathway, "ncl": ncl}
+    filters = tuple(
+        (name, _values(value)) for name, value in filters.items()
+        if value is not None)
+
+    #Use the smallest level of the cube with every column needed
+    columns = set(group_by) | {FILTER_COLUMNS[name] for name, _ in filters}
+    if level is None:
+        org_columns = columns & LEVEL_COLUMNS["Site"]
+        level = next(
+            level for level, level_columns in LEVEL_COLUMNS.items()
+            if org_columns <= level_columns)
+
+    all_pathways = "PATHWAY" not in columns
+
+    df = _query(
+        _service["submission_id"], _service["loaded_at"], filters,
+        None if start is None else _period(start),
+        None if end is None else _period(end),
+        level, all_pathways, tuple(group_by))
+
+    #Copy so callers cannot change the cached result
+    return df.copy()
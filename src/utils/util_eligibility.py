@@ -0,0 +1,47 @@
+import numpy as np
+
+from snowflake.snowpark.functions import col, lit
+
+#Metric eligibility of each CWT_BASE row
+#CWT_BASE computes CWT_ELIGIBILITY once per row (docs/dynamic_cwt_base.sql)
+# with a bit for each standard the row is valid for, so the metric builders
+# test a bit instead of each repeating the eligibility filters:
+#   1 if valid for 2WW
+# + 2 if valid for FDS
+# + 4 if valid for 31 Day (First Treatment)
+# + 8 if valid for 31 Day (Subsequent Treatments)
+# + 16 if valid for 62 Day
+#A filter that is Null in Snowflake leaves the bit unset, as the row would be
+# removed by a where() on the filter
+#util_local.base_eligibility derives the same bits for local extracts
+
+ELIGIBILITY_COLUMN = "CWT_ELIGIBILITY"
+
+ELIGIBLE_2WW = 1
+ELIGIBLE_FDS = 2
+ELIGIBLE_31DAY_FIRST = 4
+ELIGIBLE_31DAY_SUB = 8
+ELIGIBLE_62DAY = 16
+
+ELIGIBLE_ALL = (ELIGIBLE_2WW | ELIGIBLE_FDS | ELIGIBLE_31DAY_FIRST |
+    ELIGIBLE_31DAY_SUB | ELIGIBLE_62DAY)
+
+#Snowpark expressions##########################################################
+
+def eligible_column(bits):
+    """
+    Column expression that is True for rows valid for any of the bits
+    (i.e. ELIGIBLE_31DAY_FIRST | ELIGIBLE_31DAY_SUB for either 31 Day).
+    """
+
+    return col(ELIGIBILITY_COLUMN).bitand(lit(bits)) != 0
+
+#NumPy arrays for the local engine##############################################
+
+def eligible_array(eligibility, bits):
+    """
+    Boolean mask of an eligibility array that is True for rows valid for any
+    of the bits.
+    """
+
+    return (np.asarray(eligibility, dtype="int64") & bits) != 0
@@ -0,0 +1,193 @@
+import numpy as np
+import pandas as pd
+
+import utils.util_local as ul
+import utils.util_snowflake as us
+
+#Performance for any waiting time threshold from CWT_VALUE_HISTOGRAM
+#Each metric hard codes its standard (i.e. PER_VALUE <= 14 for 2WW) so a
+# different standard would otherwise need every metric to be rebuilt.
+#The histogram rows of each group (Month, organisation and metric) are sorted
+# by PER_VALUE with a running total of the weight, so the weight within any
+# threshold is one binary search into the group's bins.
+#Breaches are the rows above the threshold weighted by PER_DENOMINATOR, which
+# matches PER_NUMERATOR at the standard thresholds. At other thresholds the
+# 62 Day 6 Scenarios rows keep their provider share of the record (The split
+# itself depends on the 38 and 24 Day breaches so is not re-derived)
+
+HISTOGRAM_QUERY = """
+SELECT *
+FROM DEV__MODELLING.CANCER__CWT_PATHWAY.CWT_VALUE_HISTOGRAM
+"""
+
+#Histogram columns that identify a group (Every key except PER_VALUE)
+GROUP_KEYS = [key for key in ul.HISTOGRAM_KEYS if key != "PER_VALUE"]
+
+#Columns that can be filtered on: filter name to histogram column
+FILTER_COLUMNS = {
+    "metric": "PER_METRIC",
+    "trust": "PER_ORG_TRUST",
+    "site": "PER_ORG_SITE",
+    "ncl": "PER_ORG_NCL"
+}
+
+def histogram_store(df_histogram):
+    """
+    Build the cumulative store used by threshold_performance.
+    df_histogram: Dataframe shaped like CWT_VALUE_HISTOGRAM (i.e. the output
+        of util_local.value_histogram)
+    Returns:
+        - store: Dictionary of the groups and their cumulative weights
+    """
+
+    df = df_histogram.reset_index(drop=True)
+
+    #Groups numbered in order of first appearance (As drop_duplicates keeps)
+    group_codes = df.groupby(GROUP_KEYS, dropna=False, sort=False) \
+        .ngroup().to_numpy()
+    df_groups = df[GROUP_KEYS].drop_duplicates().reset_index(drop=True)
+    n_groups = len(df_groups)
+
+    weight = df["HIST_WEIGHT"].to_numpy(dtype="float64")
+    count = df["HIST_COUNT"].to_numpy(dtype="float64")
+    value = df["PER_VALUE"].to_numpy(dtype="float64", na_value=np.nan)
+
+    #Null values breach at every threshold so are only in the totals
+    has_value = ~np.isnan(value)
+    total_weight = np.bincount(group_codes, weights=weight, minlength=n_groups)
+    total_count = np.bincount(group_codes, weights=count, minlength=n_groups)
+
+    group_codes = group_codes[has_value]
+    value = value[has_value].astype("int64")
+    weight = weight[has_value]
+    count = count[has_value]
+
+    #Sort by group then value and offset each group so the bins of every
+    # group are in one sorted array
+    min_value = int(value.min()) if len(value) else 0
+    span = (int(value.max()) - min_value + 2) if len(value) else 1
+    keys = group_codes.astype("int64") * span + (value - min_value)
+    order = np.argsort(keys, kind="stable")
+
+    return {
+        "groups": df_groups.assign(
+            PER_PERIOD=df_groups["PER_DATE_YEAR"].astype("int64") * 12 +
+                df_groups["PER_DATE_MONTH"].astype("int64")),
+        "keys": keys[order],
+        "cumulative_weight": np.concatenate([[0.0], np.cumsum(weight[order])]),
+        "cumulative_count": np.concatenate([[0.0], np.cumsum(count[order])]),
+        "total_weight": total_weight,
+        "total_count": total_count,
+        "min_value": min_value,
+        "span": span
+    }
+
+def histogram_load(connection=False, connection_params={},
+                   query=HISTOGRAM_QUERY, query_tag=False):
+    """
+    Load CWT_VALUE_HISTOGRAM from Snowflake into a store.
+    connection, connection_params, query_tag: As for pull_data_from_query
+    query: Query to load the histogram with
+    Returns:
+        - store: Output of histogram_store
+    """
+
+    df = us.pull_data_from_query(
+        query, connection=connection, connection_params=connection_params,
+        query_tag=query_tag)
+
+    return histogram_store(df)
+
+def _within(store, groups, thresholds):
+    #Weight and count with PER_VALUE <= threshold for each group
+    #The last bin at or below the threshold is found by a binary search on
+    # the offset keys, then the running totals give the sums
+    offset = np.clip(
+        thresholds - store["min_value"], -1, store["span"] - 1).astype("int64")
+    upper = np.searchsorted(
+        store["keys"], groups * store["span"] + offset, side="right")
+    lower = np.searchsorted(store["keys"], groups * store["span"], side="left")
+
+    weight = store["cumulative_weight"][upper] - store["cumulative_weight"][lower]
+    count = store["cumulative_count"][upper] - store["cumulative_count"][lower]
+
+    return weight, count
+
+def threshold_performance(store, threshold, metric=None, trust=None,
+                          site=None, ncl=None, start=None, end=None,
+                          group_by=["PER_DATE_YEAR", "PER_DATE_MONTH"]):
+    """
+    Get breach counts and performance for a waiting time threshold.
+    Each filter takes a value or a list of values, None means no filter.
+    store: Output of histogram_store or histogram_load
+    threshold: Number of days within the standard (PER_VALUE <= threshold),
+        or a dictionary of metric name to threshold (i.e. {"2WW": 21}) in
+        which case only those metrics are included
+    metric: Metric name(s) (i.e. "62 Day")
+    trust, site: Organisation code(s)
+    ncl: True for NCL trusts, False for other trusts
+    start, end: First and last month to include as "YYYY-MM" strings
+    group_by: Columns to total by (PER_THRESHOLD is added for a dictionary)
+    Returns:
+        - df: Pandas dataframe with the group_by columns, PER_NUMERATOR
+            (Breaches weighted as the denominator), PER_DENOMINATOR,
+            PER_PERFORMANCE, PER_BREACHES (Breaching rows) and PER_COUNT
+    """
+
+    df_groups = store["groups"]
+    mask = np.ones(len(df_groups), dtype=bool)
+
+    filters = {"metric": metric, "trust": trust, "site": site, "ncl": ncl}
+    if isinstance(threshold, dict):
+        filters["metric"] = [m for m in threshold
+                             if metric is None or m in np.atleast_1d(metric)]
+    for name, values in filters.items():
+        if values is None:
+            continue
+        if not isinstance(values, (list, tuple, set)):
+            values = [values]
+        mask &= df_groups[FILTER_COLUMNS[name]].isin(list(values)).to_numpy()
+
+    for bound, compare in [(start, np.greater_equal), (end, np.less_equal)]:
+        if bound is not None:
+            year, month = str(bound).split("-")[:2]
+            mask &= compare(df_groups["PER_PERIOD"].to_numpy(),
+                            int(year) * 12 + int(month))
+
+    groups = np.flatnonzero(mask)
+    df = df_groups.iloc[groups].reset_index(drop=True)
+
+    if isinstance(threshold, dict):
+        thresholds = df["PER_METRIC"].map(threshold).to_numpy(dtype="int64")
+        group_by = list(group_by) + ["PER_THRESHOLD"]
+    else:
+        thresholds = np.full(len(groups), threshold, dtype="int64")
+    df["PER_THRESHOLD"] = thresholds
+
+    weight, count = _within(store, groups, thresholds)
+    df["PER_DENOMINATOR"] = store["total_weight"][groups]
+    df["PER_NUMERATOR"] = df["PER_DENOMINATOR"] - weight
+    df["PER_COUNT"] = store["total_count"][groups]
+    df["PER_BREACHES"] = df["PER_COUNT"] - count
+
+    df = df.groupby(list(group_by), dropna=False, sort=True)[
+        ["PER_NUMERATOR", "PER_DENOMINATOR", "PER_BREACHES", "PER_COUNT"]
+    ].sum().reset_index()
+    df["PER_PERFORMANCE"] = df["PER_NUMERATOR"] / df["PER_DENOMINATOR"]
+
+    return df
+
+def threshold_curve(store, thresholds, **filters):
+    """
+    Get performance for several thresholds (i.e. range(7, 29)) to compare
+    standards. Filters are as for threshold_performance.
+    Returns:
+        - df: Output of threshold_performance for each threshold with a
+            PER_THRESHOLD column
+    """
+
+    return pd.concat([
+        threshold_performance(store, threshold, **filters).assign(
+            PER_THRESHOLD=threshold)
+        for threshold in thresholds
+    ], ignore_index=True)
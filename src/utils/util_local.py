@@ -0,0 +1,891 @@
+import os
+import re
+import time
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import utils.util_allocation as ua
+import utils.util_columns as ucol
+import utils.util_eligibility as ue
+import utils.util_org as org
+import utils.util_pathway as upw
+
+#Output columns shared by every performance metric
+PER_COLUMNS = ["RECORD_ID", "PER_DATE_YEAR", "PER_DATE_MONTH",
+    "PER_ORG_TRUST", "PER_ORG_SITE", "PER_ORG_NCL", "PER_METRIC",
+    "PER_VALUE", "PER_NUMERATOR", "PER_DENOMINATOR", "PATHWAY"]
+
+#Additional output columns for the 31 Day (Subsequent) and 62 Day metrics
+D31_COLUMNS = PER_COLUMNS + ["D31_BREAKDOWN"]
+
+D62_COLUMNS = PER_COLUMNS + ["D62_ACC_DIAGNOSTIC", "D62_ACC_TREATMENT",
+    "D62_ALLOCATIONMETHOD", "D62_6S_SCENARIO"]
+
+def base_schema(path="docs/dynamic_cwt_base.sql"):
+    """
+    Get the CWT_BASE columns and types from the dynamic table definition.
+    path: Path to the CREATE DYNAMIC TABLE script for CWT_BASE
+    Returns:
+        - schema: Dictionary of column name to Snowflake type (i.e. "CHAR(2)")
+    """
+
+    with open(path, "r") as f:
+        script = f.read()
+
+    #Column list is between the table name and the table properties
+    definition = script[script.index("(") + 1:script.index("\n)\nCOMMENT")]
+
+    schema = {}
+    for line in definition.splitlines():
+        match = re.match(r"\s*([A-Z0-9_]+)\s+([A-Z]+(?:\(\d+\))?)", line)
+        if match:
+            schema[match.group(1)] = match.group(2)
+
+    return schema
+
+def load_base(path, columns=None):
+    """
+    Load a local columnar extract of CWT_BASE.
+    path: Path to a parquet file/folder or an arrow (feather) file
+    columns: (Optional) List of columns to read, reads all columns by default.
+        Columns the extract does not have are skipped (i.e. CWT_ELIGIBILITY
+        in extracts taken before it was added)
+    Returns:
+        - df: Pandas dataframe containing the base CWT data
+    """
+
+    is_arrow = path.endswith((".arrow", ".feather", ".ipc"))
+
+    if columns is not None:
+        if is_arrow:
+            with pa.memory_map(path) as source:
+                names = pa.ipc.open_file(source).schema.names
+        else:
+            names = pq.ParquetDataset(path).schema.names
+        columns = [column for column in columns if column in names]
+
+    if is_arrow:
+        return pd.read_feather(path, columns=columns)
+
+    return pd.read_parquet(path, columns=columns)
+
+def create_local_features(transformation_func, params, df_base=None):
+    """
+    Local equivalent of util_snowflake.create_dynamic_features.
+    Runs a local transformation function against an extract of CWT_BASE and
+    writes the output to a parquet file instead of a dynamic table.
+    transformation_func: Function from this module (i.e. performance_2ww)
+    params: Dictionary containing:
+        - base_path: Path to the CWT_BASE extract (Not needed if df_base is passed)
+        - destination_folder: Folder to write the output to
+        - destination_table: Name of the output (used as the file name)
+    df_base: (Optional) Pre-loaded base data, avoids re-reading the extract
+        when building several metrics
+    Returns:
+        - df: Pandas dataframe containing the output
+    """
+
+    #Only read the columns the function uses (See util_columns)
+    if df_base is None:
+        df_base = load_base(
+            params["base_path"], ucol.base_columns(transformation_func))
+
+    time_start = time.perf_counter()
+    df = transformation_func(df_base)
+    time_taken = time.perf_counter() - time_start
+
+    os.makedirs(params["destination_folder"], exist_ok=True)
+    destination = os.path.join(
+        params["destination_folder"], params["destination_table"] + ".parquet")
+    df.to_parquet(destination, index=False)
+
+    print(f"{params['destination_table']}: {len(df)} rows in {time_taken:.2f}s")
+
+    return df
+
+def check_base_columns(transformation_func, df_base):
+    """
+    Check the column contract of a transformation (See util_columns).
+    Runs the function on the contract columns of the base and on every
+    column and compares the outputs, so a column used by the function but
+    missing from its contract fails here rather than in a build.
+    transformation_func: Function from this module (i.e. performance_2ww)
+    df_base: Pandas dataframe containing the base CWT data (All columns)
+    Returns:
+        - is_match: True if the outputs are the same
+    """
+
+    columns = ucol.base_columns(transformation_func)
+    if columns is None:
+        raise Exception(
+            f"{transformation_func.__name__} has no column contract.")
+    columns = [column for column in columns if column in df_base.columns]
+
+    try:
+        df_contract = transformation_func(df_base[columns])
+    except KeyError as e:
+        print(f"{transformation_func.__name__} uses {e} which is not in its "
+              "column contract.")
+        return False
+
+    df_full = transformation_func(df_base)
+
+    return df_contract.reset_index(drop=True).equals(
+        df_full.reset_index(drop=True))
+
+#Organisation fields of CWT_BASE resolved from the submitted organisation codes:
+# (Code column, Trust column, NCL flag column)
+ORG_COLUMNS = [
+    ("ORG_CONSULTANTUPGRADE_SITE", "ORG_CONSULTANTUPGRADE_TRUST",
+        "IS_GEO_TRUST_CONSULTANTUPGRADE"),
+    ("ORG_FIRSTSEEN_SITE", "ORG_FIRSTSEEN_TRUST", "IS_GEO_TRUST_DATEFIRSTSEEN"),
+    ("ORG_FDPEND_SITE", "ORG_FDPEND_TRUST", "IS_GEO_TRUST_FDS"),
+    ("ORG_ACCOUNTABLETREATING_SITE", "ORG_ACCOUNTABLETREATING_TRUST",
+        "IS_GEO_TRUST_TREATMENTSTARTDATE")
+]
+
+def resolve_orgs(df, lookup):
+    """
+    Fill the organisation trust and NCL flag columns of a base extract from
+    the organisation codes, as the organisation joins in CWT_BASE do.
+    df: Pandas dataframe containing the base CWT data
+    lookup: Organisation lookup from util_org.org_lookup/org_lookup_load
+    Returns:
+        - df: Copy of df with the trust and NCL flag columns (and
+            CWT_ELIGIBILITY) replaced
+    """
+
+    df = df.copy()
+
+    for code_col, trust_col, ncl_col in ORG_COLUMNS:
+        df[trust_col], df[ncl_col] = org.org_resolve(lookup, df[code_col])
+
+    df["IS_GEO_TRUST_ACCOUNTABLEINVESTIGATING"] = org.org_is_ncl_trust(
+        lookup, df["ORG_ACCOUNTABLEINVESTIGATING_TRUST"])
+
+    #The eligibility bits depend on the trusts (i.e. 62 Day needs a First
+    # Seen trust) so are derived again from the resolved columns
+    if ue.ELIGIBILITY_COLUMN in df.columns:
+        df[ue.ELIGIBILITY_COLUMN] = base_eligibility(df)
+
+    return df
+
+def _latest_rows(df):
+    #Latest version of each record using grouped maximums on the encoded
+    # RECORD_ID (No sort), with versions in the same submission separated by
+    # the largest SK_CWT_ID
+    codes, _ = pd.factorize(df["RECORD_ID"])
+    submission = df["META_SUBMISSIONID"].to_numpy()
+
+    latest = pd.Series(submission).groupby(codes).max().to_numpy()
+    df = df.loc[submission == latest[codes],
+                ["RECORD_ID", "SK_CWT_ID", "META_SUBMISSIONID"]]
+    codes = codes[submission == latest[codes]]
+
+    #Only records with several latest versions need the SK_CWT_ID check
+    is_tied = pd.Series(codes).duplicated(keep=False).to_numpy()
+    if is_tied.any():
+        df_tied = df[is_tied]
+        keep = df_tied.groupby(codes[is_tied])["SK_CWT_ID"].transform("max")
+        df = pd.concat([df[~is_tied], df_tied[df_tied["SK_CWT_ID"] == keep]])
+
+    return df
+
+def latest_index(df, index=None):
+    """
+    Local equivalent of the CWT_LATEST index (docs/dynamic_cwt_latest.sql).
+    Only the base rows after the latest submission in the index are read, and
+    records in them replace their previous entry.
+    df: Pandas dataframe containing the base CWT data
+    index: (Optional) Index from a previous call to update
+    Returns:
+        - index: Pandas dataframe with RECORD_ID, SK_CWT_ID and META_SUBMISSIONID
+            (One row per record)
+    """
+
+    if index is None or len(index) == 0:
+        return _latest_rows(df).reset_index(drop=True)
+
+    df_new = _latest_rows(
+        df[df["META_SUBMISSIONID"] > index["META_SUBMISSIONID"].max()])
+
+    index = index[~index["RECORD_ID"].isin(df_new["RECORD_ID"])]
+
+    return pd.concat([index, df_new], ignore_index=True)
+
+def filter_latest(df, index):
+    """
+    Filter base rows to the latest version of each record (See latest_index).
+    Returns:
+        - df: Pandas dataframe of the base rows in the index
+    """
+
+    return df[df["SK_CWT_ID"].isin(index["SK_CWT_ID"])]
+
+#Helper functions to get base columns as NumPy arrays########################
+
+def _days(df, column):
+    #Dates as float days since epoch with NaN for missing dates so the
+    # Snowflake DATE - DATE arithmetic can be done with plain NumPy operations
+    if isinstance(df[column].dtype, pd.ArrowDtype):
+        #date32 (util_compact) is already stored as days since epoch
+        return pa.array(df[column]).cast(pa.int32()) \
+            .to_numpy(zero_copy_only=False).astype("float64")
+    dates = pd.to_datetime(df[column]).to_numpy(dtype="datetime64[D]")
+    days = dates.astype("int64").astype("float64")
+    days[np.isnat(dates)] = np.nan
+    return days
+
+def _num(df, column):
+    #Code columns are CHAR in Snowflake but compared to numbers in the metric
+    # logic (i.e. != 17) so coerce them to numbers in the same way
+    return pd.to_numeric(df[column], errors="coerce").to_numpy(dtype="float64")
+
+def _adjustment(df, column):
+    #Equivalent of coalesce(column, lit(0))
+    return np.nan_to_num(_num(df, column), nan=0.0)
+
+def _ne(values, value):
+    #Snowflake comparison where a Null value never passes the check
+    return ~np.isnan(values) & (values != value)
+
+def _objects(values):
+    #Values as an object array with None for Null whatever the dtype, so the
+    # compact dtypes (util_compact) give the same output as object columns
+    return values.to_numpy(dtype=object, na_value=None)
+
+def _notnull(df, column):
+    return df[column].notna().to_numpy()
+
+def _isin(df, column, codes):
+    return df[column].isin(codes).to_numpy()
+
+def _coalesce(df, columns):
+    #Object arrays so compact categoricals with different categories combine
+    values = _objects(df[columns[0]])
+    for column in columns[1:]:
+        values = np.where(pd.isna(values), _objects(df[column]), values)
+    return values
+
+def _year_month(days):
+    #Equivalent of year() and month() on the days since epoch array
+    months = days.astype("int64").astype("datetime64[D]") \
+        .astype("datetime64[M]").astype("int64")
+    return months // 12 + 1970, months % 12 + 1
+
+def _performance_frame(df, date_days, org_col, ncl_col, metric, value,
+                       threshold):
+    #Build the standard PER_* output for a metric that is 1 row per record
+    year, month = _year_month(date_days)
+
+    return pd.DataFrame({
+        "RECORD_ID": _objects(df["RECORD_ID"]),
+        "PER_DATE_YEAR": year,
+        "PER_DATE_MONTH": month,
+        "PER_ORG_TRUST": _objects(df[org_col + "_TRUST"]),
+        "PER_ORG_SITE": _objects(df[org_col + "_SITE"]),
+        "PER_ORG_NCL": _objects(df[ncl_col]),
+        "PER_METRIC": metric,
+        "PER_VALUE": pd.array(value, dtype="Int64"),
+        "PER_NUMERATOR": np.where(value <= threshold, 0, 1),
+        "PER_DENOMINATOR": 1,
+        "PATHWAY": base_pathway(df)
+    })[PER_COLUMNS]
+
+#Local metric functions######################################################
+
+def _is_upgrade(df):
+    #Upgrade pathway returned as (is upgrade, is not upgrade) since a Null
+    # referral source leaves the pathway undetermined in Snowflake
+    source = _num(df, "PATHWAY_SOURCEOFREFERRALFOROUTPATIENT_CODE")
+    has_upgrade = _notnull(df, "DATE_CONSULTANTUPGRADEDATE")
+
+    is_upgrade = _ne(source, 17) & has_upgrade
+    not_upgrade = (source == 17) | ~has_upgrade
+
+    return is_upgrade, not_upgrade
+
+def _value_fds(df):
+    #FDS end date and value (The value is part of the FDS eligibility)
+    treatment_period_start = _days(df, "DATE_CANCERTREATMENTPERIODSTARTDATE")
+    fds_end = _days(df, "DATE_FDSPATHWAYENDDATE")
+
+    end_date = np.where(
+        treatment_period_start < fds_end, treatment_period_start, fds_end)
+
+    value = (
+        end_date -
+        _days(df, "DATE_CANCERREFERRALTOTREATMENTPERIODSTARTDATE") -
+        _adjustment(df, "WTA_FIRSTSEENADJUSTMENT")
+    )
+
+    return fds_end, value
+
+def _filter_31day(df, event_types):
+    #Filter shared by the 31 Day and 62 Day metrics
+    return (
+        _isin(df, "PATHWAY_CANCERTREATMENTEVENTTYPE_CODE", event_types) &
+        _ne(_num(df, "PATHWAY_CANCERTREATMENTMODALITY_CODE"), 98) &
+        _notnull(df, "CWT_PRIMARYDIAGNOSIS_CODE") &
+        _notnull(df, "DATE_CANCERTREATMENTPERIODSTARTDATE") &
+        _notnull(df, "DATE_TREATMENTSTARTDATE")
+    )
+
+def base_eligibility(df, bits=ue.ELIGIBLE_ALL):
+    """
+    Local version of CWT_ELIGIBILITY (docs/dynamic_cwt_base.sql).
+    df: Dataframe containing the base CWT data
+    bits: (Optional) Bits to derive (See util_eligibility), all by default
+    Returns:
+        - eligibility: NumPy int64 array of the eligibility bits of each row
+    """
+
+    eligibility = np.zeros(len(df), dtype="int64")
+
+    if bits & ue.ELIGIBLE_2WW:
+        eligibility |= ue.ELIGIBLE_2WW * (
+            (_num(df, "PATHWAY_PRIORITYTYPE_CODE") == 3) &
+            _ne(_num(df, "PATHWAY_SOURCEOFREFERRALFOROUTPATIENT_CODE"), 17) &
+            _notnull(df, "DATE_CANCERREFERRALTOTREATMENTPERIODSTARTDATE") &
+            _notnull(df, "DATE_DATEFIRSTSEEN")
+        )
+
+    if bits & ue.ELIGIBLE_FDS:
+        _, value = _value_fds(df)
+        eligibility |= ue.ELIGIBLE_FDS * (
+            (
+                _isin(df, "PATHWAY_FDPENDREASON_CODE", ["01", "02", "04"]) |
+                (
+                    (df["PATHWAY_FDPENDREASON_CODE"] == "03").to_numpy() &
+                    (df["PATHWAY_FDPEXCLUSIONREASON_CODE"] == "01").to_numpy() &
+                    (value > 28)
+                )
+            ) &
+            _notnull(df, "DATE_CANCERREFERRALTOTREATMENTPERIODSTARTDATE") &
+            _notnull(df, "DATE_FDSPATHWAYENDDATE")
+        )
+
+    if bits & (ue.ELIGIBLE_31DAY_FIRST | ue.ELIGIBLE_62DAY):
+        first = _filter_31day(df, ["01", "07", "12"])
+        eligibility |= ue.ELIGIBLE_31DAY_FIRST * first
+
+    if bits & ue.ELIGIBLE_31DAY_SUB:
+        eligibility |= ue.ELIGIBLE_31DAY_SUB * _filter_31day(
+            df, ["02", "03", "04", "05", "06", "08", "09", "10", "11"])
+
+    if bits & ue.ELIGIBLE_62DAY:
+        is_upgrade, _ = _is_upgrade(df)
+        eligibility |= ue.ELIGIBLE_62DAY * (
+            first &
+            #(For all USC, Screening activity; First Seen Org is required)
+            (_notnull(df, "ORG_FIRSTSEEN_TRUST") | is_upgrade)
+        )
+
+    return eligibility & bits
+
+def _eligible(df, bits):
+    #Rows valid for any of the bits, from CWT_ELIGIBILITY when the extract
+    # has it (Older extracts derive the bits from the base columns)
+    if ue.ELIGIBILITY_COLUMN in df.columns:
+        eligibility = df[ue.ELIGIBILITY_COLUMN].to_numpy(
+            dtype="int64", na_value=0)
+    else:
+        eligibility = base_eligibility(df, bits)
+
+    return ue.eligible_array(eligibility, bits)
+
+def determine_pathway(df):
+    """
+    Local version of determine_pathway (feature_dynamic_pathway.py).
+    df: Dataframe containing the base CWT data
+    Returns:
+        - df: Dataframe containing the RECORD_ID and PATHWAY
+    """
+
+    return pd.DataFrame({
+        "RECORD_ID": _objects(df["RECORD_ID"]),
+        "PATHWAY": base_pathway(df)
+    })
+
+def base_pathway(df):
+    """
+    Local version of util_pathway.pathway_column, the pathway of each row.
+    df: Dataframe containing the base CWT data
+    Returns:
+        - pathway: NumPy object array of pathway names
+    """
+
+    priority = _num(df, "PATHWAY_PRIORITYTYPE_CODE")
+    ref_type = _num(df, "CWT_CANCERREFERALTYPE_CODE")
+    source = _num(df, "PATHWAY_SOURCEOFREFERRALFOROUTPATIENT_CODE")
+    no_upgrade = ~_notnull(df, "DATE_CONSULTANTUPGRADEDATE")
+
+    pathway_usc = (
+        (priority == 3) & _ne(ref_type, 16) & _ne(source, 17) & no_upgrade)
+
+    pathway_breastsymp = (
+        (priority == 3) & (ref_type == 16) & _ne(source, 17) & no_upgrade)
+
+    pathway_screening = (priority == 2) & (source == 17)
+
+    pathway_upgrade, _ = _is_upgrade(df)
+
+    return np.select(
+        [pathway_usc, pathway_breastsymp, pathway_screening, pathway_upgrade],
+        [upw.PATHWAY_USC, upw.PATHWAY_BREASTSYMP, upw.PATHWAY_SCREENING,
+         upw.PATHWAY_UPGRADE],
+        default=upw.PATHWAY_UNKNOWN
+    ).astype(object)
+
+def performance_2ww(df):
+    """
+    Local version of performance_2ww (feature_dynamic_performance_2ww.py).
+    df: Dataframe containing the base CWT data
+    Returns:
+        - df: Dataframe containing the PER_* columns
+    """
+
+    #Filter out to only valid 2ww records
+    df = df[_eligible(df, ue.ELIGIBLE_2WW)]
+
+    first_seen = _days(df, "DATE_DATEFIRSTSEEN")
+
+    #Calculate the 2ww value
+    value = (
+        first_seen -
+        _days(df, "DATE_CANCERREFERRALTOTREATMENTPERIODSTARTDATE") -
+        _adjustment(df, "WTA_FIRSTSEENADJUSTMENT")
+    )
+
+    return _performance_frame(
+        df, first_seen, "ORG_FIRSTSEEN", "IS_GEO_TRUST_DATEFIRSTSEEN",
+        "2WW", value, 14)
+
+def performance_fds(df):
+    """
+    Local version of performance_fds (feature_dynamic_performance_fds.py).
+    df: Dataframe containing the base CWT data
+    Returns:
+        - df: Dataframe containing the PER_* columns
+    """
+
+    #Filter out to only valid FDS records
+    df = df[_eligible(df, ue.ELIGIBLE_FDS)]
+
+    fds_end, value = _value_fds(df)
+
+    return _performance_frame(
+        df, fds_end, "ORG_FDPEND", "IS_GEO_TRUST_FDS", "FDS", value, 28)
+
+def _performance_31day(df):
+    treatment_start = _days(df, "DATE_TREATMENTSTARTDATE")
+
+    #Calculate the 31 Day value
+    value = (
+        treatment_start -
+        _days(df, "DATE_CANCERTREATMENTPERIODSTARTDATE") -
+        _adjustment(df, "WTA_TREATMENTADJUSTMENT")
+    )
+
+    return _performance_frame(
+        df, treatment_start, "ORG_ACCOUNTABLETREATING",
+        "IS_GEO_TRUST_TREATMENTSTARTDATE", "31 Day", value, 31)
+
+def performance_31day_first(df):
+    """
+    Local version of performance_31day_first
+    (feature_dynamic_performance_31_first.py).
+    df: Dataframe containing the base CWT data
+    Returns:
+        - df: Dataframe containing the PER_* columns
+    """
+
+    df = df[_eligible(df, ue.ELIGIBLE_31DAY_FIRST)]
+
+    return _performance_31day(df)
+
+def performance_31day_sub(df):
+    """
+    Local version of performance_31day_sub
+    (feature_dynamic_performance_31_sub.py).
+    df: Dataframe containing the base CWT data
+    Returns:
+        - df: Dataframe containing the PER_* columns and D31_BREAKDOWN
+    """
+
+    df = df[_eligible(df, ue.ELIGIBLE_31DAY_SUB)]
+
+    df_out = _performance_31day(df)
+
+    #Add field for 31 Day Breakdown
+    df_out["D31_BREAKDOWN"] = np.select(
+        [
+            _isin(df, "PATHWAY_CANCERTREATMENTMODALITY_CODE",
+                  ["02", "03", "14", "15"]),
+            _isin(df, "PATHWAY_CANCERTREATMENTMODALITY_CODE",
+                  ["01", "23", "24"]),
+            _isin(df, "PATHWAY_CANCERTREATMENTMODALITY_CODE",
+                  ["04", "05", "06", "13"])
+        ],
+        ["Anti Cancer Drug Treatment", "Surgery", "Radiotherapy"],
+        default="Unknown"
+    )
+
+    return df_out[D31_COLUMNS]
+
+def _records_62day(df):
+    #Filter to valid 62 Day records and derive the record level values used
+    # to build the provider allocation rows
+
+    #Filter out to only valid 62 Day records
+    df = df[_eligible(df, ue.ELIGIBLE_62DAY)]
+
+    #Define Upgrade pathway as some logic is dependent on it
+    is_upgrade, not_upgrade = _is_upgrade(df)
+
+    referral = _days(df, "DATE_CANCERREFERRALTOTREATMENTPERIODSTARTDATE")
+    upgrade = _days(df, "DATE_CONSULTANTUPGRADEDATE")
+    first_seen = _days(df, "DATE_DATEFIRSTSEEN")
+    transfer = _days(df, "DATE_TRANSFERTOTREATMENTDATE")
+    treatment_start = _days(df, "DATE_TREATMENTSTARTDATE")
+    adj_first_seen = _adjustment(df, "WTA_FIRSTSEENADJUSTMENT")
+    adj_treatment = _adjustment(df, "WTA_TREATMENTADJUSTMENT")
+
+    #If Upgrade then calculation depends if the upgrade date is before or
+    # on the date first seen
+    upgrade_early = upgrade <= first_seen
+
+    #Calculate the 62 Day value
+    value = np.select(
+        [not_upgrade, upgrade_early],
+        [
+            treatment_start - referral - adj_first_seen - adj_treatment,
+            treatment_start - upgrade - adj_first_seen - adj_treatment
+        ],
+        default=treatment_start - upgrade - adj_treatment
+    )
+
+    #Calculate 38 Day and 24 Day values (only used for 6 Scenarios)
+    value_38 = np.select(
+        [not_upgrade, upgrade_early],
+        [
+            transfer - referral - adj_first_seen,
+            transfer - upgrade - adj_first_seen
+        ],
+        default=transfer - upgrade
+    )
+
+    value_24 = treatment_start - transfer - adj_treatment
+
+    #Determine Accountable Investigating Provider
+    acc_diagnostic = _coalesce(df, [
+        "ORG_ACCOUNTABLEINVESTIGATING_TRUST",
+        "ORG_CONSULTANTUPGRADE_TRUST",
+        "ORG_FIRSTSEEN_TRUST"
+    ])
+
+    acc_treatment = _objects(df["ORG_ACCOUNTABLETREATING_TRUST"])
+
+    #Determine allocation method
+    is_solo = (
+        pd.notna(acc_diagnostic) & pd.notna(acc_treatment) &
+        (acc_diagnostic == acc_treatment)
+    )
+    is_5050 = ~is_solo & ~_notnull(df, "ORG_ACCOUNTABLEINVESTIGATING_TRUST")
+    is_6s = ~is_solo & ~is_5050
+
+    allocation_method = np.select(
+        [is_solo, is_5050], ["Solo", "5050"], default="6 Scenarios")
+
+    #Boolean shorthand to determine breaches (Null values are neither)
+    d62 = value <= 62
+    d38 = value_38 <= 38
+    d24 = value_24 <= 24
+
+    #Determine which scenario from the breach code (NaN if not 6 Scenarios)
+    breach_code = np.where(
+        is_6s, ua.breach_code_array(value, value_38, value_24), -1)
+    scenario = ua.scenario_array(breach_code)
+
+    year, month = _year_month(treatment_start)
+    numerator = np.where(d62, 0.0, 1.0)
+
+    ncl_treatment = _objects(df["IS_GEO_TRUST_TREATMENTSTARTDATE"])
+    ncl_diagnostic = _coalesce(df, [
+        "IS_GEO_TRUST_ACCOUNTABLEINVESTIGATING",
+        "IS_GEO_TRUST_CONSULTANTUPGRADE",
+        "IS_GEO_TRUST_DATEFIRSTSEEN"
+    ])
+
+    return {
+        "record_id": _objects(df["RECORD_ID"]),
+        "pathway": base_pathway(df),
+        "year": year,
+        "month": month,
+        "value": value,
+        "value_38": value_38,
+        "value_24": value_24,
+        "d38": d38,
+        "d24": d24,
+        "numerator": numerator,
+        "acc_diagnostic": acc_diagnostic,
+        "acc_treatment": acc_treatment,
+        "site_treatment": _objects(df["ORG_ACCOUNTABLETREATING_SITE"]),
+        "ncl_diagnostic": ncl_diagnostic,
+        "ncl_treatment": ncl_treatment,
+        "is_solo": is_solo,
+        "is_5050": is_5050,
+        "is_6s": is_6s,
+        "allocation_method": allocation_method,
+        "breach_code": breach_code,
+        "scenario": scenario
+    }
+
+def _frame_62day(rec, rows, trust, site, ncl, metric, value,
+                 numerator, denominator):
+    #Output dataframe for the record indices in rows
+    return pd.DataFrame({
+        "RECORD_ID": rec["record_id"][rows],
+        "PER_DATE_YEAR": rec["year"][rows],
+        "PER_DATE_MONTH": rec["month"][rows],
+        "PER_ORG_TRUST": trust,
+        "PER_ORG_SITE": site,
+        "PER_ORG_NCL": ncl,
+        "PER_METRIC": metric,
+        "PER_VALUE": pd.array(value, dtype="Int64"),
+        "PER_NUMERATOR": numerator,
+        "PER_DENOMINATOR": denominator,
+        "PATHWAY": rec["pathway"][rows],
+        "D62_ACC_DIAGNOSTIC": rec["acc_diagnostic"][rows],
+        "D62_ACC_TREATMENT": rec["acc_treatment"][rows],
+        "D62_ALLOCATIONMETHOD": rec["allocation_method"][rows],
+        "D62_6S_SCENARIO": pd.array(rec["scenario"][rows], dtype="Int64")
+    })[D62_COLUMNS]
+
+def performance_62day(df):
+    """
+    Local version of performance_62day (feature_dynamic_performance_62.py).
+    Each allocation method and provider is built separately and concatenated.
+    df: Dataframe containing the base CWT data
+    Returns:
+        - df: Dataframe containing the PER_* and D62_* columns
+    """
+
+    rec = _records_62day(df)
+
+    is_solo, is_5050, is_6s = rec["is_solo"], rec["is_5050"], rec["is_6s"]
+    breach_code = rec["breach_code"]
+    numerator = rec["numerator"]
+
+    def allocation_rows(rows, trust, site, ncl, metric, per_value,
+                        per_numerator, per_denominator):
+        return _frame_62day(
+            rec, rows, trust[rows], site[rows] if site is not None else None,
+            ncl[rows], metric, per_value[rows], per_numerator[rows],
+            per_denominator[rows])
+
+    full = np.ones(len(is_solo))
+    half = np.full(len(is_solo), 0.5)
+    acc_diagnostic, acc_treatment = rec["acc_diagnostic"], rec["acc_treatment"]
+    ncl_diagnostic, ncl_treatment = rec["ncl_diagnostic"], rec["ncl_treatment"]
+    site_treatment = rec["site_treatment"]
+    value, value_38, value_24 = rec["value"], rec["value_38"], rec["value_24"]
+
+    df_out = pd.concat([
+        #Solo
+        allocation_rows(is_solo, acc_diagnostic, None, ncl_treatment,
+                        "62 Day", value, numerator, full),
+        #5050
+        allocation_rows(is_5050, acc_diagnostic, None, ncl_diagnostic,
+                        "62 Day", value, numerator * 0.5, half),
+        allocation_rows(is_5050, acc_treatment, None, ncl_treatment,
+                        "62 Day", value, numerator * 0.5, half),
+        #6 Scenarios
+        allocation_rows(is_6s, acc_diagnostic, None, ncl_diagnostic,
+                        "62 Day", value, ua.allocation_array("diag", "num", breach_code),
+                        ua.allocation_array("diag", "den", breach_code)),
+        allocation_rows(is_6s, acc_treatment, site_treatment, ncl_treatment,
+                        "62 Day", value, ua.allocation_array("treat", "num", breach_code),
+                        ua.allocation_array("treat", "den", breach_code)),
+        #38 Day and 24 Day Performance
+        allocation_rows(is_6s, acc_diagnostic, None, ncl_diagnostic,
+                        "38 Day", value_38, np.where(rec["d38"], 0, 1), full),
+        allocation_rows(is_6s, acc_treatment, site_treatment, ncl_treatment,
+                        "24 Day", value_24, np.where(rec["d24"], 0, 1), full)
+    ], ignore_index=True)
+
+    return df_out
+
+def performance_62day_single_scan(df):
+    """
+    Single scan version of performance_62day.
+    Every record is repeated once per provider allocation row it produces
+    (Solo 1, 5050 2, 6 Scenarios 4) and the row values are picked from a
+    per-record table of slots, so the cost grows with the row count only.
+    df: Dataframe containing the base CWT data
+    Returns:
+        - df: Dataframe containing the PER_* and D62_* columns
+    """
+
+    rec = _records_62day(df)
+
+    is_solo, is_5050, is_6s = rec["is_solo"], rec["is_5050"], rec["is_6s"]
+    breach_code = rec["breach_code"]
+    numerator = rec["numerator"]
+
+    #Slots for each record: diagnostic/solo, treatment, 38 Day, 24 Day
+    n_rows = 1 + (~is_solo).astype(int) + 2 * is_6s.astype(int)
+    rows = np.repeat(np.arange(len(n_rows)), n_rows)
+    slot = np.arange(len(rows)) - np.repeat(np.cumsum(n_rows) - n_rows, n_rows)
+
+    def pick(*slot_values):
+        return np.stack(slot_values, axis=1)[rows, slot]
+
+    no_site = np.full(len(n_rows), None, dtype=object)
+    site_treatment = rec["site_treatment"]
+
+    return _frame_62day(
+        rec, rows,
+        pick(rec["acc_diagnostic"], rec["acc_treatment"],
+             rec["acc_diagnostic"], rec["acc_treatment"]),
+        pick(no_site, np.where(is_6s, site_treatment, None),
+             no_site, site_treatment),
+        pick(np.where(is_solo, rec["ncl_treatment"], rec["ncl_diagnostic"]),
+             rec["ncl_treatment"], rec["ncl_diagnostic"], rec["ncl_treatment"]),
+        np.array(["62 Day", "62 Day", "38 Day", "24 Day"])[slot],
+        pick(rec["value"], rec["value"], rec["value_38"], rec["value_24"]),
+        pick(
+            np.select([is_solo, is_5050], [numerator, numerator * 0.5],
+                      default=ua.allocation_array("diag", "num", breach_code)),
+            np.where(is_5050, numerator * 0.5,
+                     ua.allocation_array("treat", "num", breach_code)),
+            np.where(rec["d38"], 0.0, 1.0),
+            np.where(rec["d24"], 0.0, 1.0)),
+        pick(
+            np.select([is_solo, is_5050], [1.0, 0.5],
+                      default=ua.allocation_array("diag", "den", breach_code)),
+            np.where(is_5050, 0.5,
+                     ua.allocation_array("treat", "den", breach_code)),
+            np.ones(len(n_rows)),
+            np.ones(len(n_rows)))
+    )
+
+#Combined performance table#################################################
+
+#Tables in CWT_PERFORMANCE that are only reported for known pathways
+# (31 Day is not dependent on the standard pathway options)
+PATHWAY_TABLES = ["CWT_PERFORMANCE_2WW", "CWT_PERFORMANCE_FDS",
+    "CWT_PERFORMANCE_62DAY"]
+
+def combine_performance(frames):
+    """
+    Local version of CWT_PERFORMANCE (docs/dynamic_cwt_performance.sql).
+    frames: Dictionary of performance table name (i.e. CWT_PERFORMANCE_2WW)
+        to the output of its local function
+    Returns:
+        - df: Dataframe with the PER_COLUMNS of every table, without the
+            Unknown pathway rows of the PATHWAY_TABLES
+    """
+
+    return pd.concat([
+        df[PER_COLUMNS][(df["PATHWAY"] != upw.PATHWAY_UNKNOWN).to_numpy()]
+        if table in PATHWAY_TABLES else df[PER_COLUMNS]
+        for table, df in frames.items()
+    ], ignore_index=True)
+
+def performance_all(df):
+    """
+    Local version of the fused CWT_PERFORMANCE
+    (feature_dynamic_performance.performance_all), every metric combined
+    from one base frame as in combine_performance.
+    df: Pandas dataframe containing the base CWT data
+    Returns:
+        - df: Dataframe with the PER_COLUMNS of every metric
+    """
+
+    return combine_performance({
+        "CWT_PERFORMANCE_2WW": performance_2ww(df),
+        "CWT_PERFORMANCE_FDS": performance_fds(df),
+        "CWT_PERFORMANCE_31DAY_FIRST": performance_31day_first(df),
+        "CWT_PERFORMANCE_31DAY_SUBSEQUENT": performance_31day_sub(df),
+        "CWT_PERFORMANCE_62DAY": performance_62day(df)
+    })
+
+#Performance cube###########################################################
+
+#Grouping columns of the cube (docs/dynamic_cwt_performance_cube.sql)
+CUBE_KEYS = ["PER_DATE_YEAR", "PER_DATE_MONTH", "PER_METRIC", "PATHWAY",
+    "PER_ORG_NCL", "PER_ORG_TRUST", "PER_ORG_SITE"]
+
+#Organisation columns kept at each level of the cube
+CUBE_ORG_LEVELS = {
+    "Site": ["PER_ORG_NCL", "PER_ORG_TRUST", "PER_ORG_SITE"],
+    "Trust": ["PER_ORG_NCL", "PER_ORG_TRUST"],
+    "NCL": ["PER_ORG_NCL"],
+    "All": []
+}
+
+CUBE_COLUMNS = ["PER_DATE_YEAR", "PER_DATE_MONTH", "PER_ORG_TRUST",
+    "PER_ORG_SITE", "PER_ORG_NCL", "PER_METRIC", "PATHWAY", "CUBE_ORG_LEVEL",
+    "CUBE_ALL_PATHWAYS", "PER_NUMERATOR", "PER_DENOMINATOR", "PER_COUNT"]
+
+def performance_cube(df_performance):
+    """
+    Local version of CWT_PERFORMANCE_CUBE (docs/dynamic_cwt_performance_cube.sql).
+    The performance rows are aggregated once to the finest level and every
+    rollup level is summed from that, as the totals are additive.
+    df_performance: Dataframe shaped like CWT_PERFORMANCE (With the PATHWAY
+        of each row, see combine_performance)
+    Returns:
+        - df: Dataframe with a row per group at each level of the cube
+    """
+
+    df = df_performance
+
+    df_finest = df.groupby(CUBE_KEYS, dropna=False, sort=False).agg(
+        PER_NUMERATOR=("PER_NUMERATOR", "sum"),
+        PER_DENOMINATOR=("PER_DENOMINATOR", "sum"),
+        PER_COUNT=("RECORD_ID", "size")
+    ).reset_index()
+
+    levels = []
+    for level, org_keys in CUBE_ORG_LEVELS.items():
+        for all_pathways in [False, True]:
+            keys = ["PER_DATE_YEAR", "PER_DATE_MONTH", "PER_METRIC"] + \
+                ([] if all_pathways else ["PATHWAY"]) + org_keys
+            df_level = df_finest.groupby(keys, dropna=False, sort=False)[
+                ["PER_NUMERATOR", "PER_DENOMINATOR", "PER_COUNT"]
+            ].sum().reset_index()
+            df_level["CUBE_ORG_LEVEL"] = level
+            df_level["CUBE_ALL_PATHWAYS"] = all_pathways
+            levels.append(df_level)
+
+    return pd.concat(levels, ignore_index=True).reindex(columns=CUBE_COLUMNS)
+
+#Waiting time histogram######################################################
+
+#Grouping columns of the histogram (docs/dynamic_cwt_value_histogram.sql)
+HISTOGRAM_KEYS = ["PER_DATE_YEAR", "PER_DATE_MONTH", "PER_ORG_TRUST",
+    "PER_ORG_SITE", "PER_ORG_NCL", "PER_METRIC", "PER_VALUE"]
+
+HISTOGRAM_COLUMNS = HISTOGRAM_KEYS + ["HIST_WEIGHT", "HIST_COUNT"]
+
+def value_histogram(df_performance):
+    """
+    Local version of CWT_VALUE_HISTOGRAM (docs/dynamic_cwt_value_histogram.sql).
+    df_performance: Dataframe shaped like CWT_PERFORMANCE (or any of the
+        performance tables)
+    Returns:
+        - df: Dataframe with the weight and count of each PER_VALUE by month,
+            organisation and metric
+    """
+
+    return df_performance.groupby(
+        HISTOGRAM_KEYS, dropna=False, sort=False
+    ).agg(
+        HIST_WEIGHT=("PER_DENOMINATOR", "sum"),
+        HIST_COUNT=("RECORD_ID", "size")
+    ).reset_index()[HISTOGRAM_COLUMNS]
@@ -0,0 +1,162 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+#Compact in-process copy of CWT_ORGANISATION (docs/dynamic_cwt_organisation.sql)
+#Organisation codes are dictionary encoded so resolving a column of site codes
+# is one hash lookup into the site codes and one array gather for the trust
+# and NCL flag, instead of a join per organisation column
+#The lookup is a dictionary of:
+# - version: ORG_VERSION of the mapping it was built from
+# - sites: pd.Index of the organisation codes
+# - trusts: Array of the trust codes with None as the last entry
+# - site_trust: Index into trusts for each site, with a final entry pointing
+#   at None so an unknown site (get_indexer gives -1) resolves to Null
+# - trust_ncl: NCL flag for each trust (None for the Null trust)
+
+ORG_TABLE = "DEV__MODELLING.CANCER__CWT_PATHWAY.CWT_ORGANISATION"
+
+ORG_QUERY = f"SELECT ORG_SITE, ORG_TRUST, IS_NCL, ORG_VERSION FROM {ORG_TABLE}"
+
+VERSION_QUERY = f"SELECT MAX(ORG_VERSION) AS ORG_VERSION FROM {ORG_TABLE}"
+
+ORG_CACHE_PATH = "data/org_lookup.parquet"
+
+def org_lookup(df, version=None):
+    """
+    Build the compact organisation lookup from the organisation dimension.
+    Organisation codes should be unique but if a code is duplicated the first
+    row is used.
+    df: Pandas dataframe with ORG_SITE, ORG_TRUST and IS_NCL columns
+        (and optionally ORG_VERSION)
+    version: (Optional) Version of the mapping, taken from ORG_VERSION by default
+    Returns:
+        - lookup: Dictionary containing the encoded lookup (See top of file)
+    """
+
+    if version is None and "ORG_VERSION" in df.columns and len(df) > 0:
+        version = int(df["ORG_VERSION"].iloc[0])
+
+    df = df[df["ORG_SITE"].notna()].drop_duplicates("ORG_SITE")
+
+    #Encode the trusts with the Null trust as the last code
+    trust_codes, trusts = pd.factorize(df["ORG_TRUST"])
+    trust_codes[trust_codes < 0] = len(trusts)
+    trusts = np.append(trusts.to_numpy(dtype=object), None)
+
+    #NCL flag per trust (Every site of a trust has the same flag)
+    trust_ncl = np.full(len(trusts), None, dtype=object)
+    trust_ncl[trust_codes] = df["IS_NCL"].to_numpy(dtype=object)
+    trust_ncl[-1] = None
+
+    return {
+        "version": version,
+        "sites": pd.Index(df["ORG_SITE"].to_numpy(dtype=object)),
+        "trusts": trusts,
+        "site_trust": np.append(trust_codes, len(trusts) - 1).astype("int32"),
+        "trust_ncl": trust_ncl
+    }
+
+def org_frame(lookup):
+    """
+    Get the organisation dimension back from a lookup.
+    Returns:
+        - df: Pandas dataframe with ORG_SITE, ORG_TRUST, IS_NCL and ORG_VERSION
+    """
+
+    site_trust = lookup["site_trust"][:-1]
+
+    return pd.DataFrame({
+        "ORG_SITE": lookup["sites"].to_numpy(dtype=object),
+        "ORG_TRUST": lookup["trusts"][site_trust],
+        "IS_NCL": lookup["trust_ncl"][site_trust],
+        "ORG_VERSION": lookup["version"]
+    })
+
+def org_resolve(lookup, codes):
+    """
+    Resolve organisation codes to their trust and NCL flag.
+    Equivalent of a LEFT JOIN to CWT_ORGANISATION on ORG_SITE, so Null and
+    unknown codes give a Null trust and flag.
+    lookup: Lookup from org_lookup
+    codes: Array-like of organisation codes
+    Returns:
+        - trust: Object array of trust codes
+        - is_ncl: Object array of NCL flags (True, False or None)
+    """
+
+    trust_index = lookup["site_trust"][lookup["sites"].get_indexer(codes)]
+
+    return lookup["trusts"][trust_index], lookup["trust_ncl"][trust_index]
+
+def org_is_ncl_trust(lookup, codes):
+    """
+    Check whether trust codes are NCL trusts.
+    Equivalent of code IN (SELECT ORG_TRUST FROM CWT_ORGANISATION WHERE IS_NCL)
+    so a Null code gives a Null flag and any other code gives True or False.
+    Returns:
+        - is_ncl: Object array of NCL flags (True, False or None)
+    """
+
+    ncl_trusts = lookup["trusts"][lookup["trust_ncl"] == True]
+    codes = pd.Series(codes, dtype=object)
+
+    return codes.isin(ncl_trusts).astype(object).where(codes.notna(), None) \
+        .to_numpy(dtype=object)
+
+def org_lookup_save(lookup, path=ORG_CACHE_PATH):
+    """
+    Save a lookup to a parquet file with the version in the file metadata.
+    """
+
+    table = pa.Table.from_pandas(org_frame(lookup), preserve_index=False)
+    table = table.replace_schema_metadata({
+        **(table.schema.metadata or {}),
+        b"org_version": json.dumps(lookup["version"]).encode("utf-8")
+    })
+
+    folder = os.path.dirname(path)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+    pq.write_table(table, path + ".tmp")
+    os.replace(path + ".tmp", path)
+
+def _saved_version(path):
+    #Version stored by org_lookup_save (None if there is no saved lookup)
+    if not os.path.exists(path):
+        return None
+    metadata = pq.read_schema(path).metadata or {}
+    return json.loads(metadata.get(b"org_version", b"null"))
+
+def org_lookup_load(session=None, path=ORG_CACHE_PATH):
+    """
+    Load the organisation lookup, only fetching CWT_ORGANISATION when the
+    saved copy is out of date.
+    session: (Optional) Snowpark session, if not passed the saved copy is used
+        without checking the version
+    path: Parquet file to keep the saved copy in
+    Returns:
+        - lookup: Dictionary containing the encoded lookup (See top of file)
+    """
+
+    saved_version = _saved_version(path)
+
+    if session is None:
+        if saved_version is None and not os.path.exists(path):
+            raise FileNotFoundError(
+                f"No saved organisation lookup at {path}, pass a session to fetch it.")
+        return org_lookup(pd.read_parquet(path), version=saved_version)
+
+    version = session.sql(VERSION_QUERY).collect()[0]["ORG_VERSION"]
+
+    if saved_version is not None and saved_version == version:
+        return org_lookup(pd.read_parquet(path), version=saved_version)
+
+    lookup = org_lookup(session.sql(ORG_QUERY).to_pandas(), version=version)
+    org_lookup_save(lookup, path)
+
+    return lookup
@@ -0,0 +1,198 @@
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+import utils.util_columns as ucol
+
+#Parallel version of the local metric engine
+#The base is split into shards by a hash of RECORD_ID so every row of a record
+# is in the same shard (The 62 Day allocation and latest submission logic
+# look across the rows of a record). Shards are written as uncompressed arrow
+# IPC files which the workers memory map, so the base is never pickled to
+# the workers, and each worker writes its output the same way.
+#Outputs are concatenated in shard order so a run gives the same rows in the
+# same order every time (The order differs from a single process run)
+
+def shard_index(record_ids, n_shards):
+    """
+    Get the shard for each row from its RECORD_ID.
+    Uses a fixed hash so the same record is in the same shard on every run.
+    record_ids: Array-like of RECORD_IDs
+    n_shards: Number of shards
+    Returns:
+        - shard: NumPy array of shard numbers (0 to n_shards - 1)
+    """
+
+    hashes = pd.util.hash_array(
+        np.asarray(record_ids, dtype=object), categorize=True)
+
+    return (hashes % np.uint64(n_shards)).astype("int32")
+
+def _write_ipc(table, path):
+    #Uncompressed so the file can be memory mapped without decoding
+    with pa.OSFile(path, "wb") as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+
+def _read_ipc(path):
+    #Memory mapped read (The buffers are the pages of the file)
+    with pa.memory_map(path, "r") as source:
+        return pa.ipc.open_file(source).read_all()
+
+def shard_base(df_base, folder, n_shards, columns=None):
+    """
+    Split a base extract into RECORD_ID shards in a folder.
+    df_base: Pandas dataframe or arrow table containing the base CWT data, or
+        the path of a parquet extract
+    folder: Folder to write the shards to
+    n_shards: Number of shards
+    columns: (Optional) List of columns to keep, keeps all columns by default
+    Returns:
+        - paths: List of shard file paths in shard order
+    """
+
+    if isinstance(df_base, str):
+        table = pq.read_table(df_base, columns=columns)
+    elif isinstance(df_base, pd.DataFrame):
+        table = pa.Table.from_pandas(
+            df_base if columns is None else df_base[columns],
+            preserve_index=False)
+    else:
+        table = df_base if columns is None else df_base.select(columns)
+
+    shard = shard_index(table.column("RECORD_ID").to_numpy(), n_shards)
+
+    #Stable sort keeps the base order of the rows within each shard
+    order = np.argsort(shard, kind="stable")
+    bounds = np.searchsorted(shard[order], np.arange(n_shards + 1))
+
+    os.makedirs(folder, exist_ok=True)
+    paths = []
+    for i in range(n_shards):
+        path = os.path.join(folder, f"base_{i:04d}.arrow")
+        _write_ipc(table.take(order[bounds[i]:bounds[i + 1]]), path)
+        paths.append(path)
+
+    return paths
+
+def _run_shard(transformation_func, shard_path, output_path, compact):
+    #Worker: run a metric function on one memory mapped shard
+    table = _read_ipc(shard_path)
+
+    if compact:
+        import utils.util_compact as ucp
+        df_base = ucp.compact_pandas(ucp.compact_table(table))
+    else:
+        df_base = table.to_pandas()
+
+    df = transformation_func(df_base)
+    _write_ipc(pa.Table.from_pandas(df, preserve_index=False), output_path)
+
+    return output_path
+
+def parallel_local_features(transformation_funcs, df_base, n_workers=None,
+                            n_shards=None, folder=None, compact=False):
+    """
+    Run local metric functions over RECORD_ID shards of the base in a
+    process pool.
+    transformation_funcs: Function from util_local (i.e. ul.performance_62day)
+        or a dictionary of output name to function
+    df_base: Pandas dataframe, arrow table or parquet path of the base data
+    n_workers: (Optional) Number of processes, the number of CPUs by default
+    n_shards: (Optional) Number of shards, 4 per worker by default so
+        uneven shards do not leave workers idle
+    folder: (Optional) Folder for the shard files, a temporary folder that
+        is removed afterwards by default
+    compact: If True, workers load their shard with the util_compact dtypes
+    Returns:
+        - df: Output dataframe (or dictionary of output name to dataframe)
+    """
+
+    is_single = callable(transformation_funcs)
+    if is_single:
+        transformation_funcs = {"output": transformation_funcs}
+
+    n_workers = n_workers or os.cpu_count() or 1
+    n_shards = n_shards or n_workers * 4
+
+    is_temporary = folder is None
+    if is_temporary:
+        folder = tempfile.mkdtemp(prefix="cwt_shards_")
+
+    try:
+        time_start = time.perf_counter()
+        #Shards only hold the columns the functions read (See util_columns)
+        shard_paths = shard_base(
+            df_base, folder, n_shards,
+            ucol.base_columns(*transformation_funcs.values()))
+        print(f"Sharded the base into {n_shards} shards in "
+              f"{time.perf_counter() - time_start:.2f}s")
+
+        #Spawn so workers do not inherit a copy of the parent's memory
+        with ProcessPoolExecutor(
+                max_workers=n_workers,
+                mp_context=multiprocessing.get_context("spawn")) as pool:
+            futures = {
+                name: [
+                    pool.submit(
+                        _run_shard, transformation_func, shard_path,
+                        os.path.join(folder, f"{name}_{i:04d}.arrow"), compact)
+                    for i, shard_path in enumerate(shard_paths)
+                ]
+                for name, transformation_func in transformation_funcs.items()
+            }
+
+            #Concatenate in shard order (Not completion order)
+            outputs = {
+                name: pa.concat_tables(
+                    [_read_ipc(future.result()) for future in shard_futures],
+                    promote_options="permissive"
+                ).to_pandas()
+                for name, shard_futures in futures.items()
+            }
+    finally:
+        if is_temporary:
+            shutil.rmtree(folder, ignore_errors=True)
+
+    return outputs["output"] if is_single else outputs
+
+def check_parallel(transformation_funcs, df_base, compact=False, **kwargs):
+    """
+    Check parallel_local_features gives the same rows as the serial run.
+    Each shard is its own subset of the base, so with compact=True this also
+    checks the metrics on categoricals with different categories per shard.
+    transformation_funcs: As for parallel_local_features
+    df_base: Pandas dataframe of the base data
+    compact: If True, workers load their shard with the util_compact dtypes
+    kwargs: Passed to parallel_local_features (i.e. n_workers)
+    Returns:
+        - results: Dictionary of output name to True if the outputs match
+    """
+
+    if callable(transformation_funcs):
+        transformation_funcs = {
+            transformation_funcs.__name__: transformation_funcs}
+
+    outputs = parallel_local_features(
+        transformation_funcs, df_base, compact=compact, **kwargs)
+
+    #Outputs are in shard order, rows of a record stay in base order
+    def _by_record(df):
+        return df.sort_values("RECORD_ID", kind="stable").reset_index(drop=True)
+
+    results = {}
+    for name, transformation_func in transformation_funcs.items():
+        results[name] = _by_record(outputs[name]).equals(
+            _by_record(transformation_func(df_base)))
+        if not results[name]:
+            print(f"{name} gives different output in parallel.")
+
+    return results
@@ -0,0 +1,249 @@
+import os
+import shutil
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+
+import utils.util_snowflake as us
+
+#Hive partitioned parquet copy of the performance tables
+#Files are laid out as PER_DATE_YEAR=2025/PER_DATE_MONTH=3/PER_METRIC=62 Day/
+# so a read for one month and metric only opens the files in that folder.
+#Within a partition rows are sorted by trust so the row group statistics let
+# a trust filter skip row groups as well
+
+#Performance tables to export (Every table is written with the full schema,
+# with Null for the breakdown columns it does not have)
+PERFORMANCE_TABLES = [
+    "CWT_PERFORMANCE_2WW",
+    "CWT_PERFORMANCE_FDS",
+    "CWT_PERFORMANCE_31DAY_FIRST",
+    "CWT_PERFORMANCE_31DAY_SUBSEQUENT",
+    "CWT_PERFORMANCE_62DAY"
+]
+
+PARTITION_COLUMNS = ["PER_DATE_YEAR", "PER_DATE_MONTH", "PER_METRIC"]
+
+#Column order of the export, sorted within each partition by SORT_COLUMNS
+PERFORMANCE_SCHEMA = pa.schema([
+    ("RECORD_ID", pa.string()),
+    ("PER_DATE_YEAR", pa.int32()),
+    ("PER_DATE_MONTH", pa.int32()),
+    ("PER_ORG_TRUST", pa.string()),
+    ("PER_ORG_SITE", pa.string()),
+    ("PER_ORG_NCL", pa.bool_()),
+    ("PER_METRIC", pa.string()),
+    ("PER_VALUE", pa.int64()),
+    ("PER_NUMERATOR", pa.float64()),
+    ("PER_DENOMINATOR", pa.float64()),
+    ("PATHWAY", pa.string()),
+    ("D31_BREAKDOWN", pa.string()),
+    ("D62_ACC_DIAGNOSTIC", pa.string()),
+    ("D62_ACC_TREATMENT", pa.string()),
+    ("D62_ALLOCATIONMETHOD", pa.string()),
+    ("D62_6S_SCENARIO", pa.int64())
+])
+
+SORT_COLUMNS = ["PER_ORG_TRUST", "PER_ORG_SITE", "RECORD_ID"]
+
+PARTITIONING = ds.partitioning(
+    pa.schema([PERFORMANCE_SCHEMA.field(c) for c in PARTITION_COLUMNS]),
+    flavor="hive")
+
+def _conform(table):
+    #Cast a table to the export schema, adding Null for missing columns
+    columns = []
+    for field in PERFORMANCE_SCHEMA:
+        if field.name in table.column_names:
+            columns.append(table.column(field.name).cast(field.type))
+        else:
+            columns.append(pa.nulls(table.num_rows, field.type))
+    return pa.Table.from_arrays(columns, schema=PERFORMANCE_SCHEMA)
+
+def write_performance_dataset(tables, destination, basename,
+                              max_rows_per_group=65536):
+    """
+    Write performance rows to the partitioned layout.
+    tables: Iterable of arrow tables (or pandas dataframes) of performance rows,
+        each should already be sorted by the partition and SORT_COLUMNS
+    destination: Root folder of the dataset
+    basename: Prefix for the file names so several tables can share partitions
+    max_rows_per_group: Rows per row group (Smaller groups skip more precisely)
+    Returns:
+        - rows: Number of rows written
+    """
+
+    rows = 0
+    def record_batches():
+        nonlocal rows
+        for table in tables:
+            if not isinstance(table, pa.Table):
+                table = pa.Table.from_pandas(table, preserve_index=False)
+            table = _conform(table)
+            rows += table.num_rows
+            yield from table.to_batches()
+
+    ds.write_dataset(
+        record_batches(),
+        destination,
+        schema=PERFORMANCE_SCHEMA,
+        format="parquet",
+        partitioning=PARTITIONING,
+        basename_template=basename + "-{i}.parquet",
+        existing_data_behavior="overwrite_or_ignore",
+        max_rows_per_group=max_rows_per_group,
+        min_rows_per_group=min(max_rows_per_group, 8192),
+        max_partitions=100000
+    )
+
+    return rows
+
+def _replace_folder(destination, write_func):
+    #Write to a temporary folder and swap it in so readers never see a
+    # partially written dataset
+    temporary = destination.rstrip("/\\") + ".tmp"
+    if os.path.exists(temporary):
+        shutil.rmtree(temporary)
+
+    result = write_func(temporary)
+
+    if os.path.exists(destination):
+        shutil.rmtree(destination)
+    os.replace(temporary, destination)
+
+    return result
+
+def export_performance(destination, tables=PERFORMANCE_TABLES,
+                       connection=False, connection_params={},
+                       query_tag=False):
+    """
+    Export the performance tables from Snowflake to the partitioned layout.
+    Each table is streamed in batches (See stream_data_from_query) and the
+    previous export is replaced once every table has been written.
+    destination: Root folder of the dataset
+    tables: Names of the performance tables to export
+    connection, connection_params, query_tag: As for pull_data_from_query
+    Returns:
+        - rows: Dictionary of table name to number of rows written
+    """
+
+    if connection == False:
+        connection = us.connection_get(connection_params, query_tag)
+
+    def write(folder):
+        rows = {}
+        for table in tables:
+            query = f"""
+                SELECT *
+                FROM {table}
+                ORDER BY {", ".join(PARTITION_COLUMNS + SORT_COLUMNS)}
+                """
+            rows[table] = write_performance_dataset(
+                us.stream_data_from_query(
+                    query, connection=connection, as_arrow=True),
+                folder, table)
+        return rows
+
+    return _replace_folder(destination, write)
+
+def write_local_performance(frames, destination):
+    """
+    Write local performance outputs (util_local) to the partitioned layout.
+    frames: Dictionary of table name to pandas dataframe (i.e. the output of
+        util_local.performance_62day for CWT_PERFORMANCE_62DAY)
+    destination: Root folder of the dataset
+    Returns:
+        - rows: Dictionary of table name to number of rows written
+    """
+
+    def write(folder):
+        return {
+            table: write_performance_dataset(
+                [df.sort_values(PARTITION_COLUMNS + SORT_COLUMNS)],
+                folder, table)
+            for table, df in frames.items()
+        }
+
+    return _replace_folder(destination, write)
+
+def performance_filter(filters):
+    """
+    Build a dataset filter expression.
+    filters: List of (column, op, value) tuples that must all be true, with op
+        one of ==, !=, <, <=, >, >= or in (i.e. [("PER_METRIC", "==", "62 Day")])
+    Returns:
+        - expression: pyarrow.dataset expression (None if there are no filters)
+    """
+
+    expression = None
+    for column, op, value in filters or []:
+        field = ds.field(column)
+        if op == "in":
+            condition = field.isin(value)
+        else:
+            condition = {
+                "==": field == value,
+                "=": field == value,
+                "!=": field != value,
+                "<": field < value,
+                "<=": field <= value,
+                ">": field > value,
+                ">=": field >= value
+            }[op]
+        expression = condition if expression is None else expression & condition
+
+    return expression
+
+def performance_dataset(path):
+    """
+    Open the partitioned layout as a pyarrow dataset (Nothing is read yet).
+    """
+
+    return ds.dataset(
+        path, schema=PERFORMANCE_SCHEMA, format="parquet",
+        partitioning=PARTITIONING)
+
+def read_performance(path, filters=None, columns=None):
+    """
+    Read performance rows from the partitioned layout.
+    Partition folders that cannot match the filters are never opened and
+    row groups are skipped using their min/max statistics.
+    path: Root folder of the dataset
+    filters: (Optional) List of (column, op, value) tuples (See performance_filter)
+    columns: (Optional) List of columns to read, reads all columns by default
+    Returns:
+        - df: Pandas dataframe of the matching rows
+    """
+
+    #Nullable integers (As in the util_local outputs) so Null values stay Null
+    return performance_dataset(path).to_table(
+        columns=columns, filter=performance_filter(filters)).to_pandas(
+            types_mapper={pa.int64(): pd.Int64Dtype()}.get)
+
+def performance_scan_plan(path, filters=None):
+    """
+    Count the files and row groups a read would open, to check the filters
+    are pushed down.
+    path: Root folder of the dataset
+    filters: (Optional) List of (column, op, value) tuples (See performance_filter)
+    Returns:
+        - plan: Dictionary of total and matching files and row groups
+    """
+
+    dataset = performance_dataset(path)
+    expression = performance_filter(filters)
+
+    fragments = list(dataset.get_fragments())
+    matching = list(dataset.get_fragments(filter=expression)) \
+        if expression is not None else fragments
+
+    return {
+        "files": len(fragments),
+        "files_read": len(matching),
+        "row_groups": sum(f.num_row_groups for f in fragments),
+        "row_groups_read": sum(
+            len(f.split_by_row_group(filter=expression, schema=dataset.schema))
+            if expression is not None else f.num_row_groups
+            for f in matching)
+    }
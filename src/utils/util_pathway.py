@@ -0,0 +1,59 @@
+from snowflake.snowpark.functions import col, is_null, not_, when
+
+#Standard pathway of each CWT_BASE row
+#CWT_PATHWAY and every metric builder classify rows with pathway_column so
+# each performance row carries the PATHWAY of the base row it came from.
+#CWT_PERFORMANCE then drops Unknown pathways with a filter instead of a join
+# to CWT_PATHWAY on RECORD_ID (Not unique in the base, so the join repeats
+# performance rows for resubmitted records)
+#util_local.base_pathway is the local version
+
+PATHWAY_USC = "USC"
+PATHWAY_BREASTSYMP = "Breast Symptomatic"
+PATHWAY_SCREENING = "Screening"
+PATHWAY_UPGRADE = "Upgrade"
+PATHWAY_UNKNOWN = "Unknown"
+
+#Snowpark expressions##########################################################
+
+def upgrade_column():
+    """
+    Column expression for the Upgrade pathway (Also used by the 62 Day value).
+    """
+
+    return (
+        (col("PATHWAY_SOURCEOFREFERRALFOROUTPATIENT_CODE") != 17) &
+        not_(is_null(col("DATE_CONSULTANTUPGRADEDATE")))
+    )
+
+def pathway_column():
+    """
+    Column expression for the PATHWAY of each base row.
+    """
+
+    pathway_usc = (
+        (col("PATHWAY_PRIORITYTYPE_CODE") == 3) &
+        (col("CWT_CANCERREFERALTYPE_CODE") != 16) &
+        (col("PATHWAY_SOURCEOFREFERRALFOROUTPATIENT_CODE") != 17) &
+        is_null(col("DATE_CONSULTANTUPGRADEDATE"))
+    )
+
+    pathway_breastsymp = (
+        (col("PATHWAY_PRIORITYTYPE_CODE") == 3) &
+        (col("CWT_CANCERREFERALTYPE_CODE") == 16) &
+        (col("PATHWAY_SOURCEOFREFERRALFOROUTPATIENT_CODE") != 17) &
+        is_null(col("DATE_CONSULTANTUPGRADEDATE"))
+    )
+
+    pathway_screening = (
+        (col("PATHWAY_PRIORITYTYPE_CODE") == 2) &
+        (col("PATHWAY_SOURCEOFREFERRALFOROUTPATIENT_CODE") == 17)
+    )
+
+    return (
+        when(pathway_usc, PATHWAY_USC)
+        .when(pathway_breastsymp, PATHWAY_BREASTSYMP)
+        .when(pathway_screening, PATHWAY_SCREENING)
+        .when(upgrade_column(), PATHWAY_UPGRADE)
+        .otherwise(PATHWAY_UNKNOWN)
+    )
@@ -0,0 +1,179 @@
+import time
+
+#Returned by a node's submit to mark it done without building it (i.e. a
+# table with no local version in an offline run), so it has no timing
+NOT_BUILT = "NOT_BUILT"
+
+def pipeline_order(nodes):
+    """
+    Get the nodes of a pipeline in dependency order.
+    nodes: Dictionary of node name to a dictionary containing:
+        - depends_on: List of node names that must be built first
+    Returns:
+        - order: List of node names where each node is after its dependencies
+    """
+
+    order = []
+    visiting = set()
+
+    def visit(name, path):
+        if name in order:
+            return
+        if name not in nodes:
+            raise Exception(f"{path[-1]} depends on unknown node {name}.")
+        if name in visiting:
+            raise Exception(f"Pipeline has a cycle: {' -> '.join(path + [name])}")
+
+        visiting.add(name)
+        for dependency in nodes[name]["depends_on"]:
+            visit(dependency, path + [name])
+        visiting.remove(name)
+
+        order.append(name)
+
+    for name in nodes:
+        visit(name, [])
+
+    return order
+
+def critical_path(nodes, timings):
+    """
+    Find the chain of dependent nodes with the longest total build time.
+    nodes: Dictionary of pipeline nodes (see pipeline_order)
+    timings: Dictionary of node name to (start, end) times in seconds
+    Returns:
+        - path: List of node names on the critical path
+        - duration: Total build time of the nodes on the path in seconds
+    """
+
+    finish = {}
+    previous = {}
+
+    for name in pipeline_order(nodes):
+        if name not in timings:
+            continue
+
+        start, end = timings[name]
+        built = [dep for dep in nodes[name]["depends_on"] if dep in finish]
+        slowest = max(built, key=lambda dep: finish[dep], default=None)
+
+        previous[name] = slowest
+        finish[name] = (end - start) + (finish[slowest] if slowest else 0)
+
+    if not finish:
+        return [], 0
+
+    name = max(finish, key=lambda node: finish[node])
+    duration = finish[name]
+
+    path = []
+    while name:
+        path.insert(0, name)
+        name = previous[name]
+
+    return path, duration
+
+def run_pipeline(nodes, skip=[], poll_interval=1):
+    """
+    Build a pipeline of dependent nodes, submitting each node as soon as all
+    of its dependencies have finished so independent nodes run concurrently.
+    nodes: Dictionary of node name to a dictionary containing:
+        - depends_on: List of node names that must be built first
+        - submit: Function with no arguments that starts the build.
+            Returns an AsyncJob (or None if the build already finished, or
+            NOT_BUILT if the node was not built)
+    skip: List of node names to treat as already built
+    poll_interval: Seconds to wait between checking running jobs
+    Returns:
+        - timings: Dictionary of node name to (start, end) times in seconds
+            from the start of the pipeline
+    """
+
+    order = pipeline_order(nodes)
+
+    pending = [name for name in order if name not in skip]
+    finished = set(skip)
+    running = {}
+    timings = {}
+    failed = None
+
+    time_start = time.perf_counter()
+
+    while pending or running:
+        #Submit every node with all dependencies built
+        if failed is None:
+            for name in list(pending):
+                if all(dep in finished for dep in nodes[name]["depends_on"]):
+                    pending.remove(name)
+                    print(f"Submitting {name}")
+                    start = time.perf_counter() - time_start
+                    try:
+                        job = nodes[name]["submit"]()
+                    except Exception as e:
+                        #i.e. a failed check before the build (See
+                        # util_snowflake.check_join_keys)
+                        print(f"{name} failed to submit: {e}")
+                        failed = failed or e
+                        break
+                    running[name] = (job, start)
+
+        #Check for finished jobs
+        for name, (job, start) in list(running.items()):
+            if job is NOT_BUILT:
+                del running[name]
+                finished.add(name)
+                print(f"Not built {name}")
+                continue
+
+            if job is not None and not job.is_done():
+                continue
+
+            del running[name]
+            end = time.perf_counter() - time_start
+
+            try:
+                if job is not None:
+                    #Raises the error if the job failed
+                    job.result()
+            except Exception as e:
+                print(f"{name} failed after {end - start:.1f}s: {e}")
+                failed = failed or e
+                continue
+
+            timings[name] = (start, end)
+            finished.add(name)
+            print(f"Built {name} in {end - start:.1f}s")
+
+        #Stop submitting if a node failed and wait for running jobs to end
+        if failed is not None:
+            pending = []
+
+        if running:
+            time.sleep(poll_interval)
+
+    if failed is not None:
+        raise failed
+
+    return timings
+
+def pipeline_report(nodes, timings):
+    """
+    Print the wall-clock time for each node and the critical path.
+    nodes: Dictionary of pipeline nodes (see run_pipeline)
+    timings: Dictionary of node name to (start, end) times from run_pipeline
+    """
+
+    print("Node timings (seconds from pipeline start):")
+    for name in pipeline_order(nodes):
+        if name in timings:
+            start, end = timings[name]
+            print(f"  {name:<40} {start:>8.1f} -> {end:>8.1f}  ({end - start:.1f}s)")
+        else:
+            #Skipped, failed or NOT_BUILT
+            print(f"  {name:<40} {'not built':>22}")
+
+    wall_clock = max((end for _, end in timings.values()), default=0)
+    path, duration = critical_path(nodes, timings)
+
+    print(f"Total wall-clock: {wall_clock:.1f}s")
+    print(f"Critical path: {' -> '.join(path)} ({duration:.1f}s)")
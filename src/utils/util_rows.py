@@ -0,0 +1,75 @@
+from snowflake.snowpark.functions import col, iff, lit, month, year
+from snowflake.snowpark.functions import array_construct_compact, object_construct_keep_null
+from snowflake.snowpark.types import BooleanType, DoubleType, LongType, StringType
+
+#Helpers to emit several output rows per base record from a single scan
+#Each output row is built as an object (or Null if the row should not exist)
+# and the objects for a record are collected in an array that is flattened
+
+#Columns in the CWT_PERFORMANCE table (excluding RECORD_ID) and their types
+per_types = {
+    "PER_DATE_YEAR": LongType(),
+    "PER_DATE_MONTH": LongType(),
+    "PER_ORG_TRUST": StringType(),
+    "PER_ORG_SITE": StringType(),
+    "PER_ORG_NCL": BooleanType(),
+    "PER_METRIC": StringType(),
+    "PER_VALUE": LongType(),
+    "PER_NUMERATOR": DoubleType(),
+    "PER_DENOMINATOR": DoubleType()
+}
+
+def performance_row(condition, date_col, trust, site, ncl, metric, value,
+                    numerator, denominator):
+    """
+    Function to build one CWT_PERFORMANCE row for a record as an object.
+    condition: Column expression for when the row should exist (Null otherwise)
+    date_col: Column expression for the date used for PER_DATE_YEAR/MONTH
+    trust, site, ncl: Column expressions for the PER_ORG_* fields
+    metric: Name of the metric
+    value, numerator, denominator: Column expressions for the PER_* values
+    Returns:
+        - row: Column expression containing the row object or Null
+    """
+
+    fields = {
+        "PER_DATE_YEAR": year(date_col),
+        "PER_DATE_MONTH": month(date_col),
+        "PER_ORG_TRUST": trust,
+        "PER_ORG_SITE": site,
+        "PER_ORG_NCL": ncl,
+        "PER_METRIC": lit(metric),
+        "PER_VALUE": value,
+        "PER_NUMERATOR": numerator,
+        "PER_DENOMINATOR": denominator
+    }
+
+    key_values = []
+    for key, field in fields.items():
+        key_values += [lit(key), field]
+
+    return iff(condition, object_construct_keep_null(*key_values), lit(None))
+
+def explode_rows(df, rows, keep_cols=["RECORD_ID"], row_types=per_types):
+    """
+    Function to explode the row objects for each record into the long format.
+    df: Snowpark dataframe with one row per record
+    rows: List of row object column expressions (see performance_row)
+    keep_cols: Record level columns to keep on every output row
+    row_types: Dictionary of the fields in the row objects and their types
+    Returns:
+        - df: Snowpark dataframe with one row per (non Null) row object
+    """
+
+    df = df.select(
+        [col(c) for c in keep_cols] +
+        [array_construct_compact(*rows).alias("PER_ROWS")]
+    )
+
+    df = df.join_table_function("flatten", input=col("PER_ROWS"))
+
+    return df.select(
+        [col(c) for c in keep_cols] +
+        [col("VALUE")[field].cast(field_type).alias(field)
+         for field, field_type in row_types.items()]
+    )
@@ -0,0 +1,171 @@
+import numpy as np
+
+import utils.util_local as ul
+import utils.util_snowflake as us
+
+#Mergeable quantile sketches of PER_VALUE (docs/dynamic_cwt_value_sketch.sql)
+#Values are counted in log buckets that grow by a factor of
+# (1 + alpha) / (1 - alpha), so the middle of a bucket is within alpha
+# (relative) of every value in it. A quantile read from the bucket counts is
+# then within alpha of the exact quantile, however many rows were counted.
+#Sketches are rows of (Group, SKETCH_BUCKET, SKETCH_COUNT) so merging is a sum
+# of the counts, which rolls sites up to trusts or months up to quarters
+# without the record level rows. The same buckets are computed in Snowflake
+# so a sketch pulled from CWT_VALUE_SKETCH works with the functions here
+
+SKETCH_QUERY = """
+SELECT *
+FROM DEV__MODELLING.CANCER__CWT_PATHWAY.CWT_VALUE_SKETCH
+"""
+
+#Relative error of the quantiles (Must match the bucket size in the SQL)
+SKETCH_ALPHA = 0.01
+
+#Grouping columns of the sketch table (As for the histogram, without the value)
+SKETCH_KEYS = [key for key in ul.HISTOGRAM_KEYS if key != "PER_VALUE"]
+
+SKETCH_COLUMNS = SKETCH_KEYS + ["SKETCH_BUCKET", "SKETCH_COUNT"]
+
+def _gamma(alpha):
+    return (1 + alpha) / (1 - alpha)
+
+def sketch_bucket(values, alpha=SKETCH_ALPHA):
+    """
+    Get the sketch bucket of each value.
+    Buckets are 0 for 0 and +/-(ceil(log_gamma(|value|)) + 1) otherwise,
+    so the bucket order is the value order.
+    values: NumPy array of values (No NaN)
+    Returns:
+        - bucket: NumPy int64 array
+    """
+
+    values = np.asarray(values, dtype="float64")
+    magnitude = np.abs(values)
+
+    #(Zero is given a magnitude of 1 only to avoid log(0), it is bucket 0)
+    bucket = np.ceil(np.log(np.where(magnitude == 0, 1, magnitude)) /
+                     np.log(_gamma(alpha))) + 1
+
+    return np.where(magnitude == 0, 0, np.sign(values) * bucket).astype("int64")
+
+def bucket_value(bucket, alpha=SKETCH_ALPHA):
+    """
+    Get the value a bucket stands for (Within alpha of every value in it).
+    bucket: NumPy array of buckets from sketch_bucket
+    Returns:
+        - value: NumPy float64 array
+    """
+
+    bucket = np.asarray(bucket, dtype="int64")
+    gamma = _gamma(alpha)
+    magnitude = 2 * gamma ** (np.abs(bucket) - 1) / (gamma + 1)
+
+    return np.where(bucket == 0, 0.0, np.sign(bucket) * magnitude)
+
+def value_sketch(df_performance, alpha=SKETCH_ALPHA):
+    """
+    Local version of CWT_VALUE_SKETCH (docs/dynamic_cwt_value_sketch.sql).
+    df_performance: Dataframe shaped like CWT_PERFORMANCE (or any of the
+        performance tables)
+    alpha: Relative error of the quantiles
+    Returns:
+        - df: Dataframe with the count in each bucket by month, organisation
+            and metric
+    """
+
+    df = df_performance[df_performance["PER_VALUE"].notna()]
+
+    return df[SKETCH_KEYS].assign(
+        SKETCH_BUCKET=sketch_bucket(
+            df["PER_VALUE"].to_numpy(dtype="float64"), alpha)
+    ).groupby(
+        SKETCH_KEYS + ["SKETCH_BUCKET"], dropna=False, sort=False
+    ).size().rename("SKETCH_COUNT").reset_index()[SKETCH_COLUMNS]
+
+def sketch_load(connection=False, connection_params={}, query=SKETCH_QUERY,
+                query_tag=False):
+    """
+    Load CWT_VALUE_SKETCH from Snowflake.
+    connection, connection_params, query_tag: As for pull_data_from_query
+    query: Query to load the sketch with
+    Returns:
+        - df: Pandas dataframe of sketch rows
+    """
+
+    return us.pull_data_from_query(
+        query, connection=connection, connection_params=connection_params,
+        query_tag=query_tag)
+
+def _with_quarter(df_sketch, group_by):
+    #Add PER_DATE_QUARTER if it is grouped on (Not a column of the sketch)
+    if "PER_DATE_QUARTER" in group_by and \
+            "PER_DATE_QUARTER" not in df_sketch.columns:
+        return df_sketch.assign(
+            PER_DATE_QUARTER=(df_sketch["PER_DATE_MONTH"] - 1) // 3 + 1)
+    return df_sketch
+
+def sketch_merge(df_sketch, group_by):
+    """
+    Merge sketches to coarser groups (i.e. sites to trusts, months to quarters).
+    df_sketch: Output of value_sketch or sketch_load (or of this function)
+    group_by: Columns to keep, from SKETCH_KEYS and PER_DATE_QUARTER
+    Returns:
+        - df: Sketch rows for each group_by group
+    """
+
+    group_by = list(group_by)
+    df = _with_quarter(df_sketch, group_by)
+
+    return df.groupby(
+        group_by + ["SKETCH_BUCKET"], dropna=False, sort=False
+    )["SKETCH_COUNT"].sum().reset_index()
+
+def sketch_quantiles(df_sketch, quantiles=[0.5, 0.9], group_by=[],
+                     alpha=SKETCH_ALPHA):
+    """
+    Estimate quantiles of PER_VALUE from sketches.
+    Each estimate is within alpha (relative) of the exact lower quantile,
+    the value at rank floor(q * (n - 1)) (numpy.quantile method="lower").
+    df_sketch: Output of value_sketch, sketch_load or sketch_merge
+    quantiles: Quantiles to estimate (i.e. 0.5 for the median)
+    group_by: Columns to estimate for, from SKETCH_KEYS and PER_DATE_QUARTER
+        (All rows are one group by default)
+    alpha: Relative error the sketch was built with
+    Returns:
+        - df: Dataframe with the group_by columns, SKETCH_COUNT and for each
+            quantile (i.e. P90) the estimate and the bounds the exact value
+            is within (P90_LOWER, P90_UPPER)
+    """
+
+    group_by = list(group_by)
+    df = sketch_merge(df_sketch, group_by)
+
+    #Sort by group then bucket so a running count finds each rank
+    df["SKETCH_GROUP"] = df.groupby(
+        group_by, dropna=False, sort=True).ngroup() if group_by else 0
+    df = df.sort_values(["SKETCH_GROUP", "SKETCH_BUCKET"], kind="stable")
+
+    groups = df["SKETCH_GROUP"].to_numpy()
+    counts = df["SKETCH_COUNT"].to_numpy(dtype="int64")
+    cumulative = np.cumsum(counts)
+    starts = np.flatnonzero(np.r_[True, groups[1:] != groups[:-1]])
+    totals = np.add.reduceat(counts, starts)
+    before = cumulative[starts] - counts[starts]
+
+    df_out = df.iloc[starts][group_by].reset_index(drop=True)
+    df_out["SKETCH_COUNT"] = totals
+
+    buckets = df["SKETCH_BUCKET"].to_numpy()
+    for q in quantiles:
+        rank = np.floor(q * (totals - 1)).astype("int64")
+        rows = np.searchsorted(cumulative, before + rank, side="right")
+        estimate = bucket_value(buckets[rows], alpha)
+
+        name = f"P{q * 100:g}"
+        df_out[name] = estimate
+        df_out[name + "_LOWER"] = np.minimum(
+            estimate / (1 + alpha), estimate / (1 - alpha))
+        df_out[name + "_UPPER"] = np.maximum(
+            estimate / (1 + alpha), estimate / (1 - alpha))
+
+    return df_out
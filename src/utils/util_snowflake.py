@@ -1,9 +1,29 @@
+import asyncio
+import atexit
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from itertools import chain
+
 import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
 
 from snowflake.snowpark.session import Session
+from snowflake.snowpark.functions import (
+    col, count, max as max_)
 from snowflake import connector as sfc
+from snowflake.connector.constants import FIELD_ID_TO_NAME
 from snowflake.ml.feature_store import FeatureStore, CreationMode
 
+import utils.util_columns as ucol
+
 def snowpark_session_create(connection_params, query_tag=False):
     """
     Create a Snowpark session using the provided configuration.
@@ -45,19 +65,177 @@ def snowflake_connection_create(connection_params, query_tag=False):
     if query_tag:
         session_parameters["QUERY_TAG"] = query_tag
 
+    #Unset parameters (i.e. a missing .env value) are left to the defaults
     ctx = sfc.connect(
-    account="ATKJNCU-NCL",
-    user= "JAKE.KEALEY@NHS.NET",
-    authenticator= "externalbrowser",
-    role= "NCL-USERGROUP-STAFF-SNOWFLAKE-BI-ANALYST",
-    warehouse= "NCL_ANALYTICS_XS",
-    database= "DATA_LAB_NCL_TRAINING_TEMP",
-    schema= "CANCER_CWT",
-    session_parameters = session_parameters
+        **{**CONNECTION_DEFAULTS, **{
+            key: value for key, value in connection_params.items()
+            if value is not None}},
+        session_parameters=session_parameters
     )
 
     return ctx
 
+#Connection pool###############################################################
+#Connections and Snowpark sessions are shared by every caller in the process
+# that passes the same connection_params, so the login (i.e. the
+# externalbrowser prompt) happens once. Sessions are built on the pooled
+# connection so both use the same login. A connection is checked with a
+# SELECT 1 if it has not been used for health_ttl seconds and replaced if
+# it has closed or the check fails
+#The query tag is a setting of the shared connection, so the last tag set is
+# kept and only changed (or unset for untagged callers) when it differs
+
+#Connector settings used unless they are in connection_params: keep the
+# login alive while idle and cache the SSO/MFA token so new processes do not
+# need to log in again
+CONNECTION_DEFAULTS = {
+    "client_session_keep_alive": True,
+    "client_store_temporary_credential": True,
+    "client_request_mfa_token": True
+}
+
+POOL_HEALTH_TTL = 300
+
+_pool = {
+    "connections": {},
+    "sessions": {},
+    "used_at": {},
+    "query_tags": {},
+    "lock": threading.RLock()
+}
+
+def _pool_key(connection_params):
+    return json.dumps(connection_params, sort_keys=True, default=str)
+
+def _connection_is_healthy(connection, key, health_ttl):
+    if connection.is_closed():
+        return False
+    if time.time() - _pool["used_at"].get(key, 0) < health_ttl:
+        return True
+    try:
+        connection.cursor().execute("SELECT 1").fetchone()
+    except Exception:
+        return False
+    return True
+
+def _query_tag_set(connection, query_tag):
+    #The tag is a session setting so is changed on the shared connection
+    if query_tag:
+        connection.cursor().execute(
+            "ALTER SESSION SET QUERY_TAG = %(tag)s", {"tag": query_tag})
+    else:
+        connection.cursor().execute("ALTER SESSION UNSET QUERY_TAG")
+
+def _query_tag_apply(key, connection, query_tag):
+    #Change the tag of a pooled connection only if it differs from the last
+    # tag set (Called with the pool lock held)
+    #A Snowpark session on the connection knows its own tag, including one
+    # set directly with session.query_tag, so it is used when there is one
+    query_tag = query_tag or None
+    session = _pool["sessions"].get(key)
+    if session is not None:
+        if session.query_tag != query_tag:
+            session.query_tag = query_tag
+    elif _pool["query_tags"].get(key) != query_tag:
+        _query_tag_set(connection, query_tag)
+    _pool["query_tags"][key] = query_tag
+
+def _pooled_connection(connection_params, key, health_ttl):
+    #Pooled connection for the key (Called with the pool lock held)
+    connection = _pool["connections"].get(key)
+
+    if connection is None or \
+            not _connection_is_healthy(connection, key, health_ttl):
+        if connection is not None:
+            _close_quietly(connection)
+            #The session and tag were on the old connection
+            _pool["sessions"].pop(key, None)
+            _pool["query_tags"].pop(key, None)
+        connection = snowflake_connection_create(connection_params)
+        _pool["connections"][key] = connection
+
+    _pool["used_at"][key] = time.time()
+
+    return connection
+
+def connection_get(connection_params, query_tag=False,
+                   health_ttl=POOL_HEALTH_TTL):
+    """
+    Get the pooled Snowflake connection for a set of connection parameters,
+    creating it on first use or if it is no longer healthy.
+    connection_params: As for snowflake_connection_create
+    query_tag: (Optional) Tag for the statements that follow (The connection
+        is shared so this applies to other callers until it is changed, and
+        is unset for a call without a tag)
+    health_ttl: Seconds a connection can be idle before it is checked
+    Returns:
+        - connection: Snowflake connection object (Do not close it, see
+            pool_close)
+    """
+
+    key = _pool_key(connection_params)
+
+    with _pool["lock"]:
+        connection = _pooled_connection(connection_params, key, health_ttl)
+        _query_tag_apply(key, connection, query_tag)
+
+    return connection
+
+def session_get(connection_params, query_tag=False,
+                health_ttl=POOL_HEALTH_TTL):
+    """
+    Get the pooled Snowpark session for a set of connection parameters.
+    The session uses the pooled connection (See connection_get).
+    connection_params: As for snowpark_session_create
+    query_tag: (Optional) Tag for the statements that follow
+    health_ttl: Seconds a connection can be idle before it is checked
+    Returns:
+        - session: Snowpark session object (Do not close it, see pool_close)
+    """
+
+    key = _pool_key(connection_params)
+
+    with _pool["lock"]:
+        connection = _pooled_connection(connection_params, key, health_ttl)
+
+        session = _pool["sessions"].get(key)
+        if session is None:
+            session = Session.builder.configs({"connection": connection}).create()
+            _pool["sessions"][key] = session
+            #Start the session from the tag already on the connection
+            if _pool["query_tags"].get(key):
+                session.query_tag = _pool["query_tags"][key]
+
+        _query_tag_apply(key, connection, query_tag)
+
+    return session
+
+def _close_quietly(connection):
+    try:
+        connection.close()
+    except Exception:
+        pass
+
+def pool_close():
+    """
+    Close every pooled session and connection (Run when the process exits).
+    """
+
+    with _pool["lock"]:
+        for session in _pool["sessions"].values():
+            try:
+                session.close()
+            except Exception:
+                pass
+        for connection in _pool["connections"].values():
+            _close_quietly(connection)
+        _pool["sessions"].clear()
+        _pool["connections"].clear()
+        _pool["used_at"].clear()
+        _pool["query_tags"].clear()
+
+atexit.register(pool_close)
+
 def pull_data_from_query(query, 
                          connection=False, connection_params={},
                          query_tag=False):
@@ -67,6 +245,7 @@ def pull_data_from_query(query,
     
     EITHER PASS CONNECTION_PARAMS OR A SNOWFLAKE CONNECTION OBJECT. 
     IF BOTH ARE PASSED THIS WILL USE THE CONNECTION BY DEFAULT.
+    (Connection_params use the pooled connection, see connection_get)
     connection: Connection object from snowflake.connector.connect()
     connection_params: Dictionary containing connection parameters:
         - account: Snowflake account name
@@ -85,7 +264,7 @@ def pull_data_from_query(query,
 
     #Use passed connection method
     if connection == False:
-        ctx = snowflake_connection_create(connection_params, query_tag)
+        ctx = connection_get(connection_params, query_tag)
     else:
         ctx = connection
 
@@ -97,6 +276,268 @@ def pull_data_from_query(query,
     return cur.fetch_pandas_all()
 
 
+def stream_data_from_query(query,
+                           connection=False, connection_params={},
+                           query_tag=False, as_arrow=False):
+    """
+    Runs a SELECT query and yields the result in batches instead of loading
+    the full result into memory (see pull_data_from_query).
+    query: String containing the SELECT query
+    connection, connection_params, query_tag: As for pull_data_from_query
+    as_arrow: If True, yield pyarrow tables instead of pandas dataframes
+    Returns:
+        - batches: Iterator of pandas dataframes (or pyarrow tables)
+    """
+
+    #Use passed connection method
+    if connection == False:
+        ctx = connection_get(connection_params, query_tag)
+    else:
+        ctx = connection
+
+    #Execute the query
+    cur = ctx.cursor()
+    cur.execute(query)
+
+    #Yield each result batch as it is downloaded
+    if as_arrow:
+        yield from cur.fetch_arrow_batches()
+    else:
+        yield from cur.fetch_pandas_batches()
+
+#Arrow types of the result columns whose batch type depends on the values in
+# the batch (Integers are narrowed per batch and a batch of Nulls has no type)
+ARROW_RESULT_TYPES = {
+    "TEXT": pa.string(),
+    "REAL": pa.float64(),
+    "DATE": pa.date32(),
+    "BOOLEAN": pa.bool_()
+}
+
+def _result_schema(cursor, first):
+    #Arrow schema for every batch of a result from the cursor metadata, so
+    # the first batch does not fix a type later batches cannot be cast to
+    #Cursors without metadata (i.e. util_stub.LocalCursor) widen the first
+    # batch's integers
+    description = getattr(cursor, "description", None)
+
+    fields = []
+    for i, field in enumerate(first.schema):
+        arrow_type = field.type
+        if description:
+            metadata = description[i]
+            type_name = FIELD_ID_TO_NAME.get(metadata.type_code)
+            if type_name == "FIXED" and not metadata.scale:
+                arrow_type = pa.int64()
+            else:
+                arrow_type = ARROW_RESULT_TYPES.get(type_name, field.type)
+        elif pa.types.is_integer(field.type):
+            arrow_type = pa.int64()
+        fields.append(pa.field(field.name, arrow_type))
+
+    return pa.schema(fields)
+
+def write_query_to_parquet(query, destination, partition_cols=None,
+                           connection=False, connection_params={},
+                           query_tag=False):
+    """
+    Runs a SELECT query and writes the result to parquet one batch at a time,
+    so peak memory is bounded by the batch size rather than the result size.
+    Any previous output at the destination is replaced once the result has
+    been written (or removed if the result is empty).
+    query: String containing the SELECT query
+    destination: Path of the parquet file, or folder if partition_cols is set
+    partition_cols: (Optional) List of columns to partition the output by
+        (Written as a hive style folder structure, i.e. PER_DATE_YEAR=2025/)
+    connection, connection_params, query_tag: As for pull_data_from_query
+    Returns:
+        - rows: Number of rows written
+    """
+
+    #Use passed connection method
+    if connection == False:
+        ctx = connection_get(connection_params, query_tag)
+    else:
+        ctx = connection
+
+    cur = ctx.cursor()
+    cur.execute(query)
+    batches = cur.fetch_arrow_batches()
+
+    #An empty result has no batch to type the output with, so the previous
+    # output is removed instead of being left in place
+    first = next(batches, None)
+    if first is None:
+        if os.path.isdir(destination):
+            shutil.rmtree(destination)
+        elif os.path.exists(destination):
+            os.remove(destination)
+        return 0
+    schema = _result_schema(cur, first)
+
+    rows = 0
+    def record_batches():
+        nonlocal rows
+        for table in chain([first], batches):
+            for batch in table.cast(schema).to_batches():
+                rows += batch.num_rows
+                yield batch
+
+    #Write to a temporary file/folder and swap it in, so an earlier run's
+    # part files in partitions this run does not write are not kept and
+    # readers never see a partial result
+    temporary = destination.rstrip("/\\") + ".tmp"
+    if os.path.isdir(temporary):
+        shutil.rmtree(temporary)
+
+    if partition_cols:
+        ds.write_dataset(
+            record_batches(),
+            temporary,
+            schema=schema,
+            format="parquet",
+            partitioning=partition_cols,
+            partitioning_flavor="hive"
+        )
+        if os.path.exists(destination):
+            shutil.rmtree(destination)
+    else:
+        with pq.ParquetWriter(temporary, schema) as writer:
+            for batch in record_batches():
+                writer.write_batch(batch)
+
+    os.replace(temporary, destination)
+
+    return rows
+
+def _cancel_queries(ctx, query_ids):
+    #Abort queries in the warehouse (Cancelling an asyncio task only stops
+    # waiting on its query)
+    for query_id in query_ids:
+        try:
+            ctx.cursor().execute(
+                "SELECT SYSTEM$CANCEL_QUERY(%s)", (query_id,))
+        except Exception:
+            pass
+
+def _submit_query(ctx, cur, query, running):
+    #Submit a query and record its ID until it finishes, unless the batch was
+    # stopped while it was being submitted
+    cur.execute_async(query)
+    with running["lock"]:
+        if not running["closed"]:
+            running["query_ids"].add(cur.sfqid)
+            return cur.sfqid
+    _cancel_queries(ctx, [cur.sfqid])
+    return cur.sfqid
+
+async def _run_query_async(ctx, name, query, semaphore, poll_interval,
+                           as_arrow, running):
+    #Submit one query, wait for it without blocking the event loop and fetch
+    # the result (The semaphore bounds the queries running at once)
+    async with semaphore:
+        cur = ctx.cursor()
+        query_id = await asyncio.to_thread(
+            _submit_query, ctx, cur, query, running)
+
+        #Raises if the query failed
+        status = await asyncio.to_thread(
+            ctx.get_query_status_throw_if_error, query_id)
+        while ctx.is_still_running(status):
+            await asyncio.sleep(poll_interval)
+            status = await asyncio.to_thread(
+                ctx.get_query_status_throw_if_error, query_id)
+
+        with running["lock"]:
+            running["query_ids"].discard(query_id)
+
+        cur = ctx.cursor()
+        await asyncio.to_thread(cur.get_results_from_sfqid, query_id)
+        if as_arrow:
+            result = await asyncio.to_thread(cur.fetch_arrow_all)
+        else:
+            result = await asyncio.to_thread(cur.fetch_pandas_all)
+
+        return name, result
+
+async def pull_data_async(queries,
+                          connection=False, connection_params={},
+                          query_tag=False, max_concurrent=8,
+                          poll_interval=0.5, as_arrow=False):
+    """
+    Runs several SELECT queries at once and yields each result as it completes.
+    Queries are submitted with execute_async and their status is polled, so
+    a batch takes about as long as its slowest query rather than the total.
+    queries: Dictionary of name to query (or a list, named by position)
+    connection, connection_params, query_tag: As for pull_data_from_query
+        (One connection is shared by every query)
+    max_concurrent: Most queries running in the warehouse at once
+    poll_interval: Seconds between status checks of a running query
+    as_arrow: If True, yield pyarrow tables instead of pandas dataframes
+    (Queries still running when a query fails or the caller stops iterating
+    are cancelled with SYSTEM$CANCEL_QUERY)
+    Returns:
+        - results: Async iterator of (name, dataframe) in completion order
+    """
+
+    if not isinstance(queries, dict):
+        queries = dict(enumerate(queries))
+
+    if connection == False:
+        ctx = connection_get(connection_params, query_tag)
+    else:
+        ctx = connection
+
+    #Queries submitted and not yet finished, aborted if the batch stops
+    running = {"query_ids": set(), "closed": False, "lock": threading.Lock()}
+
+    semaphore = asyncio.Semaphore(max_concurrent)
+    tasks = [
+        asyncio.ensure_future(_run_query_async(
+            ctx, name, query, semaphore, poll_interval, as_arrow, running))
+        for name, query in queries.items()
+    ]
+
+    try:
+        for task in asyncio.as_completed(tasks):
+            yield await task
+    finally:
+        #Stop waiting on the other queries if one fails or the caller stops,
+        # and abort the ones still running so they are not left billing
+        for task in tasks:
+            task.cancel()
+        with running["lock"]:
+            running["closed"] = True
+            query_ids = list(running["query_ids"])
+        _cancel_queries(ctx, query_ids)
+
+def pull_data_concurrent(queries,
+                         connection=False, connection_params={},
+                         query_tag=False, max_concurrent=8,
+                         poll_interval=0.5, as_arrow=False):
+    """
+    Blocking version of pull_data_async for scripts (Not for use inside a
+    running event loop, i.e. a notebook cell, use pull_data_async there).
+    Arguments are as for pull_data_async.
+    Returns:
+        - results: Dictionary of name to dataframe in the order of queries
+    """
+
+    async def collect():
+        return {
+            name: result async for name, result in pull_data_async(
+                queries, connection=connection,
+                connection_params=connection_params, query_tag=query_tag,
+                max_concurrent=max_concurrent, poll_interval=poll_interval,
+                as_arrow=as_arrow)
+        }
+
+    results = asyncio.run(collect())
+    names = queries.keys() if isinstance(queries, dict) \
+        else range(len(queries))
+
+    return {name: results[name] for name in names}
+
 def load_feature_store(session, database, name, warehouse="NCL_ANALYTICS_XS"):
     
     """
@@ -138,7 +579,211 @@ def load_entity(feature_store, entity_name):
 
     return entity
 
-def create_dynamic_features(transformation_func, params):
+#Run tracing###################################################################
+#Every statement in a traced stage is tagged with a JSON query tag holding the
+# run ID, table and stage so it can be found in QUERY_HISTORY, and each stage
+# is logged to a local JSON lines file with its client-side timings
+
+TRACE_LOG_PATH = "output/trace.jsonl"
+
+#Current run: (run ID, log path) - the run ID is created on first use
+_trace = {"run_id": None, "log_path": TRACE_LOG_PATH}
+
+def trace_start(run_id=None, log_path=TRACE_LOG_PATH):
+    """
+    Start a new traced run.
+    run_id: (Optional) ID for the run, a timestamped random ID by default
+    log_path: JSON lines file to append the trace to (None to not write a log)
+    Returns:
+        - run_id: ID of the run
+    """
+
+    if run_id is None:
+        run_id = datetime.now().strftime("%Y%m%d-%H%M%S-") + uuid.uuid4().hex[:8]
+
+    _trace["run_id"] = run_id
+    _trace["log_path"] = log_path
+
+    return run_id
+
+def trace_run_id():
+    """
+    Get the ID of the current run (Starts a run if there is not one).
+    """
+
+    if _trace["run_id"] is None:
+        trace_start(log_path=_trace["log_path"])
+
+    return _trace["run_id"]
+
+def trace_log(event, **fields):
+    """
+    Append a record to the trace log for the current run.
+    event: Type of record (i.e. "stage" or "query")
+    fields: Values to include in the record
+    Returns:
+        - record: Dictionary that was logged
+    """
+
+    record = {
+        "run_id": trace_run_id(),
+        "time": datetime.now(timezone.utc).isoformat(),
+        "event": event,
+        **fields
+    }
+
+    if _trace["log_path"]:
+        folder = os.path.dirname(_trace["log_path"])
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        with open(_trace["log_path"], "a") as f:
+            f.write(json.dumps(record, default=str) + "\n")
+
+    return record
+
+def trace_query_tag(table, stage, tag=None):
+    """
+    Get the query tag for statements in a stage of the current run.
+    table: Name of the table being built
+    stage: Name of the stage (i.e. "plan", "create")
+    tag: (Optional) Original query tag of the script
+    Returns:
+        - query_tag: JSON string with the tag, run ID, table and stage
+    """
+
+    return json.dumps({
+        "tag": tag,
+        "run_id": trace_run_id(),
+        "table": table,
+        "stage": stage
+    })
+
+def _untraced_tag(query_tag):
+    #Get the original tag from a trace tag so stages do not nest their tags
+    try:
+        return json.loads(query_tag)["tag"]
+    except (TypeError, ValueError, KeyError):
+        return query_tag
+
+@contextmanager
+def trace_stage(session, table, stage, **fields):
+    """
+    Context manager to tag, time and log a stage of building a table.
+    The statements run in the stage are tagged with trace_query_tag and their
+    query IDs are recorded. Values added to the yielded dictionary are
+    included in the log record.
+    session: Snowpark session object
+    table: Name of the table being built
+    stage: Name of the stage
+    fields: Values to include in the log record
+    Returns:
+        - record: Dictionary for the log record of the stage
+    """
+
+    previous_tag = session.query_tag
+    session.query_tag = trace_query_tag(
+        table, stage, _untraced_tag(previous_tag))
+
+    record = dict(fields)
+    status = "success"
+    history = None
+    time_start = time.perf_counter()
+
+    try:
+        with session.query_history(include_describe=True) as history:
+            yield record
+    except Exception as e:
+        status = "error"
+        record["error"] = repr(e)
+        raise e
+    finally:
+        record["seconds"] = time.perf_counter() - time_start
+        queries = history.queries if history is not None else []
+        record["query_ids"] = [
+            query.query_id for query in queries if not query.is_describe]
+        record["describe_queries"] = sum(
+            1 for query in queries if query.is_describe)
+        session.query_tag = previous_tag
+
+        trace_log("stage", table=table, stage=stage, status=status, **record)
+
+def _like_escape(value):
+    #Escape the LIKE wildcards in a value (For patterns with ESCAPE '\\')
+    for char in ["\\", "%", "_"]:
+        value = value.replace(char, "\\" + char)
+    return value
+
+def trace_query_history(session, query_ids=None, run_id=None):
+    """
+    Log the warehouse timings of the queries in a run.
+    The compilation, queueing and execution times come from the query
+    history of the session so this must use the session that ran the queries.
+    Each query should only be logged once, so either log the queries of the
+    stages that were just run (The query_ids in their trace records) or log
+    the whole run once at the end of it.
+    session: Snowpark session object
+    query_ids: (Optional) Queries to log, every query in the run by default
+    run_id: (Optional) Run to log, the current run by default
+    Returns:
+        - queries: List of dictionaries logged for each query
+    """
+
+    if query_ids is not None:
+        if len(query_ids) == 0:
+            return []
+        condition = f"QUERY_ID IN ({', '.join(['?'] * len(query_ids))})"
+        params = list(query_ids)
+    else:
+        #The run ID is bound and its wildcards escaped as it can be given on
+        # the command line
+        run_id = run_id or trace_run_id()
+        condition = "QUERY_TAG LIKE ? ESCAPE '\\\\'"
+        params = [f'%"run_id": {_like_escape(json.dumps(run_id))}%']
+
+    rows = session.sql(f"""
+        SELECT QUERY_ID, QUERY_TAG, EXECUTION_STATUS, TOTAL_ELAPSED_TIME,
+            COMPILATION_TIME, QUEUED_PROVISIONING_TIME, QUEUED_OVERLOAD_TIME,
+            QUEUED_REPAIR_TIME, EXECUTION_TIME, BYTES_SCANNED, ROWS_PRODUCED
+        FROM TABLE(INFORMATION_SCHEMA.QUERY_HISTORY_BY_SESSION(
+            RESULT_LIMIT => 10000))
+        WHERE {condition}
+        ORDER BY START_TIME
+        """, params=params).collect()
+
+    queries = []
+    for row in rows:
+        fields = row.as_dict()
+        tag = json.loads(fields.pop("QUERY_TAG"))
+        queries.append(trace_log(
+            "query", table=tag["table"], stage=tag["stage"],
+            **{key.lower(): value for key, value in fields.items()}))
+
+    return queries
+
+def trace_read(log_path=TRACE_LOG_PATH, run_id=None):
+    """
+    Read a trace log into a dataframe.
+    log_path: JSON lines file written by the trace functions
+    run_id: (Optional) Only return the records for this run
+    Returns:
+        - df: Pandas dataframe with a row per record
+    """
+
+    df = pd.read_json(log_path, lines=True)
+
+    if run_id is not None:
+        df = df[df["run_id"] == run_id]
+
+    return df
+
+def feature_session_create(params):
+    """
+    Create a Snowpark session from the params used by the feature scripts.
+    params: Dictionary containing the feature_dynamic_params for a script
+    Returns:
+        - session: Snowpark session object
+    """
+
     connection_params = {
         "account": params["account"],
         "user": params["user"],
@@ -149,18 +794,341 @@ def create_dynamic_features(transformation_func, params):
         "schema": params["session_schema"]
     }
 
-    session = snowpark_session_create(
-        connection_params, params["query_tag"])
-    
-    #Load the base data
-    df_base = session.table(params["base_table"])
+    #Scripts run in the same process share one session (See session_get)
+    return session_get(connection_params, params["query_tag"])
+
+#Latest submission index#######################################################
+#CWT_BASE keeps every submitted version (SK_CWT_ID) of a record (RECORD_ID)
+#The index holds the latest version of each record, so filtering to current
+# rows is a semi-join on SK_CWT_ID rather than a window over the whole base
+#The index is a dynamic table (docs/dynamic_cwt_latest.sql) refreshed with the
+# dynamic tables built from it, so their scheduled refreshes between pipeline
+# runs read an index of the same version of the base
+
+LATEST_INDEX_TABLE = "CWT_LATEST"
+
+def latest_filter(df, session, index_table=LATEST_INDEX_TABLE):
+    """
+    Filter base rows to the latest version of each record.
+    df: Snowpark dataframe of base rows
+    session: Snowpark session object
+    index_table: Name of the index table (See docs/dynamic_cwt_latest.sql)
+    Returns:
+        - df: Snowpark dataframe of the base rows in the index
+    """
+
+    return df.join(
+        session.table(index_table).select("SK_CWT_ID"),
+        on="SK_CWT_ID", how="leftsemi")
+
+def base_table_load(session, params, columns=None):
+    """
+    Load the base table for a feature script.
+    params: Dictionary containing the feature_dynamic_params for a script
+        - base_table: Name of the base table
+        (Optional)
+        - latest_only: If True, only use the latest version of each record
+        - latest_table: Name of the latest submission index table
+    columns: (Optional) List of columns to select (i.e. the column contract
+        from util_columns.base_columns), selects all columns by default
+    Returns:
+        - df: Snowpark dataframe of the base table
+    """
+
+    df = session.table(params["base_table"])
+
+    #Select the contract columns first so nothing else is scanned
+    if columns is not None:
+        df = df.select(columns)
+
+    if params.get("latest_only", False):
+        df = latest_filter(
+            df, session, params.get("latest_table", LATEST_INDEX_TABLE))
+
+    return df
+
+def check_join_keys(session, table, keys, examples=5):
+    """
+    Check a table has at most one row for each value of its join keys.
+    A LEFT JOIN to a table with duplicate keys repeats the rows on the other
+    side, which inflates every count built from them without an error.
+    Null keys are ignored as they never match in an equality join.
+    session: Snowpark session object
+    table: Name of the table on the right side of the join
+    keys: List of the columns the table is joined on
+    examples: Number of duplicate keys to include in the error
+    """
+
+    df = session.table(table)
+    for key in keys:
+        df = df.filter(col(key).is_not_null())
+
+    duplicates = df.group_by(keys).agg(count("*").alias("JOIN_ROWS")) \
+        .filter(col("JOIN_ROWS") > 1).limit(examples).collect()
+
+    if duplicates:
+        raise Exception(
+            f"{table} has more than one row for some values of "
+            f"({', '.join(keys)}), joining to it would repeat rows: "
+            f"{[tuple(row) for row in duplicates]}")
+
+def check_incremental(df):
+    """
+    Check a transformation can be refreshed incrementally by RECORD_ID.
+    Each output row must only depend on the base rows for the same record, so
+    window functions (which can look across records) are not allowed. The
+    plan must also be a single query, as the temporary objects created by
+    cache_result or create_dataframe (Extra queries and post actions) are not
+    rebuilt for each refresh.
+    df: Snowpark dataframe returned by a transformation function
+    """
+
+    queries = df.queries
+    if len(queries["queries"]) > 1 or len(queries["post_actions"]) > 0:
+        raise Exception(
+            "Transformation uses temporary objects (i.e. cache_result) and "
+            "cannot be refreshed incrementally by submission.")
+
+    for query in queries["queries"]:
+        if " OVER (" in query.upper():
+            raise Exception(
+                "Transformation uses a window function and cannot be "
+                "refreshed incrementally by submission.")
+
+def _watermark_table_create(session, watermark_table):
+    #Table to record the latest submission processed for each destination
+    session.sql(f"""
+        CREATE TABLE IF NOT EXISTS {watermark_table} (
+            DESTINATION_TABLE VARCHAR,
+            META_SUBMISSIONID NUMBER,
+            REFRESHED_AT TIMESTAMP_NTZ
+        )""").collect()
+
+def _watermark_get(session, watermark_table, destination_full):
+    return session.table(watermark_table) \
+        .filter(col("DESTINATION_TABLE") == destination_full) \
+        .agg(max_("META_SUBMISSIONID")).collect()[0][0]
+
+def _is_dynamic_table(session, database, schema, table):
+    #LIKE is case-insensitive with _ as a wildcard so the name is checked too
+    rows = session.sql(
+        f"SHOW DYNAMIC TABLES LIKE '{table}' IN SCHEMA {database}.{schema}"
+    ).collect()
+    return any(row["name"] == table.upper() for row in rows)
+
+def refresh_incremental_features(transformation_func, params, session):
+    """
+    Refresh a performance table using only the records touched by new
+    submissions (META_SUBMISSIONID) since the last refresh.
+    The rows for touched records are deleted from the destination and
+    rebuilt from all base rows for those records.
+    The first refresh builds the full table.
+    transformation_func: Function to build the table from the base data
+    params: Dictionary containing the feature_dynamic_params for a script
+        (Optional)
+        - watermark_table: Table to track the latest submission processed
+    session: Snowpark session object
+    Returns:
+        - submission_id: Latest submission included in the destination
+    """
+
+    destination_full = ".".join([
+        params["destination_database"],
+        params["destination_schema"],
+        params["destination_table"],
+    ])
+
+    watermark_table = ".".join([
+        params["destination_database"],
+        params["destination_schema"],
+        params.get("watermark_table", "CWT_REFRESH_WATERMARK"),
+    ])
+
+    #The scripts create the destinations as dynamic tables, which cannot be
+    # replaced by (or written to as) a standard table
+    if _is_dynamic_table(session, params["destination_database"],
+                         params["destination_schema"],
+                         params["destination_table"]):
+        raise Exception(
+            f"{destination_full} is a dynamic table. Drop it (or use another "
+            "destination_table) before using SUBMISSION refreshes, which "
+            "build a standard table.")
+
+    _watermark_table_create(session, watermark_table)
+    watermark = _watermark_get(session, watermark_table, destination_full)
+
+    #Fix the latest submission first so the refresh is a consistent snapshot
+    df_base = base_table_load(
+        session, params, ucol.base_columns(transformation_func))
+    submission_id = df_base.agg(max_("META_SUBMISSIONID")).collect()[0][0]
+    df_base = df_base.filter(col("META_SUBMISSIONID") <= submission_id)
+
+    if watermark is not None and submission_id <= watermark:
+        print(f"{destination_full} is up to date (Submission {watermark})")
+        return watermark
+
+    if watermark is None:
+        #First refresh so build the full table
+        #(Not in the transaction as creating a table commits it)
+        df = transformation_func(df_base)
+        check_incremental(df)
+        df.write.save_as_table(
+            destination_full, mode="overwrite", comment=params["fdt_comment"])
+
+    session.sql("BEGIN").collect()
+    try:
+        if watermark is not None:
+            #Records with any row in a new submission
+            df_touched = df_base \
+                .filter(col("META_SUBMISSIONID") > watermark) \
+                .select("RECORD_ID").distinct()
+
+            #All base rows (every submission) for the touched records
+            df_changed = df_base.join(df_touched, on="RECORD_ID", how="leftsemi")
+
+            df = transformation_func(df_changed)
+            check_incremental(df)
+
+            #Replace the rows for the touched records
+            df_destination = session.table(destination_full)
+            df_destination.delete(
+                df_destination["RECORD_ID"] == df_touched["RECORD_ID"],
+                df_touched
+            )
+            df.write.save_as_table(destination_full, mode="append")
+
+        session.sql(f"""
+            INSERT INTO {watermark_table}
+            SELECT '{destination_full}', {submission_id}, CURRENT_TIMESTAMP()
+            """).collect()
+
+        session.sql("COMMIT").collect()
+    except Exception as e:
+        session.sql("ROLLBACK").collect()
+        raise e
+
+    print(f"{destination_full} refreshed to Submission {submission_id}")
+
+    return submission_id
+
+def verify_incremental_features(transformation_func, params, session):
+    """
+    Check an incrementally refreshed table matches a full rebuild of the
+    same submissions.
+    Rows are compared as a multiset so duplicate rows must also match.
+    transformation_func: Function to build the table from the base data
+    params: Dictionary containing the feature_dynamic_params for a script
+    session: Snowpark session object
+    Returns:
+        - is_match: True if the incremental table matches the full rebuild
+    """
 
-    #Create the dynamic table
     destination_full = ".".join([
         params["destination_database"],
         params["destination_schema"],
         params["destination_table"],
     ])
+
+    watermark_table = ".".join([
+        params["destination_database"],
+        params["destination_schema"],
+        params.get("watermark_table", "CWT_REFRESH_WATERMARK"),
+    ])
+
+    watermark = _watermark_get(session, watermark_table, destination_full)
+
+    #Nothing to compare until the first refresh has built the table
+    if watermark is None:
+        raise Exception(
+            f"{destination_full} has not been refreshed (No watermark in "
+            f"{watermark_table}).")
+
+    df_full = transformation_func(
+        base_table_load(
+            session, params, ucol.base_columns(transformation_func))
+        .filter(col("META_SUBMISSIONID") <= watermark)
+    )
+    df_incremental = session.table(destination_full).select(df_full.columns)
+
+    #Count each distinct row so duplicates are compared as well
+    counts_full = df_full.group_by(df_full.columns).count()
+    counts_incremental = df_incremental \
+        .group_by(df_incremental.columns).count()
+
+    rows_missing = counts_full.except_(counts_incremental).count()
+    rows_extra = counts_incremental.except_(counts_full).count()
+
+    is_match = (rows_missing == 0) and (rows_extra == 0)
+
+    if is_match:
+        print(f"{destination_full} matches a full rebuild (Submission {watermark})")
+    else:
+        print(f"{destination_full} does not match a full rebuild: "
+              f"{rows_missing} row counts missing, {rows_extra} row counts extra")
+
+    return is_match
+
+def dynamic_table_ddl(df, name, params):
+    """
+    Get the CREATE DYNAMIC TABLE statement for a dataframe.
+    This is used to submit dynamic table creation as an async job.
+    Only a plan with a single query can be submitted this way, as the
+    temporary objects created by cache_result or create_dataframe (Extra
+    queries and post actions) would not exist when the statement runs.
+    df: Snowpark dataframe containing the table definition
+    name: Full name of the dynamic table
+    params: Dictionary containing the fdt_* settings and warehouse
+    Returns:
+        - ddl: String containing the statement
+    """
+
+    queries = df.queries
+    if len(queries["queries"]) > 1 or len(queries["post_actions"]) > 0:
+        raise Exception(
+            f"The plan for {name} uses temporary objects (i.e. cache_result) "
+            "so cannot be submitted as a single statement.")
+
+    create = {
+        "overwrite": "CREATE OR REPLACE DYNAMIC TABLE",
+        "errorifexists": "CREATE DYNAMIC TABLE",
+        "ignore": "CREATE DYNAMIC TABLE IF NOT EXISTS"
+    }[params["fdt_mode"]]
+
+    comment = params["fdt_comment"].replace("'", "\\'")
+
+    return f"""{create} {name}
+        TARGET_LAG = '{params["fdt_lag"]}'
+        REFRESH_MODE = {params["fdt_refresh_mode"]}
+        INITIALIZE = {params["fdt_initialize"]}
+        WAREHOUSE = {params["warehouse"]}
+        COMMENT = '{comment}'
+        AS
+        {queries["queries"][0]}"""
+
+def create_dynamic_features(transformation_func, params, session=None,
+                            block=True):
+    """
+    Create the destination table for a transformation of the base data.
+    transformation_func: Function to build the table from the base data
+    params: Dictionary containing the feature_dynamic_params for a script
+        (Optional)
+        - fdt_lag, fdt_mode, fdt_initialize: Dynamic table settings
+        - fdt_refresh_mode: FULL, INCREMENTAL or AUTO for a dynamic table.
+            SUBMISSION refreshes a standard table with only the records
+            touched by new submissions (see refresh_incremental_features)
+        - fdt_verify: If True, check a SUBMISSION refresh against a full rebuild
+        - latest_only: If True, build from the latest version of each record
+            (See base_table_load, the index must be created first)
+    session: (Optional) Snowpark session to use instead of creating one
+        (An util_stub.OfflineSession runs the util_local version of the
+        transformation on a fixture and captures the creation locally)
+    block: If False, submit the dynamic table creation as an async job
+    Returns:
+        - job: AsyncJob for the creation if block is False, otherwise None
+    """
+
+    if session is None:
+        session = feature_session_create(params)
     
     if "fdt_lag" not in params.keys():
         params["fdt_lag"] = "24 hours"
@@ -174,13 +1142,72 @@ def create_dynamic_features(transformation_func, params):
     if "fdt_initialize" not in params.keys():
         params["fdt_initialize"] = "ON_CREATE"
 
-    
-    transformation_func(df_base).create_or_replace_dynamic_table(
-        name=destination_full,
-        warehouse=params["warehouse"],
-        lag=params["fdt_lag"],
-        comment=params["fdt_comment"],
-        mode=params["fdt_mode"],
-        refresh_mode=params["fdt_refresh_mode"],
-        initialize=params["fdt_initialize"] 
-    )
\ No newline at end of file
+    table = params["destination_table"]
+    is_offline = getattr(session, "is_offline", False)
+
+    if params["fdt_refresh_mode"] == "SUBMISSION":
+        if is_offline:
+            raise Exception("SUBMISSION refreshes cannot be run offline.")
+
+        #The incremental refresh runs several dependent statements so is
+        # always blocking
+        with trace_stage(session, table, "refresh"):
+            refresh_incremental_features(transformation_func, params, session)
+
+        if params.get("fdt_verify", False):
+            with trace_stage(session, table, "verify") as trace:
+                trace["is_match"] = verify_incremental_features(
+                    transformation_func, params, session)
+
+        return
+
+    #Create the dynamic table (Offline runs may not have a database and schema)
+    destination_full = ".".join(filter(None, [
+        params["destination_database"],
+        params["destination_schema"],
+        params["destination_table"],
+    ]))
+
+    #Build the plan and generate the SQL (Client side only, apart from
+    # describe queries to resolve the columns)
+    with trace_stage(session, table, "plan") as trace:
+        time_start = time.perf_counter()
+        if is_offline:
+            df = session.local_features(transformation_func, params)
+        else:
+            df = transformation_func(base_table_load(
+                session, params, ucol.base_columns(transformation_func)))
+        trace["plan_seconds"] = time.perf_counter() - time_start
+
+        time_start = time.perf_counter()
+        queries = df.queries["queries"]
+        trace["sql_seconds"] = time.perf_counter() - time_start
+        trace["sql_length"] = len(queries[-1])
+        trace["statements"] = len(queries)
+
+    if not block:
+        with trace_stage(session, table, "submit") as trace:
+            job = session.sql(
+                dynamic_table_ddl(df, destination_full, params)).collect_nowait()
+            trace["query_id"] = job.query_id
+        return job
+
+    with trace_stage(session, table, "create") as trace_create:
+        df.create_or_replace_dynamic_table(
+            name=destination_full,
+            warehouse=params["warehouse"],
+            lag=params["fdt_lag"],
+            comment=params["fdt_comment"],
+            mode=params["fdt_mode"],
+            refresh_mode=params["fdt_refresh_mode"],
+            initialize=params["fdt_initialize"]
+        )
+
+    with trace_stage(session, table, "sample") as trace_sample:
+        print("Sample of output:")
+        session.table(destination_full).show()
+
+    #Log the compilation, queueing and execution time of each statement (Only
+    # this table's, so building several tables does not log a query twice)
+    trace_query_history(session, query_ids=trace["query_ids"]
+                        + trace_create["query_ids"] + trace_sample["query_ids"])
@@ -0,0 +1,465 @@
+import os
+import re
+import threading
+import time
+import numpy as np
+import pyarrow as pa
+
+import utils.util_columns as ucol
+import utils.util_local as ul
+import utils.util_parquet as upq
+import utils.util_sketch as usk
+
+#Local stand-ins for a Snowflake connection so the utility functions can be
+# run and benchmarked without a warehouse
+
+def cwt_batch(batch_index, batch_size=100000):
+    """
+    Generate a batch of record-level rows shaped like a CWT_BASE extract.
+    batch_index: Index of the batch (used as the random seed and RECORD_ID offset)
+    batch_size: Number of rows in the batch
+    Returns:
+        - table: Pyarrow table containing the batch
+    """
+
+    rng = np.random.default_rng(batch_index)
+    ids = np.arange(batch_index * batch_size, (batch_index + 1) * batch_size)
+
+    referral = np.datetime64("2020-01-01") + \
+        rng.integers(0, 365 * 5, batch_size).astype("timedelta64[D]")
+
+    return pa.table({
+        "RECORD_ID": pa.array(ids.astype(str)),
+        "ORG_FIRSTSEEN_TRUST": pa.array(
+            rng.choice(["RAL", "RAN", "RAP", "RKE", "RRV", "RP4", "RP6"], batch_size)),
+        "PATHWAY_PRIORITYTYPE_CODE": pa.array(rng.integers(1, 4, batch_size)),
+        "PATHWAY_CANCERTREATMENTEVENTTYPE_CODE": pa.array(
+            rng.choice(["01", "02", "07", "12"], batch_size)),
+        "DATE_CANCERREFERRALTOTREATMENTPERIODSTARTDATE": pa.array(referral),
+        "DATE_DATEFIRSTSEEN": pa.array(
+            referral + rng.integers(0, 30, batch_size).astype("timedelta64[D]")),
+        "WTA_FIRSTSEENADJUSTMENT": pa.array(rng.integers(0, 5, batch_size)),
+        "META_SUBMISSIONID": pa.array(rng.integers(1, 60, batch_size))
+    })
+
+class LocalCursor:
+    """
+    Stand-in for a snowflake.connector cursor that returns generated batches.
+    Batches are generated lazily so only the fetch method decides how much is
+    held in memory at once.
+    """
+
+    def __init__(self, batch_func, n_batches):
+        self.batch_func = batch_func
+        self.n_batches = n_batches
+        self.query = None
+
+    def execute(self, query):
+        self.query = query
+        return self
+
+    def fetch_arrow_batches(self):
+        for batch_index in range(self.n_batches):
+            yield self.batch_func(batch_index)
+
+    def fetch_pandas_batches(self):
+        for table in self.fetch_arrow_batches():
+            yield table.to_pandas()
+
+    def fetch_arrow_all(self):
+        return pa.concat_tables(list(self.fetch_arrow_batches()))
+
+    def fetch_pandas_all(self):
+        return self.fetch_arrow_all().to_pandas()
+
+class LocalConnection:
+    """
+    Stand-in for a snowflake.connector connection (see LocalCursor).
+    """
+
+    def __init__(self, batch_func=cwt_batch, n_batches=10):
+        self.batch_func = batch_func
+        self.n_batches = n_batches
+
+    def cursor(self):
+        return LocalCursor(self.batch_func, self.n_batches)
+
+class LocalAsyncCursor:
+    """
+    Stand-in for a snowflake.connector cursor on a LocalAsyncConnection.
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.sfqid = None
+
+    def execute_async(self, query):
+        self.sfqid = self.connection.submit(query)
+        return {"queryId": self.sfqid}
+
+    def execute(self, query, params=None):
+        if query.startswith("SELECT SYSTEM$CANCEL_QUERY"):
+            self.connection.cancel(params[0])
+            return self
+
+        #Blocking execute waits for the query as the connector does
+        self.execute_async(query)
+        time.sleep(max(0, self.connection.queries[self.sfqid][1] - time.time()))
+        return self
+
+    def get_results_from_sfqid(self, query_id):
+        self.sfqid = query_id
+
+    def fetch_arrow_all(self):
+        query, end = self.connection.queries[self.sfqid]
+        if time.time() < end:
+            raise Exception(f"Query {self.sfqid} is still running.")
+        return self.connection.result_func(query)
+
+    def fetch_pandas_all(self):
+        return self.fetch_arrow_all().to_pandas()
+
+class LocalAsyncConnection:
+    """
+    Stand-in for a snowflake.connector connection whose queries take time
+    to run, to test asynchronous execution without a warehouse.
+    Each query is running for its latency after it is submitted and then
+    returns result_func(query). The most queries running at once is kept in
+    peak_running and the IDs of queries cancelled while running in cancelled.
+    result_func: Function from query to arrow table (A generated batch by default)
+    latency: Seconds each query runs for, or a function from query to seconds
+    is_error: (Optional) Function from query to True if the query should fail
+    """
+
+    def __init__(self, result_func=None, latency=1.0, is_error=None):
+        self.result_func = result_func or (lambda query: cwt_batch(0, 1000))
+        self.latency = latency if callable(latency) else (lambda query: latency)
+        self.is_error = is_error or (lambda query: False)
+        self.queries = {}
+        self.peak_running = 0
+        self.cancelled = set()
+        self.lock = threading.Lock()
+
+    def cursor(self):
+        return LocalAsyncCursor(self)
+
+    def submit(self, query):
+        #Cursors can be used from several threads (i.e. asyncio.to_thread)
+        with self.lock:
+            query_id = f"local-{len(self.queries) + 1:06d}"
+            now = time.time()
+            self.queries[query_id] = (query, now + self.latency(query))
+
+            running = sum(1 for _, end in self.queries.values() if end > now)
+            self.peak_running = max(self.peak_running, running)
+
+        return query_id
+
+    def cancel(self, query_id):
+        #SYSTEM$CANCEL_QUERY ends a running query (No effect once it has ended)
+        with self.lock:
+            query, end = self.queries[query_id]
+            now = time.time()
+            if end > now:
+                self.queries[query_id] = (query, now)
+                self.cancelled.add(query_id)
+
+    def running(self):
+        #IDs of the queries still running
+        now = time.time()
+        return [query_id for query_id, (_, end) in self.queries.items()
+                if end > now]
+
+    def get_query_status_throw_if_error(self, query_id):
+        query, end = self.queries[query_id]
+        if time.time() < end:
+            return "RUNNING"
+        if query_id in self.cancelled:
+            raise Exception(f"Query {query_id} was cancelled.")
+        if self.is_error(query):
+            raise Exception(f"Query {query_id} failed.")
+        return "SUCCESS"
+
+    def is_still_running(self, status):
+        return status == "RUNNING"
+
+def _like_regex(pattern, escape="\\"):
+    #Compile a LIKE pattern (With an escape character) to a regex
+    regex = ""
+    chars = iter(pattern)
+    for char in chars:
+        if char == escape:
+            regex += re.escape(next(chars, ""))
+        elif char == "%":
+            regex += ".*"
+        elif char == "_":
+            regex += "."
+        else:
+            regex += re.escape(char)
+    return re.compile(regex, re.DOTALL)
+
+class LocalRow(dict):
+    """
+    Stand-in for a Snowpark Row (only as_dict is used).
+    """
+
+    def as_dict(self):
+        return dict(self)
+
+class LocalQueryRecord:
+    """
+    Stand-in for a Snowpark QueryRecord.
+    """
+
+    def __init__(self, query_id, sql_text, is_describe=False):
+        self.query_id = query_id
+        self.sql_text = sql_text
+        self.is_describe = is_describe
+
+class LocalQueryHistory:
+    """
+    Stand-in for a Snowpark QueryHistory listener.
+    """
+
+    def __init__(self, session, include_describe=False):
+        self.session = session
+        self.include_describe = include_describe
+        self.queries = []
+
+    def __enter__(self):
+        self.session.listeners.append(self)
+        return self
+
+    def __exit__(self, *exc):
+        self.session.listeners.remove(self)
+
+class LocalAsyncJob:
+    """
+    Stand-in for a Snowpark AsyncJob.
+    """
+
+    def __init__(self, query_id, rows):
+        self.query_id = query_id
+        self.rows = rows
+
+    def is_done(self):
+        return True
+
+    def result(self):
+        return self.rows
+
+class LocalStatement:
+    """
+    Statement created by LocalSession.sql that is run on collect.
+    """
+
+    def __init__(self, session, query, params=None):
+        self.session = session
+        self.query = query
+        self.params = params
+
+    def collect(self):
+        return self.session.execute(self.query, self.params)[1]
+
+    def collect_nowait(self):
+        return LocalAsyncJob(*self.session.execute(self.query, self.params))
+
+class LocalSession:
+    """
+    Stand-in for a Snowpark session that records the statements it is given.
+    Each statement is logged to the history with its query tag and a fake
+    timing so the tracing functions can be run without a warehouse. Queries
+    of QUERY_HISTORY_BY_SESSION return the history.
+    """
+
+    def __init__(self, query_tag=None, execution_time=10):
+        self.query_tag = query_tag
+        self.execution_time = execution_time
+        self.history = []
+        self.listeners = []
+
+    def sql(self, query, params=None):
+        return LocalStatement(self, query, params)
+
+    def query_history(self, include_describe=False):
+        return LocalQueryHistory(self, include_describe)
+
+    def execute(self, query, params=None):
+        query_id = f"local-{len(self.history) + 1:06d}"
+
+        #Filter the history on the bound query IDs or LIKE pattern of the
+        # query tag
+        rows = []
+        if "QUERY_HISTORY_BY_SESSION" in query and "QUERY_ID IN" in query:
+            rows = [LocalRow(record) for record in self.history
+                    if record["QUERY_ID"] in params]
+        elif "QUERY_HISTORY_BY_SESSION" in query and "QUERY_TAG LIKE" in query:
+            pattern = _like_regex(params[0])
+            rows = [LocalRow(record) for record in self.history
+                    if pattern.fullmatch(record["QUERY_TAG"] or "")]
+
+        self.history.append({
+            "QUERY_ID": query_id,
+            "QUERY_TAG": self.query_tag,
+            "EXECUTION_STATUS": "SUCCESS",
+            "TOTAL_ELAPSED_TIME": self.execution_time,
+            "COMPILATION_TIME": 0,
+            "QUEUED_PROVISIONING_TIME": 0,
+            "QUEUED_OVERLOAD_TIME": 0,
+            "QUEUED_REPAIR_TIME": 0,
+            "EXECUTION_TIME": self.execution_time,
+            "BYTES_SCANNED": 0,
+            "ROWS_PRODUCED": len(rows)
+        })
+        for listener in self.listeners:
+            listener.queries.append(LocalQueryRecord(query_id, query))
+
+        return query_id, rows
+
+class OfflineFrame:
+    """
+    Stand-in for a Snowpark dataframe in an OfflineSession, holding the
+    pandas output of a local transformation.
+    Its query is a placeholder that OfflineSession resolves back to the frame
+    when a CREATE DYNAMIC TABLE statement selects from it.
+    """
+
+    def __init__(self, session, df, frame_id=None):
+        self.session = session
+        self.df = df
+        self.frame_id = frame_id
+
+    @property
+    def queries(self):
+        return {"queries": [f"SELECT * FROM OFFLINE_FRAME_{self.frame_id}"],
+                "post_actions": []}
+
+    def to_pandas(self):
+        return self.df
+
+    def count(self):
+        return len(self.df)
+
+    def show(self, n=10):
+        print(self.df.head(n).to_string())
+
+    def create_or_replace_dynamic_table(self, name, **kwargs):
+        self.session.execute(
+            f"CREATE OR REPLACE DYNAMIC TABLE {name}\n"
+            f"AS\n{self.queries['queries'][-1]}")
+
+#Local versions of the tables defined in the docs SQL scripts, from the
+# tables already built in an OfflineSession (Tables not here, i.e. CWT_BASE,
+# are not built offline)
+OFFLINE_SQL_TABLES = {
+    "CWT_PERFORMANCE": lambda tables: ul.combine_performance(
+        {table: tables[table] for table in upq.PERFORMANCE_TABLES}),
+    "CWT_PERFORMANCE_CUBE": lambda tables: ul.performance_cube(
+        tables["CWT_PERFORMANCE"]),
+    "CWT_VALUE_HISTOGRAM": lambda tables: ul.value_histogram(
+        tables["CWT_PERFORMANCE"]),
+    "CWT_VALUE_SKETCH": lambda tables: usk.value_sketch(
+        tables["CWT_PERFORMANCE"])
+}
+
+class OfflineSession(LocalSession):
+    """
+    Stand-in for a Snowpark session that builds tables from parquet fixtures
+    instead of a warehouse, so create_dynamic_features and the pipeline can
+    be run without credentials.
+    Transformations are run with their local version from util_local (Same
+    function name) and CREATE DYNAMIC TABLE statements are captured: the
+    statement is written to the output folder as <table>.sql and, if it
+    selects from an OfflineFrame, the frame is written as <table>.parquet and
+    can be read back with table(). Tables defined in the docs SQL scripts are
+    built with local_sql. Other statements are only recorded.
+    """
+
+    is_offline = True
+
+    def __init__(self, fixtures, folder="output/offline", query_tag=None):
+        super().__init__(query_tag)
+        self.fixtures = fixtures
+        self.folder = folder
+        self.tables = {}
+        self.frames = []
+
+    def table(self, name):
+        #Tables are looked up by name without the database and schema
+        name = name.split(".")[-1]
+
+        if name not in self.tables:
+            if name not in self.fixtures:
+                raise Exception(
+                    f"{name} has not been built or loaded from a fixture.")
+            self.tables[name] = ul.load_base(self.fixtures[name])
+
+        return OfflineFrame(self, self.tables[name])
+
+    def local_features(self, transformation_func, params):
+        """
+        Run the local version of a transformation on the base fixture.
+        transformation_func: Snowpark transformation (i.e. performance_2ww)
+        params: Dictionary containing the feature_dynamic_params for a script
+        Returns:
+            - df: OfflineFrame of the output
+        """
+
+        local_func = getattr(ul, transformation_func.__name__, None)
+        if local_func is None:
+            raise Exception(
+                f"{transformation_func.__name__} has no local version in "
+                "util_local so cannot be run offline.")
+
+        #Select the column contract as base_table_load does in Snowflake
+        df_base = self.table(params["base_table"]).to_pandas()
+        columns = ucol.base_columns(transformation_func)
+        if columns is not None:
+            df_base = df_base[
+                [column for column in columns if column in df_base.columns]]
+        if params.get("latest_only", False):
+            df_base = ul.filter_latest(df_base, ul.latest_index(df_base))
+
+        self.frames.append(local_func(df_base))
+
+        return OfflineFrame(self, self.frames[-1], len(self.frames) - 1)
+
+    def local_sql(self, name, query):
+        """
+        Build a table defined in a docs SQL script with its local version
+        (See OFFLINE_SQL_TABLES), capturing it as for a transformation.
+        name: Table name (i.e. CWT_PERFORMANCE)
+        query: CREATE DYNAMIC TABLE statement from the script
+        Returns:
+            - job: LocalAsyncJob of the statement
+        """
+
+        try:
+            df = OFFLINE_SQL_TABLES[name](self.tables)
+        except KeyError as e:
+            raise Exception(f"{name} needs {e} which has not been built.")
+
+        self.frames.append(df)
+
+        return LocalAsyncJob(*self.execute(
+            f"{query}\n--Built offline from OFFLINE_FRAME_{len(self.frames) - 1}"))
+
+    def execute(self, query, params=None):
+        match = re.search(
+            r"CREATE\s+(?:OR\s+REPLACE\s+)?DYNAMIC\s+TABLE\s+"
+            r"(?:IF\s+NOT\s+EXISTS\s+)?([\w.\"]+)", query, re.IGNORECASE)
+
+        if match:
+            name = match.group(1).replace('"', "").split(".")[-1]
+            os.makedirs(self.folder, exist_ok=True)
+            with open(os.path.join(self.folder, name + ".sql"), "w") as f:
+                f.write(query)
+
+            frame = re.search(r"\bOFFLINE_FRAME_(\d+)\b", query)
+            if frame:
+                df = self.frames[int(frame.group(1))]
+                df.to_parquet(
+                    os.path.join(self.folder, name + ".parquet"), index=False)
+                self.tables[name] = df
+
+        return super().execute(query, params)
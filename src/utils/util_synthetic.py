@@ -0,0 +1,434 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+import utils.util_local as ul
+
+#Generator for synthetic CWT_BASE rows so the metric builders can be tested
+# and benchmarked at scale without patient data
+#The columns follow docs/dynamic_cwt_base.sql and each referral (RECORD_ID)
+# can appear in several submissions, with the later stages of the pathway
+# only filled in by the later submissions
+
+#NCL trusts (Same list as the IS_GEO_TRUST_* flags in CWT_BASE)
+NCL_TRUSTS = ["RAL", "RAN", "RAP", "RKE", "RRV", "RP4", "RP6"]
+
+#Trusts outside NCL that NCL patients are referred to or treated at
+OTHER_TRUSTS = ["RRK", "RQM", "RJ1", "R1H", "RYJ", "RWG"]
+
+#Arrow type for each Snowflake type in CWT_BASE
+ARROW_TYPES = {
+    "VARCHAR": pa.string(),
+    "CHAR": pa.string(),
+    "NUMBER": pa.int64(),
+    "DATE": pa.date32(),
+    "BOOLEAN": pa.bool_()
+}
+
+#Primary diagnosis code: (Description, Grouping, COSD Stageable, RCRD Stageable)
+DIAGNOSES = {
+    "C50.9": ("Breast, unspecified", "Breast", True, True),
+    "C61": ("Malignant neoplasm of prostate", "Urological", True, True),
+    "C34.9": ("Bronchus or lung, unspecified", "Lung", True, True),
+    "C18.9": ("Colon, unspecified", "Lower GI", True, True),
+    "C20": ("Malignant neoplasm of rectum", "Lower GI", True, True),
+    "C43.9": ("Malignant melanoma of skin, unspecified", "Skin", True, False),
+    "C44.3": ("Skin of other and unspecified parts of face", "Skin", False, False),
+    "C16.9": ("Stomach, unspecified", "Upper GI", True, True),
+    "C25.9": ("Pancreas, unspecified", "Upper GI", True, True),
+    "C56": ("Malignant neoplasm of ovary", "Gynaecological", True, True),
+    "C67.9": ("Bladder, unspecified", "Urological", True, True),
+    "C85.9": ("Non-Hodgkin lymphoma, unspecified", "Haematological", True, False),
+    "D05.1": ("Intraductal carcinoma in situ", "Breast", False, False)
+}
+
+#Cancer referral type code: Description (16 is Breast Symptomatic)
+REFERRAL_TYPES = {
+    "01": "Suspected gynaecological cancer",
+    "02": "Suspected lower gastrointestinal cancer",
+    "03": "Suspected lung cancer",
+    "05": "Suspected skin cancer",
+    "06": "Suspected urological cancer",
+    "07": "Suspected upper gastrointestinal cancer",
+    "16": "Exhibited (non-cancer) breast symptoms",
+    "17": "Suspected breast cancer"
+}
+
+#Treatment modality code: Description
+MODALITIES = {
+    "01": "Surgery",
+    "02": "Anti-cancer drug regimen (Cytotoxic Chemotherapy)",
+    "03": "Anti-cancer drug regimen (Hormone Therapy)",
+    "04": "Teletherapy (Beam Radiation excluding Proton Therapy)",
+    "05": "Brachytherapy",
+    "06": "Chemoradiotherapy",
+    "14": "Anti-cancer drug regimen (Immunotherapy)",
+    "97": "Other treatment",
+    "98": "All treatment declined"
+}
+
+#Codes for the residence and GP fields
+LSOAS = np.array([f"E0100{i:04d}" for i in range(5000)], dtype=object)
+PRACTICES = np.array([f"F83{i:03d}" for i in range(700)], dtype=object)
+
+#Trusts as an array with None as the last entry so an index of -1 is Null
+TRUSTS = np.array(NCL_TRUSTS + OTHER_TRUSTS + [None], dtype=object)
+
+#Site codes are the trust code followed by a 2 digit site number
+SITES = np.array(
+    [[None if t is None else f"{t}{i:02d}" for i in range(1, 4)] for t in TRUSTS],
+    dtype=object)
+
+def _choice(rng, values, n_rows, p=None, null_rate=0.0):
+    #Random values (as an object array) with a share of Null values
+    picked = np.array(values, dtype=object)[
+        rng.choice(len(values), n_rows, p=p)]
+    if null_rate > 0:
+        picked[rng.random(n_rows) < null_rate] = None
+    return picked
+
+def _after(rng, dates, mean_days, n_rows, null_rate=0.0):
+    #Dates a gamma distributed number of days after dates (NaT stays NaT)
+    days = rng.gamma(2.0, mean_days / 2.0, n_rows).astype("int64")
+    later = dates + days.astype("timedelta64[D]")
+    if null_rate > 0:
+        later[rng.random(n_rows) < null_rate] = np.datetime64("NaT")
+    return later
+
+def _trust(rng, n_rows, null_rate=0.0):
+    #Trust indices (into TRUSTS) weighted towards the NCL trusts
+    p = np.array([0.12] * len(NCL_TRUSTS) + [0.02] * len(OTHER_TRUSTS))
+    index = rng.choice(len(p), n_rows, p=p / p.sum())
+    if null_rate > 0:
+        index[rng.random(n_rows) < null_rate] = -1
+    return index
+
+def _ids(prefix, numbers):
+    #String identifiers built in arrow as it is much faster than NumPy
+    return pc.binary_join_element_wise(
+        prefix, pa.array(numbers).cast(pa.string()), "")
+
+def _is_ncl(trust_index):
+    #Equivalent of ORG_TRUST IN (...) where a Null org gives a Null flag
+    return pa.array(trust_index < len(NCL_TRUSTS), mask=trust_index < 0)
+
+def cwt_base_chunk(n_rows, seed=0, chunk_index=0, start_date="2020-01-01",
+                   years=5, row_start=0):
+    """
+    Generate a chunk of synthetic CWT_BASE rows.
+    Chunks are independent so large extracts can be generated a chunk at a
+    time. IDs are unique across chunks that do not overlap in
+    [row_start, row_start + n_rows).
+    n_rows: Number of rows in the chunk
+    seed: Random seed (combined with chunk_index)
+    chunk_index: Index of the chunk
+    start_date: Earliest referral date
+    years: Number of years of referrals after start_date
+    row_start: Position of the first row of the chunk in the whole extract
+        (Offsets the IDs, a chunk has no more records than rows)
+    Returns:
+        - table: Pyarrow table with the CWT_BASE columns
+    """
+
+    rng = np.random.default_rng([seed, chunk_index])
+
+    #Submissions per referral (Most referrals are only submitted once)
+    n_submissions = rng.choice([1, 2, 3], n_rows, p=[0.75, 0.18, 0.07])
+    total = np.cumsum(n_submissions)
+    n = int(np.searchsorted(total, n_rows)) + 1
+    n_submissions = n_submissions[:n]
+    n_submissions[-1] -= total[n - 1] - n_rows
+
+    #Referral level fields########################################
+
+    #Pathway identifiers
+    priority = rng.choice([1, 2, 3], n, p=[0.15, 0.1, 0.75])
+    source = np.where(
+        (priority == 2) & (rng.random(n) < 0.9), "17",
+        _choice(rng, ["03", "01", "02", "92"], n, p=[0.85, 0.05, 0.05, 0.05]))
+    event_type = _choice(
+        rng, ["01", "02", "03", "04", "05", "06", "07", "08", "12"], n,
+        p=[0.55, 0.14, 0.08, 0.06, 0.04, 0.03, 0.05, 0.02, 0.03])
+    diagnosis = _choice(rng, list(DIAGNOSES), n, null_rate=0.02)
+    referral_type = _choice(rng, list(REFERRAL_TYPES), n, null_rate=0.03)
+    modality = _choice(
+        rng, list(MODALITIES), n,
+        p=[0.3, 0.15, 0.12, 0.15, 0.03, 0.05, 0.08, 0.07, 0.05])
+
+    #Date chain (Referral -> First Seen -> FDS -> Transfer -> Treatment)
+    start = np.datetime64(start_date, "D")
+    referral = start + rng.integers(0, 365 * years, n).astype("timedelta64[D]")
+    decision_to_refer = referral - rng.integers(0, 4, n).astype("timedelta64[D]")
+    first_seen = _after(rng, referral, 12, n, null_rate=0.04)
+    fds_end = _after(rng, first_seen, 18, n, null_rate=0.08)
+
+    #Consultant upgrades are only for non-USC referrals
+    has_upgrade = (priority != 3) & (rng.random(n) < 0.25)
+    upgrade = np.where(
+        has_upgrade,
+        first_seen + rng.integers(-7, 21, n).astype("timedelta64[D]"),
+        np.datetime64("NaT"))
+
+    #Only referrals with a cancer diagnosis go on to treatment
+    is_treated = rng.random(n) < 0.4
+    transfer = _after(rng, np.maximum(first_seen, fds_end), 14, n, null_rate=0.1)
+    transfer = np.where(is_treated, transfer, np.datetime64("NaT"))
+    treatment = np.where(
+        is_treated,
+        _after(rng, np.where(np.isnat(transfer), fds_end, transfer), 20, n),
+        np.datetime64("NaT"))
+    treatment_period = treatment - rng.gamma(2.0, 10.0, n).astype(
+        "int64").astype("timedelta64[D]")
+
+    #Subsequent treatments do not always have the referral dates
+    is_subsequent = np.isin(event_type, ["02", "03", "04", "05", "06", "08"])
+    no_referral = is_subsequent & (rng.random(n) < 0.5)
+    referral = np.where(no_referral, np.datetime64("NaT"), referral)
+    first_seen = np.where(no_referral, np.datetime64("NaT"), first_seen)
+
+    #Waiting time adjustments
+    adj_first_seen = rng.choice([0, 3, 7], n, p=[0.8, 0.1, 0.1])
+    adj_treatment = rng.choice([0, 5, 14], n, p=[0.8, 0.1, 0.1])
+    adj_reason = np.where(
+        adj_treatment > 0,
+        _choice(rng, ["Patient declined", "Patient unavailable"], n), None)
+
+    #Organisations (Treatment is often at the first seen trust (Solo) and
+    # the investigating provider is only sometimes recorded (5050 vs 6S))
+    first_seen_trust = _trust(rng, n, null_rate=0.02)
+    treating_trust = np.where(
+        rng.random(n) < 0.6, first_seen_trust, _trust(rng, n))
+    treating_trust = np.where(is_treated, treating_trust, -1)
+    investigating_trust = np.where(
+        rng.random(n) < 0.5, -1,
+        np.where(rng.random(n) < 0.5, first_seen_trust, _trust(rng, n)))
+    upgrade_trust = np.where(has_upgrade, _trust(rng, n), -1)
+    fds_trust = np.where(
+        rng.random(n) < 0.8, first_seen_trust, _trust(rng, n))
+
+    #Residence and GP
+    icbs = ["QMJ", "QRV", "QWE", "QKK"]
+    reg_icb = _choice(rng, icbs, n, p=[0.85, 0.06, 0.05, 0.04])
+    res_icb = np.where(rng.random(n) < 0.95, reg_icb, _choice(rng, icbs, n))
+
+    record = {
+        "RECORD_ID": row_start + np.arange(n),
+        "PSUEDO_NHS_ID": rng.integers(0, 10 ** 9, n),
+        "ORG_ACCOUNTABLEINVESTIGATING_TRUST": investigating_trust,
+        "ORG_CONSULTANTUPGRADE_TRUST": upgrade_trust,
+        "ORG_FIRSTSEEN_TRUST": first_seen_trust,
+        "ORG_FDPEND_TRUST": fds_trust,
+        "ORG_ACCOUNTABLETREATING_TRUST": treating_trust,
+        "SITE_NUMBER": rng.integers(0, 3, (n, 4)),
+        "CWT_PRIMARYDIAGNOSIS_CODE": diagnosis,
+        "CWT_CANCERREFERALTYPE_CODE": referral_type,
+        "CWT_PATIENTSTATUS_CODE": _choice(
+            rng, ["03", "07", "08", "14", "15", "21"], n),
+        "REG_ICB_CODE": reg_icb,
+        "REG_PRACTICE_CODE": PRACTICES[rng.integers(0, len(PRACTICES), n)],
+        "RES_ICB_CODE": res_icb,
+        "RES_LA_CODE": _choice(
+            rng, ["E09000003", "E09000007", "E09000010", "E09000014",
+                  "E09000019"], n),
+        "RES_LSOA": LSOAS[rng.integers(0, len(LSOAS), n)],
+        "PATHWAY_PRIORITYTYPE_CODE": priority,
+        "PATHWAY_CANCERTREATMENTEVENTTYPE_CODE": event_type,
+        "PATHWAY_SOURCEOFREFERRALFOROUTPATIENT_CODE": source,
+        "PATHWAY_CANCERTREATMENTMODALITY_CODE": modality,
+        "PATHWAY_CANCERCARESETTINGTREATMENT_CODE": _choice(
+            rng, ["01", "02", "03", "04"], n, p=[0.4, 0.3, 0.2, 0.1]),
+        "PATHWAY_FDPENDREASON_CODE": _choice(
+            rng, ["01", "02", "03", "04"], n, p=[0.6, 0.3, 0.05, 0.05],
+            null_rate=0.1),
+        "PATHWAY_FDPEXCLUSIONREASON_CODE": _choice(
+            rng, ["01", "02", "03"], n, null_rate=0.9),
+        "PATHWAY_FDPOUTCOMEMETHOD_CODE": _choice(
+            rng, ["01", "02", "03", "04"], n, null_rate=0.1),
+        "PATHWAY_FDPOUTCOMEPROFTYPE_CODE": _choice(
+            rng, ["01", "02", "03"], n, null_rate=0.1),
+        "DATE_DECISIONTOREFERDATE": decision_to_refer,
+        "DATE_CANCERREFERRALTOTREATMENTPERIODSTARTDATE": referral,
+        "DATE_CONSULTANTUPGRADEDATE": upgrade,
+        "DATE_DATEFIRSTSEEN": first_seen,
+        "DATE_FDSPATHWAYENDDATE": fds_end,
+        "DATE_TRANSFERTOTREATMENTDATE": transfer,
+        "DATE_CANCERTREATMENTPERIODSTARTDATE": treatment_period,
+        "DATE_TREATMENTSTARTDATE": treatment,
+        "WTA_FIRSTSEENADJUSTMENT": adj_first_seen,
+        "WTA_TREATMENTADJUSTMENT": adj_treatment,
+        "WTA_TREATMENTREASON": adj_reason
+    }
+
+    #Expand to one row per submission#############################
+    rows = np.repeat(np.arange(n), n_submissions)
+    row = {column: values[rows] for column, values in record.items()}
+
+    #Submission number for the referral (0 for the first submission)
+    submission = np.arange(n_rows) - np.repeat(total[:n] - n_submissions, n_submissions)
+    pending = submission < n_submissions[rows] - 1
+
+    #Submissions are monthly and follow the referral date
+    month_index = (
+        row["DATE_DECISIONTOREFERDATE"].astype("datetime64[M]") -
+        start.astype("datetime64[M]")
+    ).astype("int64")
+    row["META_SUBMISSIONID"] = month_index + submission + 1
+
+    #Earlier submissions have not yet recorded the treatment
+    for column in ["DATE_TRANSFERTOTREATMENTDATE",
+                   "DATE_CANCERTREATMENTPERIODSTARTDATE",
+                   "DATE_TREATMENTSTARTDATE"]:
+        row[column][pending] = np.datetime64("NaT")
+    row["ORG_ACCOUNTABLETREATING_TRUST"][pending] = -1
+
+    #Organisation codes from the trust indices
+    site_number = row.pop("SITE_NUMBER")
+    for i, org in enumerate(["CONSULTANTUPGRADE", "FIRSTSEEN", "FDPEND",
+                             "ACCOUNTABLETREATING"]):
+        trust_index = row[f"ORG_{org}_TRUST"]
+        row[f"ORG_{org}_SITE"] = SITES[trust_index, site_number[:, i]]
+    trust_index = {
+        column: row[column] for column in row if column.endswith("_TRUST")}
+    for column, index in trust_index.items():
+        row[column] = TRUSTS[index]
+    row["ORG_PATIENTPATHWAYIDENTIFIERISSUER_TRUST"] = \
+        row["ORG_FIRSTSEEN_TRUST"]
+
+    #Identifiers
+    row["SK_CWT_ID"] = _ids("S", row_start + np.arange(n_rows))
+    row["RECORD_ID"] = _ids("R", row["RECORD_ID"])
+    row["PSUEDO_NHS_ID"] = _ids("P", row["PSUEDO_NHS_ID"])
+
+    #Reference fields looked up from the codes
+    for i, field in enumerate(["DESC", "GROUPING", "COSD_STAGEABLE",
+                               "RCRD_STAGEABLE"]):
+        lookup = pd.Series({code: values[i] for code, values in DIAGNOSES.items()})
+        row[f"CWT_PRIMARYDIAGNOSIS_{field}"] = \
+            lookup.reindex(row["CWT_PRIMARYDIAGNOSIS_CODE"]).to_numpy()
+    for field in ["COSD_STAGEABLE", "RCRD_STAGEABLE"]:
+        row[f"CWT_PRIMARYDIAGNOSIS_{field}"] = \
+            row[f"CWT_PRIMARYDIAGNOSIS_{field}"] == True
+    row["CWT_CANCERREFERALTYPE_DESC"] = pd.Series(REFERRAL_TYPES).reindex(
+        row["CWT_CANCERREFERALTYPE_CODE"]).to_numpy()
+    row["CWT_MODALITY_DESC"] = pd.Series(MODALITIES).reindex(
+        row["PATHWAY_CANCERTREATMENTMODALITY_CODE"]).to_numpy()
+
+    #Geo and event flags derived as in CWT_BASE
+    row["IS_GEO_GP"] = row["REG_ICB_CODE"] == "QMJ"
+    row["IS_GEO_RESIDENCE"] = row["RES_ICB_CODE"] == "QMJ"
+    for flag, column in [
+            ("DATEFIRSTSEEN", "FIRSTSEEN"),
+            ("FDS", "FDPEND"),
+            ("TREATMENTSTARTDATE", "ACCOUNTABLETREATING"),
+            ("ACCOUNTABLEINVESTIGATING", "ACCOUNTABLEINVESTIGATING"),
+            ("CONSULTANTUPGRADE", "CONSULTANTUPGRADE")]:
+        row[f"IS_GEO_TRUST_{flag}"] = _is_ncl(trust_index[f"ORG_{column}_TRUST"])
+    row["IS_GEO_TRUST"] = np.isin(
+        np.stack([trust_index["ORG_FIRSTSEEN_TRUST"],
+                  trust_index["ORG_FDPEND_TRUST"],
+                  trust_index["ORG_ACCOUNTABLETREATING_TRUST"]]),
+        np.arange(len(NCL_TRUSTS))).any(axis=0)
+    for flag, column in [
+            ("DATEFIRSTSEEN", "DATE_DATEFIRSTSEEN"),
+            ("CANCERTREATMENTPERIOD", "DATE_CANCERTREATMENTPERIODSTARTDATE"),
+            ("FDS", "DATE_FDSPATHWAYENDDATE"),
+            ("TREATMENTSTARTDATE", "DATE_TREATMENTSTARTDATE")]:
+        row[f"IS_EVENT_{flag}"] = ~np.isnat(row[column])
+
+    #Metric eligibility derived as in CWT_BASE
+    row["CWT_ELIGIBILITY"] = ul.base_eligibility(pd.DataFrame(row))
+
+    schema = base_arrow_schema()
+
+    return pa.table(
+        [pa.array(row[field.name], type=field.type, from_pandas=True)
+         for field in schema],
+        schema=schema)
+
+def base_arrow_schema():
+    """
+    Get the CWT_BASE columns as a pyarrow schema.
+    Returns:
+        - schema: Pyarrow schema with a field per CWT_BASE column
+    """
+
+    return pa.schema([
+        (column, ARROW_TYPES[sql_type.split("(")[0]])
+        for column, sql_type in ul.base_schema().items()
+    ])
+
+def organisation():
+    """
+    Get the synthetic organisation dimension (Shaped like CWT_ORGANISATION).
+    Each trust maps to itself and to each of its sites.
+    Returns:
+        - df: Pandas dataframe with ORG_SITE, ORG_TRUST, IS_NCL and ORG_VERSION
+    """
+
+    trusts = TRUSTS[:-1]
+    sites = SITES[:-1]
+
+    df = pd.DataFrame({
+        "ORG_SITE": np.concatenate([trusts, sites.ravel()]),
+        "ORG_TRUST": np.concatenate([trusts, np.repeat(trusts, sites.shape[1])])
+    })
+    df["IS_NCL"] = df["ORG_TRUST"].isin(NCL_TRUSTS)
+    df["ORG_VERSION"] = int(
+        pd.util.hash_pandas_object(df, index=False).sum() % 2**62)
+
+    return df
+
+def cwt_base(n_rows, seed=0, chunk_rows=1000000):
+    """
+    Generate synthetic CWT_BASE rows in memory.
+    n_rows: Number of rows to generate
+    seed: Random seed
+    chunk_rows: Number of rows generated at a time
+    Returns:
+        - df: Pandas dataframe with the CWT_BASE columns
+    """
+
+    table = pa.concat_tables([
+        cwt_base_chunk(min(chunk_rows, n_rows - start), seed, i,
+                       row_start=start)
+        for i, start in enumerate(range(0, n_rows, chunk_rows))
+    ])
+
+    assert pc.count_distinct(table["SK_CWT_ID"]).as_py() == table.num_rows, \
+        "SK_CWT_ID is not unique"
+
+    return table.to_pandas(date_as_object=False)
+
+def write_cwt_base(path, n_rows, seed=0, chunk_rows=1000000):
+    """
+    Write synthetic CWT_BASE rows to a parquet file a chunk at a time so the
+    extract can be much larger than memory (i.e. 100M rows).
+    Each chunk is written as its own row group.
+    path: Path of the parquet file to write
+    n_rows: Number of rows to generate
+    seed: Random seed
+    chunk_rows: Number of rows generated and written at a time
+    Returns:
+        - path: Path of the parquet file
+    """
+
+    folder = os.path.dirname(path)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+
+    schema = base_arrow_schema()
+
+    #Write to a temporary file first so an interrupted run is not reused
+    with pq.ParquetWriter(path + ".tmp", schema) as writer:
+        for i, start in enumerate(range(0, n_rows, chunk_rows)):
+            writer.write_table(
+                cwt_base_chunk(min(chunk_rows, n_rows - start), seed, i,
+                               row_start=start))
+
+    os.replace(path + ".tmp", path)
+
+    return path
@@ -0,0 +1,5 @@
+import os
+import sys
+
+#The scripts import the utilities as utils.* from the src folder
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
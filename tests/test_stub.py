@@ -0,0 +1,22 @@
+import pytest
+
+import utils.util_snowflake as us
+import utils.util_stub as stub
+
+#Checks of the utility functions against the local stand-ins for Snowflake
+# (See utils/util_stub.py)
+
+def test_pull_data_concurrent_cancels_on_error():
+    #The first query fails after 0.1s while the others would run for 5s, so
+    # the batch must cancel them rather than leave them in the warehouse
+    connection = stub.LocalAsyncConnection(
+        latency=lambda query: 0.1 if query == "0" else 5.0,
+        is_error=lambda query: query == "0")
+
+    with pytest.raises(Exception):
+        us.pull_data_concurrent(
+            [str(i) for i in range(8)], connection=connection,
+            max_concurrent=4, poll_interval=0.05)
+
+    assert len(connection.cancelled) > 0
+    assert connection.running() == []